@@ -0,0 +1,282 @@
+# incident_headless.py
+#
+# Headless entry point for batch workers and scripts. Imports the report
+# pipeline without Streamlit; python-docx / pandas / matplotlib load lazily on
+# first use.
+#
+#   python incident_headless.py generate incident.json --out report.docx \
+#       [--edr export.csv] [--survey survey.csv] [--images a.png b.jpg]
+#   python incident_headless.py analytics [--by rig] [--rebuild] [--out rollup.csv]
+#   python incident_headless.py fleet --since 2025-01 --until 2025-03 --out fleet.docx
+#   python incident_headless.py blobs [--delete-job ID ...] [--gc]
+#   python incident_headless.py watch /shared/incidents [--once] [--debounce-s 30]
+#   python incident_headless.py rerender [--workers 8] [--force] [--dry-run]
+#   python incident_headless.py import-budget
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import streamlit_incident_builder as sib
+
+
+# Cold import of streamlit_incident_builder must stay under this (seconds).
+IMPORT_BUDGET_S = 0.3
+
+# None of these may be imported just by importing the pipeline module.
+LAZY_MODULES = ["streamlit", "docx", "pandas", "matplotlib", "requests"]
+
+
+def generate_report_files(incident_path: str, out_path: str, api_key: str, model: str,
+                          edr_path=None, image_paths=None, force: bool = False, survey_path=None,
+                          profile_memory: bool = None, memory_budget_mb: float = None) -> dict:
+    """
+    Load an incident JSON (same shape as the mock user_data dicts), run the
+    pipeline and write the .docx to out_path. Returns the pipeline result.
+    Pre-flight errors raise ValueError unless force. profile_memory /
+    memory_budget_mb are passed to run_report_pipeline.
+    """
+    with open(incident_path, "r", encoding="utf-8") as fh:
+        user_data = json.load(fh)
+
+    if edr_path:
+        sib.attach_edr_export(user_data, edr_path)
+    if survey_path:
+        user_data["survey"] = sib.parse_survey(survey_path)
+
+    images = sib.encode_image_files(image_paths or [])
+    result = sib.run_report_pipeline(
+        user_data, api_key=api_key, model=model, images=images, skip_preflight=force,
+        profile_memory=profile_memory, memory_budget_mb=memory_budget_mb,
+    )
+    with open(out_path, "wb") as fh:
+        fh.write(result["docx_bytes"].getvalue())
+    return result
+
+
+def measure_cold_import():
+    """
+    Import the pipeline in a fresh interpreter. Returns (seconds, the
+    LAZY_MODULES that got imported along with it).
+    """
+    probe = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import streamlit_incident_builder\n"
+        "elapsed = time.perf_counter() - t\n"
+        f"eager = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n"
+        "print(elapsed)\n"
+        "print(','.join(eager))\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        [sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(out[0]), [m for m in (out[1].split(",") if len(out) > 1 else []) if m]
+
+
+def check_import_budget(budget_s: float = IMPORT_BUDGET_S) -> int:
+    """
+    Cold-import the pipeline and fail (non-zero exit) if it exceeds the
+    budget or eagerly imports any of LAZY_MODULES.
+    """
+    elapsed, eager = measure_cold_import()
+    print(f"cold import: {elapsed * 1000:.0f} ms (budget {budget_s * 1000:.0f} ms)")
+    if eager:
+        print(f"FAIL: eagerly imported {', '.join(eager)}")
+        return 1
+    if elapsed > budget_s:
+        print("FAIL: import budget exceeded")
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Headless incident report builder")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Generate a .docx report from an incident JSON file")
+    gen.add_argument("incident", help="Incident JSON (user_data shape)")
+    gen.add_argument("--out", required=True, help="Output .docx path")
+    gen.add_argument("--edr", help="Pason EDR CSV / ASCII export")
+    gen.add_argument("--survey", help="Directional survey CSV (MD + TVD, or MD + Inc + Azi)")
+    gen.add_argument("--images", nargs="*", default=[], help="Appendix images")
+    gen.add_argument("--model", default=sib.DEFAULT_GROK_MODEL)
+    gen.add_argument("--api-key", default=os.environ.get("GROK_API_KEY", ""))
+    gen.add_argument("--force", action="store_true", help="Generate despite pre-flight errors")
+    gen.add_argument("--profile-memory", action="store_true", default=None,
+                     help="Print peak / retained memory per pipeline stage")
+    gen.add_argument("--memory-budget-mb", type=float, help="Abort if a stage's traced peak exceeds this")
+
+    budget = sub.add_parser("import-budget", help="Fail if cold import regresses")
+    budget.add_argument("--budget-s", type=float, default=IMPORT_BUDGET_S)
+
+    analytics = sub.add_parser("analytics", help="Export incident rollups as CSV")
+    analytics.add_argument("--by", choices=sib.ANALYTICS_DIMENSIONS, default="rig")
+    analytics.add_argument("--out", help="CSV path (default: stdout)")
+    analytics.add_argument("--rebuild", action="store_true", help="Recompute from stored reports first")
+
+    fleet = sub.add_parser("fleet", help="Fleet summary .docx over stored incidents (map-reduce)")
+    fleet.add_argument("--out", required=True, help="Output .docx path")
+    fleet.add_argument("--since", help="First report month, YYYY-MM")
+    fleet.add_argument("--until", help="Last report month, YYYY-MM")
+    fleet.add_argument("--batch-size", type=int, default=sib.FLEET_BATCH_SIZE)
+    fleet.add_argument("--concurrency", type=int, default=sib.FLEET_CONCURRENCY)
+    fleet.add_argument("--model", default=sib.DEFAULT_GROK_MODEL)
+    fleet.add_argument("--api-key", default=os.environ.get("GROK_API_KEY", ""))
+
+    blobs = sub.add_parser("blobs", help="Blob store stats, job deletion and garbage collection")
+    blobs.add_argument("--delete-job", nargs="*", default=[], metavar="JOB_ID",
+                       help="Delete these jobs and release their blobs")
+    blobs.add_argument("--gc", action="store_true", help="Delete unreferenced blobs")
+    blobs.add_argument("--grace-s", type=float, default=sib.BLOB_GC_GRACE_S,
+                       help="Keep unreferenced blobs younger than this")
+
+    watch = sub.add_parser("watch", help="Queue draft reports from per-CIR folders dropped into a directory")
+    watch.add_argument("watch_dir", help="Folder to watch (one sub-folder or CIR_ file prefix per incident)")
+    watch.add_argument("--once", action="store_true", help="Drain the current backlog, then exit")
+    watch.add_argument("--debounce-s", type=float, default=sib.WATCH_DEBOUNCE_S,
+                       help="A group must be unchanged this long before ingestion")
+    watch.add_argument("--poll-s", type=float, default=sib.WATCH_POLL_S)
+    watch.add_argument("--workers", type=int, default=sib.JOB_WORKERS, help="Concurrent report generations")
+    watch.add_argument("--max-inflight", type=int, help="Drafts queued at once (default 2 x workers)")
+    watch.add_argument("--force", action="store_true", help="Queue drafts despite pre-flight errors")
+    watch.add_argument("--retry-failed", action="store_true", help="Re-ingest groups whose draft failed")
+    watch.add_argument("--model", default=sib.DEFAULT_GROK_MODEL)
+    watch.add_argument("--api-key", default=os.environ.get("GROK_API_KEY", ""))
+
+    rerender = sub.add_parser("rerender", help="Re-render stored reports after template / styling changes (no Grok)")
+    rerender.add_argument("--workers", type=int, default=sib.RERENDER_WORKERS, help="Worker processes")
+    rerender.add_argument("--force", action="store_true", help="Re-render every report, not just stale ones")
+    rerender.add_argument("--dry-run", action="store_true", help="Only count stale reports")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        if not args.api_key:
+            parser.error("set GROK_API_KEY or pass --api-key")
+        t = time.perf_counter()
+        try:
+            result = generate_report_files(
+                args.incident, args.out, api_key=args.api_key, model=args.model,
+                edr_path=args.edr, image_paths=args.images, force=args.force, survey_path=args.survey,
+                profile_memory=args.profile_memory, memory_budget_mb=args.memory_budget_mb,
+            )
+        except ValueError as e:
+            if not hasattr(e, "preflight"):
+                raise
+            for issue in e.preflight:
+                print(f"ERROR: {issue['message']}")
+            print("pre-flight check failed; fix the incident or pass --force")
+            return 1
+        except RuntimeError as e:
+            if not hasattr(e, "memory_profile"):
+                raise
+            print(f"ERROR: {e}")
+            return 1
+        size_mb, size_warning = sib.check_docx_size(result["docx_bytes"])
+        print(f"wrote {args.out} ({size_mb} MB) in {time.perf_counter() - t:.1f} s")
+        if size_warning:
+            print(f"WARNING: {size_warning}")
+        if result["memory_profile"]:
+            for stage in result["memory_profile"]["stages"]:
+                print(f"  {stage['stage']:<36} peak {stage['peak_mb']:>8} MB  retained {stage['retained_mb']:>8} MB")
+        return 0
+
+    if args.command == "analytics":
+        if args.rebuild:
+            print(f"rebuilt analytics from {sib.rebuild_analytics()} incidents", file=sys.stderr)
+        df = sib.rollup_frame(sib.load_rollups(), args.by)
+        if args.out:
+            df.to_csv(args.out)
+        else:
+            print(df.to_csv(), end="")
+        return 0
+
+    if args.command == "fleet":
+        if not args.api_key:
+            parser.error("set GROK_API_KEY or pass --api-key")
+        incidents = sib.fleet_incidents(since=args.since, until=args.until)
+        if not incidents:
+            print("no finished reports in that period")
+            return 1
+        fleet = sib.summarise_fleet(
+            incidents, args.api_key, args.model, batch_size=args.batch_size, concurrency=args.concurrency,
+            progress=lambda done, total: print(f"\rsummarised {done}/{total}", end="", file=sys.stderr),
+        )
+        print(file=sys.stderr)
+        with open(args.out, "wb") as fh:
+            fh.write(sib.build_fleet_docx(fleet, incidents).getvalue())
+        print(
+            f"wrote {args.out}: {len(incidents)} incidents, {fleet['calls']} Grok calls "
+            f"({fleet['cached_calls']} cached, {fleet['failed_calls']} failed), "
+            f"~{fleet['est_tokens']} tokens, {fleet['elapsed_s']} s"
+        )
+        return 0
+
+    if args.command == "blobs":
+        store = sib.BlobStore()
+        if args.delete_job:
+            queue = sib.ReportJobQueue(max_workers=1)
+            for job_id in args.delete_job:
+                queue.delete(job_id)
+        if args.gc:
+            print(f"gc: {store.gc(grace_s=args.grace_s)}")
+        print(f"blob store: {store.stats()}")
+        return 0
+
+    if args.command == "watch":
+        if not args.api_key:
+            parser.error("set GROK_API_KEY or pass --api-key")
+        ingestor = sib.WatchFolderIngestor(
+            args.watch_dir, sib.ReportJobQueue(max_workers=args.workers), args.api_key, args.model,
+            debounce_s=args.debounce_s, max_inflight=args.max_inflight or 2 * args.workers,
+            force=args.force, retry_failed=args.retry_failed,
+        )
+
+        def log(counts):
+            if counts["queued"] or counts["rejected"] or counts["finished"]:
+                print(
+                    f"{datetime.now():%H:%M:%S} {counts['groups']} groups: {counts['queued']} queued, "
+                    f"{counts['rejected']} rejected, {counts['finished']} finished, "
+                    f"{counts['inflight']} in flight, {counts['pending']} pending"
+                )
+
+        try:
+            ingestor.run(poll_s=args.poll_s, once=args.once, on_tick=log)
+        except KeyboardInterrupt:
+            pass
+        state = ingestor.state()
+        for status in ("done", "failed", "rejected", "queued"):
+            print(f"{status}: {sum(1 for rec in state.values() if rec.get('status') == status)}")
+        return 0
+
+    if args.command == "rerender":
+        summary = sib.rerender_reports(
+            workers=args.workers, force=args.force, dry_run=args.dry_run,
+            progress=lambda done, total: print(f"\rre-rendered {done}/{total}", end="", file=sys.stderr),
+        )
+        if summary["stale"] and not args.dry_run:
+            print(file=sys.stderr)
+        for job_id, error in summary["errors"].items():
+            print(f"ERROR {job_id}: {error}")
+        print(
+            f"{summary['checked']} reports, {summary['stale']} stale"
+            + ("" if args.dry_run else
+               f": {summary['text']} text + docx, {summary['docx']} docx only, {summary['failed']} failed")
+            + f" in {summary['elapsed_s']} s"
+        )
+        return 1 if summary["failed"] else 0
+
+    if args.command == "import-budget":
+        return check_import_budget(args.budget_s)
+
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,31 @@
 # streamlit_incident_builder.py
+#
+# Heavy dependencies (streamlit, requests, python-docx, pandas, matplotlib) are
+# imported inside the functions that use them, so the pipeline can be imported
+# cheaply by batch workers / incident_headless.py without pulling in the UI.
 
-import streamlit as st
-import requests
 import json
 import base64
+import copy
+import hashlib
+import html
+import mimetypes
+import os
+import re
+import shutil
+import string
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
 from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timezone
 
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.style import WD_STYLE_TYPE
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import numpy as np
 
 
 # ============================================================
@@ -18,6 +33,17 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 # ============================================================
 DEFAULT_GROK_MODEL = "grok-4-fast-reasoning"  # adjust to your deployed model
 
+# Local working data (EDR cache etc.). Override with INCIDENT_BUILDER_DATA_DIR.
+DATA_DIR = os.environ.get("INCIDENT_BUILDER_DATA_DIR", ".incident_builder")
+EDR_CACHE_DIR = os.path.join(DATA_DIR, "edr_cache")
+CHART_CACHE_DIR = os.path.join(DATA_DIR, "chart_cache")
+GROK_METRICS_PATH = os.path.join(DATA_DIR, "grok_metrics.jsonl")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+ANALYTICS_DIR = os.path.join(DATA_DIR, "analytics")
+MEMORY_METRICS_PATH = os.path.join(DATA_DIR, "memory_metrics.jsonl")
+FLEET_CACHE_DIR = os.path.join(DATA_DIR, "fleet_cache")
+
 
 # ============================================================
 # MOCK INCIDENTS (so you don't have to type everything)
@@ -194,6 +220,8 @@ def cause_incorrect_pumping_volume(data):
     fcp = data.get("fcp_mpa", "N/A")
     bump = data.get("bump_pressure_mpa", "N/A")
     bled = data.get("bledoff_to_mpa", "N/A")
+    mc = data.get("uncertainty")
+    mc_text = f"\n\n{describe_displacement_uncertainty(mc)}" if mc else ""
 
     return f"""Incorrect Pumping Volumes & Leak Above Float Collar
 
@@ -201,7 +229,7 @@ Review of drilling reports, cement charts, and Pason EDR data shows that the cor
 
 API 5CT allows tolerance on pipe wall thickness, which can change actual casing volume versus nominal min/max. If you pump only the nominal volume with no allowance for tolerance, aeration, and compressibility, the plug might not fully land and latch.
 
-Given the Pason / cement data, it appears the correct volume was displaced and a partial bump was observed. We do not believe total displacement volume is the cause of the incident.
+Given the Pason / cement data, it appears the correct volume was displaced and a partial bump was observed. We do not believe total displacement volume is the cause of the incident.{mc_text}
 """.strip()
 
 
@@ -212,6 +240,10 @@ def cause_compressibility_ballooning(data, compressibility_outcome: str):
 
     calc_theoretical_L = "200"
     calc_thermal_L = "50"
+    mc = data.get("uncertainty")
+    if mc:
+        calc_theoretical_L = f"{mc['compression_L']['p50']:.0f}"
+        calc_thermal_L = f"{mc['thermal_L']['p50']:.0f}"
 
     if compressibility_outcome == "plausible":
         conclusion = (
@@ -229,9 +261,14 @@ def cause_compressibility_ballooning(data, compressibility_outcome: str):
             "and integrity above the float collar is in question."
         )
 
+    fit = data.get("bleedoff_fit")
+    fit_text = f"\n\n{describe_bleedoff_fit(fit)}" if fit else ""
+    if mc:
+        fit_text += f"\n\n{describe_flowback_uncertainty(mc)}"
+
     return f"""Fluid Compressibility, Casing Ballooning, and Thermal Expansion
 
-We calculated compressibility for {disp}m³ at ~{bump}MPa surface-applied pressure. The theoretical compressed volume is approximately {calc_theoretical_L} L, plus an additional {calc_thermal_L} L from conservative thermal expansion.
+We calculated compressibility for {disp}m³ at ~{bump}MPa surface-applied pressure. The theoretical compressed volume is approximately {calc_theoretical_L} L, plus an additional {calc_thermal_L} L from conservative thermal expansion.{fit_text}
 
 {conclusion}
 """.strip()
@@ -282,10 +319,12 @@ This behavior is consistent with debris sitting on the float collar landing face
 def cause_third_party_integrity(data):
     bled = data.get("bledoff_to_mpa", "N/A")
     flowback = data.get("flowback_volume", "N/A")
+    fit = data.get("bleedoff_fit")
+    fit_text = f" {describe_bleedoff_fit(fit)}" if fit else ""
 
     return f"""Failure of Third-Party Casing Accessories & Connections
 
-We landed on calculated displacement volume and saw an apparent bump, but we could not hold a positive pressure test. The string repeatedly bled down and stabilized around {bled}MPa. In addition, post-job data indicates inflow that exceeded normal compressibility / thermal expansion (reported ~{flowback}).
+We landed on calculated displacement volume and saw an apparent bump, but we could not hold a positive pressure test. The string repeatedly bled down and stabilized around {bled}MPa. In addition, post-job data indicates inflow that exceeded normal compressibility / thermal expansion (reported ~{flowback}).{fit_text}
 
 When the plug lands on volume but we cannot maintain pressure, and we later observe inflow, the most probable explanation is loss of integrity somewhere above the float collar: a casing connection, frac/toe port, or other third-party accessory. The pattern here is not consistent with float equipment failure.
 """.strip()
@@ -304,287 +343,2259 @@ ROOT_CAUSE_BLOCK_BUILDERS = {
 
 
 # ============================================================
-# Grok call – with optional images
+# SHARED RESOURCES (built once per server process)
 # ============================================================
 
-def encode_uploaded_images(uploaded_files):
+class SharedResourceRegistry:
     """
-    Turn Streamlit uploaded files into a list of dicts:
-    [
-      {
-        "filename": ...,
-        "mime_type": ...,
-        "b64": "<base64 string>"
-      }
-    ]
+    Thread-safe, process-wide home for heavy immutable resources (compiled
+    prompt, HTTP session, docx style template, job queue...). Each resource is
+    built once by its factory on first use and then shared by every session
+    and worker thread. Build time, approximate size and hit counts are kept
+    for the performance panel.
     """
-    images = []
-    for f in uploaded_files:
-        raw = f.read()
-        if not raw:
-            continue
-        b64 = base64.b64encode(raw).decode("utf-8")
-        mime = f.type or "image/png"
-        images.append({
-            "filename": f.name,
-            "mime_type": mime,
-            "b64": b64,
-        })
-    return images
 
-
-def generate_ai_full_report(user_data: dict, api_key: str, model: str, images=None) -> dict:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Hit counts have their own lock so lookups never wait behind a build.
+        self._hits_lock = threading.Lock()
+        self._items = {}
+        self._stats = {}
+        self._hits = defaultdict(int)
+
+    def get(self, name: str, factory):
+        item = self._items.get(name)
+        if item is not None:
+            with self._hits_lock:
+                self._hits[name] += 1
+            return item
+        with self._lock:
+            if name not in self._items:
+                start = time.perf_counter()
+                item = factory()
+                self._stats[name] = {
+                    "name": name,
+                    "build_ms": round((time.perf_counter() - start) * 1000, 1),
+                    "approx_kb": round(_approx_size(item) / 1024, 1),
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                }
+                self._items[name] = item
+            return self._items[name]
+
+    def stats(self):
+        with self._lock, self._hits_lock:
+            return [dict(v, hits=self._hits[name]) for name, v in self._stats.items()]
+
+
+def _approx_size(obj, _depth: int = 0) -> int:
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, _depth + 1) + _approx_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_approx_size(v, _depth + 1) for v in obj)
+    return size
+
+
+_SHARED_RESOURCES = SharedResourceRegistry()
+
+
+def shared_registry() -> SharedResourceRegistry:
+    return _SHARED_RESOURCES
+
+
+def use_shared_registry(registry: SharedResourceRegistry):
     """
-    Ask Grok to:
-    - pick applicable root cause modules from our allowed list
-    - classify compressibility outcome
-    - write LONG, detailed narrative sections
-    - explain reasoning in overall_cause_analysis
-    - optionally consider uploaded images (EDR screenshots, etc.)
+    Streamlit re-executes this script on every rerun, which would create a new
+    module-level registry each time. main() pins the first one (held by
+    st.cache_resource) back in place with this.
+    """
+    global _SHARED_RESOURCES
+    _SHARED_RESOURCES = registry
 
-    images: list of {"filename", "mime_type", "b64"}
+
+def shared_resource(name: str, factory):
+    return _SHARED_RESOURCES.get(name, factory)
+
+
+def process_memory_mb() -> dict:
     """
+    Current and peak resident memory of this process in MB (Linux /proc, with
+    a resource.getrusage fallback for the peak).
+    """
+    mem = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    mem["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    mem["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        try:
+            import resource
 
-    if images is None:
-        images = []
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            mem["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        except ImportError:
+            pass
+    return mem
 
-    # allowed_modules = [
-    #     "incorrect_pumping_volume",
-    #     "compressibility_ballooning",
-    #     "failure_prior_to_cementing",
-    #     "mismatched_receptacle",
-    #     "debris_on_collar",
-    #     "third_party_integrity"
-    # ]
 
-    allowed_modules = [
-    # Core modules
-    "incorrect_pumping_volume",
-    "compressibility_ballooning",
-    "failure_prior_to_cementing",
-    "mismatched_receptacle",
-    "debris_on_collar",
-    "third_party_integrity",
+def _build_grok_session():
+    import requests
+    from requests.adapters import HTTPAdapter
 
-    # From CIR-25-19+ to 31 series
-    "plug_bumped_early_not_latched",
-    "valve_or_plunger_sticking",
-    "plug_damaged_or_deformed",
-    "float_valve_leakback",
-    "third_party_port_leakage",
-    "plug_misalignment_in_latch",
-    "premature_float_activation",
-    "hydraulic_lock_during_displacement",
-    "damaged_float_shoe_face",
-    "gas_cut_fluid_in_cement",
-    "operational_interruption_during_bump",
-    "mechanical_damage_during_drillout",
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, JOB_WORKERS * 2))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    # From CIR-25-12 to 18 series
-    "no_plug_bump_no_test",
-    "plug_landed_but_not_tested",
-    "float_valve_did_not_close",
-    "float_valve_stuck_open",
-    "plug_receptacle_tolerance_issue",
-    "underdisplacement_due_to_rate_cutback",
-    "cement_channel_or_bypass",
-    "fractured_float_body",
-    "plug_assembly_contamination",
-    "flowback_through_toe",
-    "premature_cement_cutoff",
-    "no_wits_data_verification",
-    "cb_sub_failed_burst_disk",
 
-    "float_shoe_damaged_during_run",
-    "float_valve_plugged_by_debris",
-    "float_valve_not_fully_closing",
-    "cold_weather_surface_issue",
-    "underdisplacement_due_to_operational_interruptions",
-    "plug_bypassed_or_not_latched",
-    "float_collar_or_shoe_leakage",
-    "buoyancy_disc_failure",
+def _build_docx_template() -> bytes:
+    from docx import Document
 
-    "no_plug_bump_inflow",
-    "plug_bypassed_or_damaged",
-    "valve_or_plunger_damaged_during_run",
-    "float_valve_leak_post_cement",
-    "staged_pump_shutdown_pressure_spike",
-    "segmented_plug_design_limitation",
-    "hydraulic_shock_during_burst",
-    "third_party_integrity_failure",
-    "compressibility_exceeds_expected",
-    "pressure_fluctuation_during_staging",
-    "plug_seat_misalignment",
+    doc = Document()
+    ensure_styles(doc)
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
 
-    "incomplete_air_displacement",
-    "compressibility_and_thermal_expansion",
-    "burst_disc_debris_bridging_valves",
-    "third_party_tool_communication",
-    "debris_from_casing_or_lcm",
-    "plug_not_seated_in_float_collar",
-    "connection_leak_above_float",
-    "incorrect_pumping_tolerance_margin",
-    "burst_port_or_toe_sleeve_misconfiguration",
-    "float_valve_partial_closure",
-]
 
+def warm_up_shared_resources():
+    """
+    Build the shared resources up front (server start / first session) so the
+    first report doesn't pay for them. Returns the registry stats.
+    """
+    shared_resource("system_prompt", build_system_instruction)
+    shared_resource("grok_session", _build_grok_session)
+    shared_resource("docx_template", _build_docx_template)
+    return _SHARED_RESOURCES.stats()
 
-    # Flatten relevant facts into text bullets
-    facts_lines = []
-    for key, val in user_data.items():
-        if key in ["volume_table", "post_job"]:
-            continue
-        facts_lines.append(f"- {key}: {val}")
-    for k, v in user_data["volume_table"].items():
-        facts_lines.append(f"- volume_table.{k}: {v}")
-    for k, v in user_data["post_job"].items():
-        facts_lines.append(f"- post_job.{k}: {v}")
-    facts_lines.append(
-        f"- mismatch_receptacle_receptacle_id_in: {user_data.get('mismatch_receptacle_receptacle_id_in')}"
-    )
-    facts_lines.append(
-        f"- mismatch_receptacle_plug_nose_id_in: {user_data.get('mismatch_receptacle_plug_nose_id_in')}"
-    )
 
-    facts_blob = "\n".join(facts_lines)
+# ============================================================
+# EDR TIME-SERIES INGESTION (Pason CSV / ASCII exports)
+# ============================================================
 
-    # Build system instructions
-    system_instruction = f"""
-You are an experienced completions/cementing engineer writing an internal incident investigation report for CCAI.
+# Bump this whenever parsing / normalisation changes so stale caches are ignored.
+EDR_CACHE_VERSION = 1
+EDR_CHUNK_ROWS = 250_000
+
+# Normalised column name -> canonical channel.
+EDR_CHANNEL_ALIASES = {
+    "time": "time",
+    "date_time": "time",
+    "datetime": "time",
+    "timestamp": "time",
+    "yyyy_mm_dd_hh_mm_ss": "time",
+    "elapsed_time": "time",
+    "date": "date",
+    "yyyy_mm_dd": "date",
+    "hh_mm_ss": "time",
+
+    "standpipe_pressure": "spp_mpa",
+    "stand_pipe_pressure": "spp_mpa",
+    "spp": "spp_mpa",
+    "pump_pressure": "spp_mpa",
+    "cement_pressure": "spp_mpa",
+    "treating_pressure": "spp_mpa",
+    "pressure": "spp_mpa",
+
+    "pump_rate": "rate_m3_per_min",
+    "total_pump_output": "rate_m3_per_min",
+    "flow_rate": "rate_m3_per_min",
+    "flow_in": "rate_m3_per_min",
+    "rate": "rate_m3_per_min",
+
+    "total_volume": "volume_m3",
+    "cumulative_volume": "volume_m3",
+    "displacement_volume": "volume_m3",
+    "pumped_volume": "volume_m3",
+    "volume_pumped": "volume_m3",
+    "stage_volume": "volume_m3",
+}
 
-Tone rules:
-- Factual, past-tense, neutral, technical.
-- Use MPa for pressures, m³ for volumes, mMD for measured depth.
-- Do not assign personal blame. Use language like "suggests", "indicates", "appears".
-- Audience is engineering / production / management.
+# Canonical channel -> {unit: factor to canonical unit}. First entry is the
+# assumed unit when the export carries none (Pason Canada defaults).
+EDR_UNIT_FACTORS = {
+    "spp_mpa": {"kpa": 0.001, "mpa": 1.0, "psi": 0.00689476, "bar": 0.1},
+    "rate_m3_per_min": {
+        "m3/min": 1.0, "l/min": 0.001, "bbl/min": 0.158987, "bpm": 0.158987,
+        "m3/h": 1.0 / 60.0, "m3/hr": 1.0 / 60.0, "gpm": 0.00378541,
+    },
+    "volume_m3": {"m3": 1.0, "l": 0.001, "bbl": 0.158987},
+}
 
-You MUST reason from ONLY the provided facts and any uploaded images. DO NOT invent numbers that are not given.
+EDR_NA_VALUES = ["", "-999.25", "-999", "-9999", "NaN", "nan", "---", "N/A"]
 
-VERY IMPORTANT:
-- Your narratives MUST explicitly reference the specific observations: pre-cement notes, cleanup behavior, bump pressure,
-  bleed-off pattern, final stabilized pressure, flowback volume/behavior, post-job tests, and any mismatch ID information.
-- Do NOT write generic boilerplate. Each incident must read as specific to the data for that job.
-- If flowback is minimal and pressure drops directly to 0 MPa, strongly consider failure_prior_to_cementing, debris_on_collar, or mismatched_receptacle.
-- If there is continued inflow and pressure stabilizes at non-zero MPa, strongly consider third_party_integrity and compressibility_ballooning.
-- If mismatch IDs are provided, you MUST comment on their relevance in your cause analysis.
-- If images are provided (screenshots, charts, photos), you must interpret them and reference any relevant features (e.g. pressure trend, volumes, TOC indications) in your cause analysis and narratives.
 
-ROOT CAUSE MODULES:
-You may ONLY choose from this exact list (zero or more):
-{allowed_modules}
+def _normalise_edr_column(raw: str):
+    """
+    Split a raw EDR header such as 'Standpipe Pressure (kPa)' into
+    ('standpipe_pressure', 'kpa').
+    """
+    name, unit = raw.strip(), ""
+    m = re.match(r"^(.*?)\s*[\(\[]([^\)\]]*)[\)\]]\s*$", name)
+    if m:
+        name, unit = m.group(1), m.group(2)
+    key = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+    return key, _normalise_edr_unit(unit)
 
-MEANING OF MODULES (for your reasoning):
-- incorrect_pumping_volume:
-  Pumped nominal bump volume but plug did not seal or hold, or pattern matches under/over displacement concerns.
-- compressibility_ballooning:
-  Flowback that may be explained by fluid compressibility, trapped-volume expansion, ballooning, thermal rebound.
-- failure_prior_to_cementing:
-  Debris / glass / buoyancy-disc fragments / damage that interfered with plug landing BEFORE cementing.
-- mismatched_receptacle:
-  Plug nose ID and float collar receptacle ID do not match, so plug can land but not seal.
-- debris_on_collar:
-  Debris sitting on the float collar landing face so plug cannot seat; bridge plug / packer later tests casing above successfully.
-- third_party_integrity:
-  Leak path above the float equipment (toe subs, sleeves, connections, other accessories), not float equipment failure itself.
 
-COMPRESSIBILITY OUTCOME:
-Return either:
-- "plausible"       -> if observed flowback/inflow could be normal compressibility / ballooning / thermal rebound.
-- "exceeds_normal"  -> if flowback volume and continued inflow clearly indicate a communication path above the float equipment.
+def _normalise_edr_unit(unit: str) -> str:
+    return unit.strip().lower().replace("³", "3").replace(" ", "")
 
-NARRATIVE SECTIONS (MAKE THEM JUICY):
-Return 4 long-form fields in "narrative_sections":
 
-1) incident_summary:
-   - 3 to 6 paragraphs.
-   - Walk through the whole sequence chronologically: drilling, running casing/accessories, buoyancy/airlock or toe subs,
-     cleanup circulation, cement pumping, displacement, plug drop/bump attempts, flowback/inflow observations.
-   - Refer explicitly to the key numbers (depths, volumes, pressures, rates, any meaningful timing).
-   - Comment on abnormal SPP, pump behavior, or well response.
+def _edr_unit_factor(channel: str, unit: str) -> float:
+    factors = EDR_UNIT_FACTORS.get(channel)
+    if not factors:
+        return 1.0
+    if not unit:
+        return next(iter(factors.values()))
+    if unit not in factors:
+        raise ValueError(f"Unsupported unit '{unit}' for EDR channel {channel}")
+    return factors[unit]
 
-2) incident_review:
-   - 1 to 3 paragraphs.
-   - Focus on QA/QC and process: how the equipment is normally inspected, tested, and built.
-   - If relevant, mention debris-handling design features, valve design, latch design, typical testing practices,
-     and how they relate to this job.
 
-3) conclusion:
-   - 2 to 4 paragraphs.
-   - Clearly state the most probable cause(s) of the incident given the data, referencing the selected root cause modules.
-   - Explain how the observed pressures, volumes, bump signatures, and flowback support or contradict each possible cause.
-   - Provide clear recommendations for follow-up, data review, or procedural changes.
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
 
-4) overall_cause_analysis:
-   - 3 to 6 paragraphs of deeper engineering reasoning.
-   - Compare the observed behavior to what you would expect for:
-        * a clean, successful bump with good integrity,
-        * pure compressibility/thermal effects,
-        * leaks across or above the float equipment,
-        * debris / damage / mismatched hardware at the latch.
-   - Step-by-step logic: what the data says, what it rules out, and why the final selected causes are most consistent.
 
-OUTPUT FORMAT:
-Return STRICT JSON with keys:
-{{
-  "root_cause_blocks": [...],
-  "compressibility_outcome": "plausible" | "exceeds_normal",
-  "narrative_sections": {{
-    "incident_summary": "string",
-    "incident_review": "string",
-    "conclusion": "string",
-    "overall_cause_analysis": "string"
-  }}
-}}
+def _split_edr_line(line: str, sep):
+    if sep is None:
+        return line.split()
+    return [c.strip().strip('"') for c in line.split(sep)]
 
-CRITICAL:
-- 'root_cause_blocks' MUST ONLY contain items from this allowed set: {allowed_modules}
-- Do NOT include any extra keys.
-- No markdown, no headings like "INCIDENT SUMMARY:" inside the strings themselves.
-- Just plain text paragraphs in each string, separated by blank lines where natural.
-- Do NOT mention these instructions in your output.
-""".strip()
 
-    # Build the user content: text + optional images (OpenAI-style content array)
-    # Allow user_content to be a list of dicts with potentially nested dicts as values
-    user_content: list[dict[str, object]] = [
-        {
-            "type": "text",
-            "text": f"FACTS:\n{facts_blob}\n\nIf images are present below, use them to refine your assessment.\n"
+def _sniff_edr_layout(head_lines):
+    """
+    Work out delimiter, header row, optional unit row and the channels we keep
+    from the first few lines of an export (Pason files may carry a preamble).
+    """
+    for i, line in enumerate(head_lines):
+        if not line.strip():
+            continue
+        counts = {sep: line.count(sep) for sep in ("\t", ",", ";")}
+        sep = max(counts, key=counts.get)
+        if counts[sep] == 0:
+            sep = None  # whitespace-delimited ASCII
+        fields = _split_edr_line(line, sep)
+        columns = {}
+        for idx, raw in enumerate(fields):
+            key, unit = _normalise_edr_column(raw)
+            channel = EDR_CHANNEL_ALIASES.get(key)
+            if channel and channel not in columns:
+                columns[channel] = {"index": idx, "raw": raw.strip(), "unit": unit}
+        if "time" not in columns or len(columns) < 2:
+            continue
+
+        data_start = i + 1
+        if data_start < len(head_lines):
+            unit_fields = _split_edr_line(head_lines[data_start], sep)
+            if unit_fields and not any(_is_number(u) for u in unit_fields if u):
+                for col in columns.values():
+                    if col["index"] < len(unit_fields) and not col["unit"]:
+                        col["unit"] = _normalise_edr_unit(unit_fields[col["index"]])
+                data_start += 1
+
+        first_row = []
+        if data_start < len(head_lines):
+            first_row = _split_edr_line(head_lines[data_start], sep)
+        time_idx = columns["time"]["index"]
+        time_is_numeric = (
+            "date" not in columns
+            and time_idx < len(first_row)
+            and _is_number(first_row[time_idx])
+        )
+        return {
+            "sep": sep,
+            "data_start": data_start,
+            "columns": columns,
+            "time_is_numeric": time_is_numeric,
         }
-    ]
 
-    for img in images:
-        data_url = f"data:{img['mime_type']};base64,{img['b64']}"
-        user_content.append({
-            "type": "image_url",
-            "image_url": {"url": data_url}
-        })
+    raise ValueError("Could not find a time column plus pressure/rate/volume channels in EDR export.")
 
-    url = "https://api.x.ai/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system_instruction},
-            {"role": "user", "content": user_content},
-        ],
-        "temperature": 0.25,
-        "max_tokens": 1800,
+
+def _edr_source_digest(source):
+    """
+    Return (sha256 hex digest, head text, pandas-readable source, display name)
+    for either a filesystem path or an uploaded file object.
+    """
+    h = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                h.update(block)
+        with open(source, "rb") as fh:
+            head = fh.read(64 * 1024)
+        return h.hexdigest(), head, source, os.path.basename(source)
+
+    raw = source.getvalue() if hasattr(source, "getvalue") else source.read()
+    h.update(raw)
+    return h.hexdigest(), raw[:64 * 1024], BytesIO(raw), getattr(source, "name", "edr_export")
+
+
+def _parse_edr_export(reader_source, layout):
+    """
+    Stream the export through pandas in chunks with explicit dtypes and return
+    ({channel: ndarray}, start_epoch_s). Values are converted to canonical units.
+    """
+    import pandas as pd
+
+    columns = layout["columns"]
+    order = sorted(columns, key=lambda c: columns[c]["index"])
+    usecols = [columns[c]["index"] for c in order]
+    dtypes = {}
+    for c in order:
+        if c in ("time", "date"):
+            dtypes[columns[c]["index"]] = "float64" if layout["time_is_numeric"] else "str"
+        else:
+            dtypes[columns[c]["index"]] = "float32"
+
+    read_kwargs = dict(
+        header=None,
+        skiprows=layout["data_start"],
+        usecols=usecols,
+        dtype=dtypes,
+        na_values=EDR_NA_VALUES,
+        chunksize=EDR_CHUNK_ROWS,
+        on_bad_lines="skip",
+    )
+    if layout["sep"] is None:
+        read_kwargs["sep"] = r"\s+"
+    else:
+        read_kwargs.update(sep=layout["sep"], engine="c")
+
+    parts = {c: [] for c in order if c != "date"}
+    for chunk in pd.read_csv(reader_source, **read_kwargs):
+        if layout["time_is_numeric"]:
+            t = chunk[columns["time"]["index"]].to_numpy(dtype="float64")
+        else:
+            stamp = chunk[columns["time"]["index"]]
+            if "date" in columns:
+                stamp = chunk[columns["date"]["index"]] + " " + stamp
+            ts = pd.to_datetime(stamp, errors="coerce", cache=True).to_numpy(dtype="datetime64[ns]")
+            t = np.where(np.isnat(ts), np.nan, ts.astype("int64") / 1e9)
+        parts["time"].append(t)
+        for c in order:
+            if c in ("time", "date"):
+                continue
+            parts[c].append(chunk[columns[c]["index"]].to_numpy(dtype="float32"))
+
+    arrays = {c: (np.concatenate(v) if v else np.empty(0)) for c, v in parts.items()}
+    keep = ~np.isnan(arrays["time"])
+    arrays = {c: a[keep] for c, a in arrays.items()}
+
+    t = arrays.pop("time")
+    start_epoch = float(t[0]) if (t.size and not layout["time_is_numeric"]) else 0.0
+    arrays["time_s"] = (t - (t[0] if t.size else 0.0)).astype("float64")
+
+    for c in list(arrays):
+        if c == "time_s":
+            continue
+        factor = _edr_unit_factor(c, columns[c]["unit"])
+        if factor != 1.0:
+            arrays[c] = (arrays[c] * np.float32(factor)).astype("float32")
+
+    # Some exports only carry rate; integrate it so cumulative volume is always available.
+    if "volume_m3" not in arrays and "rate_m3_per_min" in arrays and arrays["time_s"].size:
+        dt_min = np.diff(arrays["time_s"], prepend=arrays["time_s"][0]) / 60.0
+        rate = np.nan_to_num(arrays["rate_m3_per_min"])
+        arrays["volume_m3"] = np.cumsum(rate * dt_min).astype("float32")
+
+    return arrays, start_epoch
+
+
+def ingest_edr_export(source, cache_dir: str = EDR_CACHE_DIR) -> dict:
+    """
+    Import a Pason EDR CSV / ASCII export (path or Streamlit uploaded file).
+
+    Channels are normalised to:
+      time_s, spp_mpa, rate_m3_per_min, volume_m3
+    and cached as memory-mapped .npy files keyed by the file's SHA-256, so
+    re-opening the same export skips parsing entirely.
+
+    Returns a small JSON-serialisable reference suitable for user_data["edr"];
+    use load_edr_series() to get the arrays.
+    """
+    digest, head, reader_source, name = _edr_source_digest(source)
+    entry_dir = os.path.join(cache_dir, f"{digest}_v{EDR_CACHE_VERSION}")
+    meta_path = os.path.join(entry_dir, "meta.json")
+
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    head_lines = head.decode("utf-8", errors="replace").splitlines()[:50]
+    layout = _sniff_edr_layout(head_lines)
+    arrays, start_epoch = _parse_edr_export(reader_source, layout)
+
+    t = arrays["time_s"]
+    meta = {
+        "source_name": name,
+        "file_hash": digest,
+        "cache_dir": entry_dir,
+        "channels": sorted(arrays),
+        "n_samples": int(t.size),
+        "duration_s": float(t[-1]) if t.size else 0.0,
+        "start_time": (
+            datetime.fromtimestamp(start_epoch, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            if start_epoch else None
+        ),
+        "source_units": {c: v["unit"] for c, v in layout["columns"].items() if c != "date"},
     }
 
+    # Write to a temp dir then rename, so a half-written cache is never picked up.
+    tmp_dir = f"{entry_dir}.tmp{os.getpid()}.{threading.get_ident()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for c, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{c}.npy"), np.ascontiguousarray(arr))
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as fh:
+        json.dump(meta, fh, indent=2)
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=90)
-        resp.raise_for_status()
-        data = resp.json()
-        ai_text = data["choices"][0]["message"]["content"].strip()
-        parsed = json.loads(ai_text)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another worker finished first; its copy is identical.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return meta
+
+
+def load_edr_series(edr_ref: dict) -> dict:
+    """
+    Memory-map the cached channels for an EDR reference returned by
+    ingest_edr_export(). Returns {channel: ndarray}.
+    """
+    return {
+        c: np.load(os.path.join(edr_ref["cache_dir"], f"{c}.npy"), mmap_mode="r")
+        for c in edr_ref["channels"]
+    }
+
+
+def summarize_edr_ref(edr_ref: dict) -> str:
+    hours = edr_ref.get("duration_s", 0.0) / 3600.0
+    channels = ", ".join(c for c in edr_ref.get("channels", []) if c != "time_s")
+    return (
+        f"{edr_ref.get('source_name')} – {edr_ref.get('n_samples')} samples over "
+        f"{hours:.2f} h ({channels})"
+    )
+
+
+# ============================================================
+# EDR EVENT DETECTION (displacement, FCP, bump, bleed-off)
+# ============================================================
+
+EVENT_RATE_THRESHOLD = 0.05        # m³/min – below this the pumps are "off"
+EVENT_PLUG_DROP_GAP_S = 120.0      # shutdown this long separates cement from displacement
+EVENT_MIN_INTERRUPTION_S = 10.0    # shorter gaps are treated as noise
+EVENT_SMOOTH_S = 10.0              # smoothing window for pressure slopes
+EVENT_ONSET_SLOPE = 0.05           # MPa/s – bump onset once the rise is steeper than this
+EVENT_STABLE_SLOPE = 0.005         # MPa/s – bleed-off considered stable below this
+EVENT_STABLE_WINDOW_S = 120.0
+EVENT_FCP_WINDOW_S = 120.0
+EVENT_POST_BUMP_MAX_S = 3600.0
+
+# Detected event -> user_data field it can pre-fill.
+EDR_EVENT_FIELDS = {
+    "fcp_mpa": "fcp_mpa",
+    "bump_pressure_mpa": "bump_pressure_mpa",
+    "bledoff_to_mpa": "bledoff_to_mpa",
+    "displacement_pumped_m3": "displacement_pumped_m3",
+}
+
+
+def _ffill_nan(x):
+    x = np.asarray(x, dtype="float64")
+    mask = np.isnan(x)
+    if not mask.any():
+        return x
+    idx = np.where(~mask, np.arange(x.size), 0)
+    np.maximum.accumulate(idx, out=idx)
+    out = x[idx]
+    return np.nan_to_num(out)
+
+
+def _moving_average(x, w: int):
+    if w <= 1 or x.size < w:
+        return x
+    c = np.cumsum(np.insert(x, 0, 0.0))
+    core = (c[w:] - c[:-w]) / w
+    pad = w // 2
+    return np.concatenate([np.full(pad, core[0]), core, np.full(x.size - core.size - pad, core[-1])])
+
+
+def _samples_for(t, seconds: float) -> int:
+    if t.size < 2:
+        return 1
+    dt = float(np.median(np.diff(t)))
+    return max(1, int(round(seconds / dt))) if dt > 0 else 1
+
+
+def _event(value, time_s, confidence):
+    return {
+        "value": None if value is None else round(float(value), 2),
+        "time_s": None if time_s is None else float(time_s),
+        "confidence": confidence,
+    }
+
+
+def detect_cementing_events(series: dict) -> dict:
+    """
+    Find displacement start, final circulating pressure, bump onset / peak,
+    bleed-off stabilisation level and pumping interruptions in EDR arrays
+    (see load_edr_series). Everything is NumPy-vectorised so a full job at 1 Hz
+    runs in a few milliseconds.
+
+    Each event is {"value", "time_s", "confidence"} with confidence one of
+    "high" / "medium" / "low". Returns {} if no pumping is found or the export
+    has neither rate nor volume; without pressure only the displacement
+    start / volume and interruptions are returned.
+    """
+    t = np.asarray(series["time_s"], dtype="float64")
+    p = _ffill_nan(series["spp_mpa"]) if "spp_mpa" in series else None
+    v = _ffill_nan(series["volume_m3"]) if "volume_m3" in series else None
+    if "rate_m3_per_min" in series:
+        q = _ffill_nan(series["rate_m3_per_min"])
+    elif v is not None and t.size >= 2:
+        q = np.gradient(v, t) * 60.0
+    else:
+        return {}
+    n = t.size
+    if n < 3:
+        return {}
+
+    # --- Pumping segments -------------------------------------------------
+    pumping = q > EVENT_RATE_THRESHOLD
+    edges = np.diff(pumping.astype(np.int8))
+    starts = np.flatnonzero(edges == 1) + 1
+    ends = np.flatnonzero(edges == -1) + 1  # exclusive
+    if pumping[0]:
+        starts = np.insert(starts, 0, 0)
+    if pumping[-1]:
+        ends = np.append(ends, n)
+    if starts.size == 0:
+        return {}
+
+    gaps = t[np.minimum(starts[1:], n - 1)] - t[ends[:-1] - 1]
+
+    # Walk back from the final segment across short stops; a long shutdown is the plug drop.
+    k = starts.size - 1
+    while k > 0 and gaps[k - 1] < EVENT_PLUG_DROP_GAP_S:
+        k -= 1
+    start_conf = "high" if k > 0 else "low"
+    disp_start = starts[k]
+    pump_stop = ends[-1] - 1
+
+    interruptions = [
+        {
+            "start_s": float(t[ends[i] - 1]),
+            "end_s": float(t[starts[i + 1]]),
+            "duration_s": round(float(gaps[i]), 1),
+        }
+        for i in range(k, starts.size - 1)
+        if gaps[i] >= EVENT_MIN_INTERRUPTION_S
+    ]
+
+    disp_volume = None
+    if v is not None:
+        disp_volume = float(v[pump_stop] - v[disp_start])
+    displacement = {
+        "displacement_start": _event(None, t[disp_start], start_conf),
+        "displacement_pumped_m3": _event(
+            disp_volume, t[pump_stop], start_conf if disp_volume is not None else "low"
+        ),
+        "interruptions": interruptions,
+    }
+    if p is None:
+        return displacement
+
+    # --- Bump peak and onset ----------------------------------------------
+    win_end = min(n, np.searchsorted(t, t[pump_stop] + 60.0, side="right"))
+    ip = disp_start + int(np.argmax(p[disp_start:win_end]))
+
+    p_smooth = _moving_average(p, _samples_for(t, EVENT_SMOOTH_S))
+    slope = np.gradient(p_smooth, t)
+    # Search back from the last steep sample: smoothing across the pump stop
+    # flattens the slope right at the peak.
+    steep = np.flatnonzero(slope[disp_start:ip] >= EVENT_ONSET_SLOPE)
+    rise_end = disp_start + int(steep[-1]) if steep.size else ip
+    flat_before = np.flatnonzero(slope[disp_start:rise_end] < EVENT_ONSET_SLOPE)
+    onset = disp_start + int(flat_before[-1]) if flat_before.size else disp_start
+
+    fcp_lo = np.searchsorted(t, t[onset] - EVENT_FCP_WINDOW_S)
+    fcp_window = p[fcp_lo:onset + 1][pumping[fcp_lo:onset + 1]]
+    fcp = float(np.median(fcp_window)) if fcp_window.size else float(p[onset])
+
+    rise = float(p[ip]) - fcp
+    bump_conf = "high" if rise >= 2.0 else ("medium" if rise >= 0.5 else "low")
+
+    # --- Bleed-off stabilisation --------------------------------------------
+    post_end = np.searchsorted(t, t[ip] + EVENT_POST_BUMP_MAX_S)
+    later_pumping = np.flatnonzero(pumping[ip:post_end] & (np.arange(ip, post_end) > pump_stop))
+    if later_pumping.size:
+        post_end = ip + int(later_pumping[0])
+    w = _samples_for(t, EVENT_STABLE_WINDOW_S)
+    abs_slope = _moving_average(np.abs(slope[ip:post_end]), w)
+    stable = np.flatnonzero(abs_slope < EVENT_STABLE_SLOPE)
+    if stable.size:
+        j = ip + int(stable[0])
+        bled = float(np.median(p[j:min(post_end, j + w)]))
+        bled_conf = "high"
+    elif post_end - ip > 1:
+        j = post_end - 1
+        bled = float(np.median(p[max(ip, post_end - w):post_end]))
+        bled_conf = "low"
+    else:
+        j, bled, bled_conf = None, None, "low"
+
+    return {
+        "displacement_start": displacement["displacement_start"],
+        "fcp_mpa": _event(fcp, t[onset], "high" if fcp_window.size else "low"),
+        "bump_onset": _event(p[onset], t[onset], bump_conf),
+        "bump_pressure_mpa": _event(p[ip], t[ip], bump_conf),
+        "bledoff_to_mpa": _event(bled, None if j is None else t[j], bled_conf),
+        "displacement_pumped_m3": displacement["displacement_pumped_m3"],
+        "interruptions": interruptions,
+    }
+
+
+def apply_edr_events(user_data: dict, events: dict, overwrite: bool = False):
+    """
+    Pre-fill user_data pressures / volumes from detect_cementing_events().
+    Only empty fields are filled unless overwrite=True. The events (with their
+    confidence flags) are kept on user_data["edr_events"].
+
+    Returns the list of fields that were filled.
+    """
+    filled = []
+    for event_key, field in EDR_EVENT_FIELDS.items():
+        ev = events.get(event_key)
+        if not ev or ev["value"] is None:
+            continue
+        current = user_data.get(field)
+        if overwrite or current is None or current == "":
+            user_data[field] = ev["value"]
+            filled.append(field)
+    if "displacement_pumped_m3" in filled and "volume_table" in user_data:
+        user_data["volume_table"]["displacement_pumped_m3"] = user_data["displacement_pumped_m3"]
+    user_data["edr_events"] = events
+    return filled
+
+
+def summarize_edr_events(events: dict):
+    """
+    Flatten detected events into 'name: value (confidence)' strings for the facts blob.
+    """
+    lines = []
+    for key, ev in events.items():
+        if key == "interruptions":
+            total = sum(i["duration_s"] for i in ev)
+            lines.append(f"pumping_interruptions: {len(ev)} during displacement ({total:.0f} s total)")
+        elif ev["value"] is not None:
+            lines.append(f"{key}: {ev['value']} at t={ev['time_s']:.0f}s (confidence {ev['confidence']})")
+        elif ev["time_s"] is not None:
+            lines.append(f"{key}: t={ev['time_s']:.0f}s (confidence {ev['confidence']})")
+    return lines
+
+
+# ============================================================
+# BLEED-OFF DECAY FITTING (compressibility relaxation vs leak)
+# ============================================================
+
+# Model:  p(t) = asymptote + amplitude * exp(-t / tau) - leak_rate * t
+# tau is searched on a log grid; for each tau the rest is linear least squares,
+# solved for every (window, tau) pair at once via 3x3 normal equations.
+DECAY_TAU_GRID_S = np.geomspace(5.0, 3600.0, 48)
+DECAY_POINTS = 240
+DECAY_BATCH = 256
+DECAY_MIN_SAMPLES = 10
+LEAK_RATE_THRESHOLD_MPA_PER_MIN = 0.02
+RELAXATION_MIN_AMPLITUDE_MPA = 0.1
+
+
+def extract_bleedoff_window(series: dict, events: dict, max_s: float = EVENT_POST_BUMP_MAX_S):
+    """
+    Slice the post-bump pressure window (pumps off, up to the next pumping or
+    max_s seconds) from EDR arrays. Returns (t_rel_s, p_mpa) or None.
+    """
+    peak = events.get("bump_pressure_mpa") if events else None
+    if not peak or peak.get("time_s") is None:
+        return None
+    t = np.asarray(series["time_s"], dtype="float64")
+    p = _ffill_nan(series["spp_mpa"])
+    i0 = int(np.searchsorted(t, peak["time_s"]))
+    i1 = int(np.searchsorted(t, peak["time_s"] + max_s))
+    if "rate_m3_per_min" in series:
+        pumping = _ffill_nan(series["rate_m3_per_min"])[i0:i1] > EVENT_RATE_THRESHOLD
+        off = np.flatnonzero(~pumping)
+        if off.size == 0:
+            return None
+        first_off = int(off[0])
+        back_on = np.flatnonzero(pumping[first_off:])
+        i1 = i0 + first_off + (int(back_on[0]) if back_on.size else pumping.size - first_off)
+        i0 += first_off
+    if i1 - i0 < DECAY_MIN_SAMPLES:
+        return None
+    return t[i0:i1] - t[i0], p[i0:i1]
+
+
+def _decay_verdict(tau, amplitude, leak, duration):
+    # A "relaxation" slower than twice the window is indistinguishable from a leak.
+    effective_leak = leak
+    if tau > 2.0 * duration and amplitude > 0:
+        effective_leak = max(leak, amplitude / tau * 60.0)
+    if effective_leak >= LEAK_RATE_THRESHOLD_MPA_PER_MIN:
+        return "sustained_leak"
+    if amplitude >= RELAXATION_MIN_AMPLITUDE_MPA:
+        return "compressibility_relaxation"
+    return "inconclusive"
+
+
+def fit_bleedoff_decay_batch(windows):
+    """
+    Fit the exponential + leak-rate model to many post-bump windows at once.
+
+    windows: list of (t_s, p_mpa) pairs (or None), e.g. from extract_bleedoff_window
+    for every stored incident. Returns a list aligned with windows of dicts:
+      tau_s, asymptote_mpa, amplitude_mpa, leak_rate_mpa_per_min,
+      rmse_mpa, r2, window_s, verdict
+    or None where a window was too short to fit.
+    """
+    results = [None] * len(windows)
+    valid = [
+        (i, np.asarray(w[0], dtype="float64"), np.asarray(w[1], dtype="float64"))
+        for i, w in enumerate(windows)
+        if w is not None and len(w[0]) >= DECAY_MIN_SAMPLES and w[0][-1] > w[0][0]
+    ]
+    taus = DECAY_TAU_GRID_S
+
+    for b in range(0, len(valid), DECAY_BATCH):
+        chunk = valid[b:b + DECAY_BATCH]
+        dur = np.array([t[-1] - t[0] for _, t, _ in chunk])
+        T = np.linspace(0.0, 1.0, DECAY_POINTS)[None, :] * dur[:, None]        # (W, M)
+        P = np.stack([np.interp(T[k], t - t[0], p) for k, (_, t, p) in enumerate(chunk)])
+        Tn = T / dur[:, None]                                                   # linear term scaled to [0, 1]
+        E = np.exp(-T[:, None, :] / taus[None, :, None])                        # (W, K, M)
+
+        m = float(DECAY_POINTS)
+        s_e = E.sum(-1)
+        s_ee = (E * E).sum(-1)
+        s_et = (E * Tn[:, None, :]).sum(-1)
+        s_t = np.broadcast_to(Tn.sum(-1)[:, None], s_e.shape)
+        s_tt = np.broadcast_to((Tn * Tn).sum(-1)[:, None], s_e.shape)
+        s_p = np.broadcast_to(P.sum(-1)[:, None], s_e.shape)
+        s_ep = (E * P[:, None, :]).sum(-1)
+        s_tp = np.broadcast_to((Tn * P).sum(-1)[:, None], s_e.shape)
+
+        A = np.empty(s_e.shape + (3, 3))
+        A[..., 0, 0] = m
+        A[..., 0, 1] = A[..., 1, 0] = s_e
+        A[..., 0, 2] = A[..., 2, 0] = s_t
+        A[..., 1, 1] = s_ee
+        A[..., 1, 2] = A[..., 2, 1] = s_et
+        A[..., 2, 2] = s_tt
+        rhs = np.stack([s_p, s_ep, s_tp], axis=-1)
+        A += np.eye(3) * 1e-9  # keeps very slow taus (E ~ linear) solvable
+
+        coef = np.linalg.solve(A, rhs[..., None])[..., 0]                       # (W, K, 3)
+        pp = (P * P).sum(-1)[:, None]
+        sse = np.clip(pp - (coef * rhs).sum(-1), 0.0, None)
+        best = np.argmin(sse, axis=1)
+        rows = np.arange(len(chunk))
+        c = coef[rows, best]
+        sse_best = sse[rows, best]
+        sst = ((P - P.mean(-1, keepdims=True)) ** 2).sum(-1)
+
+        for k, (i, _, _) in enumerate(chunk):
+            tau = float(taus[best[k]])
+            asymptote, amplitude, slope_n = (float(x) for x in c[k])
+            leak = max(0.0, float(-slope_n / dur[k] * 60.0))
+            results[i] = {
+                "tau_s": round(tau, 1),
+                "asymptote_mpa": round(asymptote, 2),
+                "amplitude_mpa": round(amplitude, 2),
+                "leak_rate_mpa_per_min": round(leak, 4),
+                "rmse_mpa": round(float(np.sqrt(sse_best[k] / m)), 3),
+                "r2": round(float(1.0 - sse_best[k] / sst[k]), 3) if sst[k] > 0 else None,
+                "window_s": round(float(dur[k]), 1),
+                "verdict": _decay_verdict(tau, amplitude, leak, float(dur[k])),
+            }
+    return results
+
+
+def fit_bleedoff_decay(t, p):
+    return fit_bleedoff_decay_batch([(t, p)])[0]
+
+
+def describe_bleedoff_fit(fit: dict) -> str:
+    """
+    One-sentence, report-ready description of a bleed-off fit.
+    """
+    meaning = {
+        "compressibility_relaxation": "consistent with fluid compressibility / thermal relaxation rather than a sustained leak",
+        "sustained_leak": "indicative of a sustained leak rather than compressibility / thermal relaxation alone",
+        "inconclusive": "inconclusive as to whether a sustained leak is present",
+    }[fit["verdict"]]
+    return (
+        f"Fitting the post-bump pressure decay from the EDR data ({fit['window_s']:.0f} s window) "
+        f"gives a time constant of ~{fit['tau_s']:.0f} s towards {fit['asymptote_mpa']}MPa with a "
+        f"residual leak rate of {fit['leak_rate_mpa_per_min']}MPa/min, which is {meaning}."
+    )
+
+
+def attach_edr_export(user_data: dict, source, overwrite: bool = False) -> dict:
+    """
+    Ingest an EDR export into user_data["edr"], fill blank fields from the
+    detected events and add the bleed-off fit (headless / watch-folder use;
+    the UI does the same steps interactively). Returns the events.
+    """
+    user_data["edr"] = ingest_edr_export(source)
+    series = load_edr_series(user_data["edr"])
+    events = detect_cementing_events(series)
+    if events:
+        apply_edr_events(user_data, events, overwrite=overwrite)
+        window = extract_bleedoff_window(series, events)
+        fit = fit_bleedoff_decay(*window) if window is not None else None
+        if fit:
+            user_data["bleedoff_fit"] = fit
+    return events
+
+
+# ============================================================
+# MONTE CARLO UNCERTAINTY (displacement and flowback)
+# ============================================================
+
+MC_DRAWS = 20000
+ATM_MPA = 0.101325
+
+# Sampled parameters: (low, high) are uniform bounds, *_SD are normal
+# standard deviations as a fraction of the reading.
+MC_CASING_TOLERANCE = 0.02             # +/- fraction if casing min/max are blank
+MC_METER_ERROR_SD = 0.01               # flow meter / stroke counter
+MC_GAUGE_ERROR_SD = 0.01               # surface pressure gauge
+MC_FLOWBACK_READING_SD = 0.10          # tank strap / flowback estimate
+MC_AERATION_FRACTION = (0.0, 0.002)    # free gas, volume fraction at surface
+MC_FLUID_COMPRESSIBILITY_PER_MPA = (4.0e-4, 5.0e-4)
+MC_BALLOONING_PER_MPA = (4.0e-5, 8.0e-5)
+MC_THERMAL_EXPANSION_PER_C = (2.0e-4, 4.0e-4)
+MC_WARMBACK_C = (0.0, 5.0)
+# Delivered volume within this fraction of casing volume counts as landed.
+MC_LANDED_FRACTION = 0.005
+
+_FLOWBACK_UNITS_L = {"m³": 1000.0, "m3": 1000.0, "l": 1.0, "bbl": 158.987}
+
+
+def parse_flowback_litres(text):
+    """
+    Free-text flowback ("≈1.0 m³ and still flowing", "250 L") -> (litres or
+    None, still_flowing).
+    """
+    if isinstance(text, (int, float)):
+        return float(text) * 1000.0, False
+    text = str(text or "")
+    still_flowing = bool(re.search(r"still flowing|continu", text, re.IGNORECASE))
+    m = re.search(r"(\d*\.?\d+)\s*(m³|m3|l\b|bbl)", text, re.IGNORECASE)
+    if not m:
+        return None, still_flowing
+    return float(m.group(1)) * _FLOWBACK_UNITS_L[m.group(2).lower()], still_flowing
+
+
+def _percentiles(x, digits: int = 2) -> dict:
+    p5, p50, p95 = np.percentile(x, [5, 50, 95])
+    return {"p5": round(float(p5), digits), "p50": round(float(p50), digits), "p95": round(float(p95), digits)}
+
+
+def run_uncertainty_analysis(user_data: dict, draws: int = MC_DRAWS, seed=None):
+    """
+    Sample casing volume (API 5CT wall tolerance via the min/max volumes),
+    meter and gauge error, aeration, fluid compressibility, ballooning and
+    warm-back, all as NumPy arrays of `draws` samples, and return:
+
+    - displacement_delta_m3: delivered displacement minus casing volume
+      (percentiles), p_under_displaced / p_over_displaced
+    - normal_flowback_L (and its compression_L / thermal_L parts): volume
+      expected back when the bump pressure is released
+    - p_flowback_exceeds_normal: chance the observed flowback is more than
+      that (None if flowback isn't given as a volume)
+
+    The seed defaults to a hash of the inputs so a report is reproducible.
+    Returns None without displacement, casing volume and bump pressure.
+    """
+    vt = user_data.get("volume_table") or {}
+    nominal = parse_numeric_range(vt.get("casing_vol_nominal_m3"))[0]
+    vmin = parse_numeric_range(vt.get("casing_vol_min_m3"))[0]
+    vmax = parse_numeric_range(vt.get("casing_vol_max_m3"))[0]
+    pumped = parse_numeric_range(user_data.get("displacement_pumped_m3"))[0]
+    bump = parse_numeric_range(user_data.get("bump_pressure_mpa"))[0]
+    fcp = parse_numeric_range(user_data.get("fcp_mpa"))[0]
+    if np.isnan(nominal) or np.isnan(pumped) or np.isnan(bump):
+        return None
+    if np.isnan(vmin) or np.isnan(vmax) or not vmin <= nominal <= vmax:
+        vmin, vmax = nominal * (1 - MC_CASING_TOLERANCE), nominal * (1 + MC_CASING_TOLERANCE)
+    if np.isnan(fcp):
+        fcp = bump
+    observed_L, still_flowing = parse_flowback_litres(user_data.get("flowback_volume"))
+
+    if seed is None:
+        key = json.dumps([nominal, vmin, vmax, pumped, bump, fcp, observed_L, draws])
+        seed = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:16], 16)
+    rng = np.random.default_rng(seed)
+
+    casing = rng.triangular(vmin, nominal, vmax, draws) if vmax > vmin else np.full(draws, nominal)
+    aeration = rng.uniform(*MC_AERATION_FRACTION, draws)
+    fluid_c = rng.uniform(*MC_FLUID_COMPRESSIBILITY_PER_MPA, draws)
+    balloon_c = rng.uniform(*MC_BALLOONING_PER_MPA, draws)
+    thermal_b = rng.uniform(*MC_THERMAL_EXPANSION_PER_C, draws)
+    warmback = rng.uniform(*MC_WARMBACK_C, draws)
+    p_bump = bump * (1 + rng.normal(0.0, MC_GAUGE_ERROR_SD, draws))
+    p_fcp = fcp * (1 + rng.normal(0.0, MC_GAUGE_ERROR_SD, draws))
+
+    # Displacement actually delivered to the plug: metered volume, less the
+    # free gas compressed out of it at displacement pressure.
+    delivered = pumped * (1 + rng.normal(0.0, MC_METER_ERROR_SD, draws))
+    delivered *= 1 - aeration * (1 - ATM_MPA / (ATM_MPA + p_fcp))
+    delta = delivered - casing
+    band = casing * MC_LANDED_FRACTION
+
+    # Volume returned when the bump pressure is bled to zero.
+    gas_L = aeration * casing * (1 - ATM_MPA / (ATM_MPA + p_bump)) * 1000.0
+    compression_L = (fluid_c + balloon_c) * casing * p_bump * 1000.0 + gas_L
+    thermal_L = thermal_b * casing * warmback * 1000.0
+    normal_L = compression_L + thermal_L
+
+    result = {
+        "draws": draws,
+        "displacement_delta_m3": _percentiles(delta),
+        "p_under_displaced": round(float(np.mean(delta < -band)), 3),
+        "p_over_displaced": round(float(np.mean(delta > band)), 3),
+        "normal_flowback_L": _percentiles(normal_L, 0),
+        "compression_L": _percentiles(compression_L, 0),
+        "thermal_L": _percentiles(thermal_L, 0),
+        "observed_flowback_L": observed_L,
+        "flowback_still_flowing": still_flowing,
+        "p_flowback_exceeds_normal": None,
+    }
+    if observed_L is not None:
+        observed = observed_L * (1 + rng.normal(0.0, MC_FLOWBACK_READING_SD, draws))
+        result["p_flowback_exceeds_normal"] = round(float(np.mean(observed > normal_L)), 3)
+    return result
+
+
+def describe_displacement_uncertainty(mc: dict) -> str:
+    d = mc["displacement_delta_m3"]
+    return (
+        f"A Monte Carlo analysis ({mc['draws']:,} draws over API 5CT wall tolerance, meter error and "
+        f"aeration) puts the delivered displacement at {d['p50']:+}m³ relative to the casing volume to "
+        f"the float collar (90% range {d['p5']:+} to {d['p95']:+}m³), giving a "
+        f"{mc['p_under_displaced']:.0%} probability of under-displacement and "
+        f"{mc['p_over_displaced']:.0%} of over-displacement."
+    )
+
+
+def describe_flowback_uncertainty(mc: dict) -> str:
+    n = mc["normal_flowback_L"]
+    text = (
+        f"Sampling fluid compressibility, casing ballooning, aeration, warm-back and gauge error gives an "
+        f"expected normal flowback of ~{n['p50']:.0f} L (90% range {n['p5']:.0f}–{n['p95']:.0f} L)"
+    )
+    if mc["p_flowback_exceeds_normal"] is None:
+        return text + "."
+    text += (
+        f"; the probability that the observed {mc['observed_flowback_L']:.0f} L exceeds normal "
+        f"compressibility is {mc['p_flowback_exceeds_normal']:.0%}"
+    )
+    if mc["flowback_still_flowing"]:
+        text += " (a lower bound, as flow had not stopped)"
+    return text + "."
+
+
+# ============================================================
+# HYDROSTATICS (differential pressure along the well path)
+# ============================================================
+
+GRAVITY = 9.80665
+
+# Used when the incident leaves a density blank (kg/m³); reported as assumed.
+PRESSURE_DEFAULT_DENSITIES = {
+    "displacement": 1000.0,   # fresh water
+    "annulus": 1150.0,        # drilling fluid / spacer above the cement
+    "lead": 1500.0,
+    "tail": 1900.0,
+}
+# Planned bump is typically 3.5-7 MPa over final circulating pressure.
+PRESSURE_BUMP_MARGIN_MPA = 3.5
+
+SURVEY_COLUMN_ALIASES = {
+    "md": "md", "measured_depth": "md", "depth": "md", "md_m": "md",
+    "tvd": "tvd", "true_vertical_depth": "tvd", "tvd_m": "tvd",
+    "inc": "inc", "incl": "inc", "inclination": "inc",
+    "azi": "azi", "azm": "azi", "azimuth": "azi",
+}
+
+
+def minimum_curvature_tvd(md, inc_deg, azi_deg):
+    """
+    TVD at each survey station by the minimum curvature method (first
+    station taken as TVD = MD).
+    """
+    md, inc, azi = (np.asarray(a, dtype=float) for a in (md, inc_deg, azi_deg))
+    inc, azi = np.radians(inc), np.radians(azi)
+    i1, i2, a1, a2 = inc[:-1], inc[1:], azi[:-1], azi[1:]
+    cos_dogleg = np.cos(i2 - i1) - np.sin(i1) * np.sin(i2) * (1.0 - np.cos(a2 - a1))
+    dogleg = np.arccos(np.clip(cos_dogleg, -1.0, 1.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(dogleg > 1e-9, 2.0 / dogleg * np.tan(dogleg / 2.0), 1.0)
+    d_tvd = np.diff(md) / 2.0 * (np.cos(i1) + np.cos(i2)) * ratio
+    return np.concatenate([[md[0]], md[0] + np.cumsum(d_tvd)])
+
+
+def parse_survey(source) -> dict:
+    """
+    Directional survey CSV (path or uploaded file) with MD and either TVD or
+    inclination / azimuth columns, in metres and degrees. Returns
+    {"md_m", "tvd_m", "source"} for user_data["survey"].
+    """
+    import pandas as pd
+
+    _, _, reader_source, name = _edr_source_digest(source)
+    df = pd.read_csv(reader_source, sep=None, engine="python")
+    df.columns = [SURVEY_COLUMN_ALIASES.get(_normalise_edr_column(c)[0], c) for c in df.columns]
+    if "md" not in df.columns:
+        raise ValueError("survey has no MD column")
+    df = df.apply(pd.to_numeric, errors="coerce").dropna(subset=["md"]).sort_values("md")
+    if "tvd" in df.columns and df["tvd"].notna().all():
+        tvd = df["tvd"].to_numpy()
+    elif {"inc", "azi"} <= set(df.columns):
+        tvd = minimum_curvature_tvd(df["md"], df["inc"].fillna(0.0), df["azi"].fillna(0.0))
+    else:
+        raise ValueError("survey needs a TVD column or inclination and azimuth")
+    return {
+        "md_m": np.round(df["md"].to_numpy(), 2).tolist(),
+        "tvd_m": np.round(tvd, 2).tolist(),
+        "source": name,
+    }
+
+
+def _parse_casing_od_mm(desc: str):
+    """
+    Largest OD in a string description ('4-1/2" ... x 5-1/2" ...') in mm.
+    """
+    sizes = []
+    for whole, num, den, dec in re.findall(r'(\d+)(?:-(\d)/(\d)|(\.\d+))?"', str(desc or "")):
+        inches = float(whole) + (float(num) / float(den) if den else float(dec or 0))
+        sizes.append(inches * 25.4)
+    return max(sizes) if sizes else np.nan
+
+
+def _pressure_setup(user_data: dict):
+    """
+    Stations and fluid layout for one incident, or None without a float
+    collar depth and TVD.
+    """
+    def num(path):
+        return parse_numeric_range(_get_path(user_data, path))[0]
+
+    fc, shoe = num("volume_table.float_collar_depth_m"), num("volume_table.shoe_depth_m")
+    well_tvd = num("volume_table.well_tvd_m")
+    survey = user_data.get("survey") or {}
+    if np.isnan(fc) or (np.isnan(well_tvd) and not survey.get("md_m")):
+        return None
+    if np.isnan(shoe) or shoe < fc:
+        shoe = fc
+
+    assumed = []
+    rho = {}
+    for fluid, default in PRESSURE_DEFAULT_DENSITIES.items():
+        rho[fluid] = num(f"fluids.{fluid}_density_kg_m3")
+        if np.isnan(rho[fluid]):
+            rho[fluid] = default
+            assumed.append(fluid)
+    if np.isnan(parse_numeric_range(user_data.get("cement_tail_m3"))[0]):
+        rho["tail"] = rho["lead"]
+    buoyant = num("fluids.buoyant_section_density_kg_m3")
+    airlock = num("volume_table.airlock_depth_m")
+
+    # Cement tops from the entries, else from volumes over the open-hole annulus.
+    hole_m = parse_numeric_range(user_data.get("hole_size_mm"))[0] / 1000.0
+    od_m = num("fluids.casing_od_mm")
+    od_m = (_parse_casing_od_mm(user_data.get("string_desc")) if np.isnan(od_m) else od_m) / 1000.0
+    capacity = np.pi / 4.0 * (hole_m ** 2 - od_m ** 2)
+    tail_m3 = np.nan_to_num(parse_numeric_range(user_data.get("cement_tail_m3"))[0])
+    lead_m3 = np.nan_to_num(parse_numeric_range(user_data.get("cement_lead_m3"))[0])
+    tail_top, toc = num("fluids.tail_top_m"), num("fluids.cement_top_m")
+    if np.isnan(tail_top):
+        tail_top = shoe - tail_m3 / capacity if capacity > 0 else shoe
+    if np.isnan(toc):
+        toc = tail_top - lead_m3 / capacity if capacity > 0 else np.nan
+        if np.isnan(toc):
+            assumed.append("cement_top")
+            toc = 0.0
+    excess = num("volume_table.excess_to_surface_m3")
+    if not np.isnan(excess) and excess > 0:
+        toc = 0.0
+    toc, tail_top = max(toc, 0.0), max(tail_top, 0.0)
+
+    if survey.get("md_m"):
+        s_md, s_tvd = np.asarray(survey["md_m"], dtype=float), np.asarray(survey["tvd_m"], dtype=float)
+    else:
+        # No survey: vertical to the well TVD, then lateral.
+        assumed.append("survey")
+        s_md = np.array([0.0, well_tvd, max(shoe, well_tvd)])
+        s_tvd = np.array([0.0, well_tvd, well_tvd])
+    key_depths = [0.0, fc, shoe, toc, tail_top, airlock, num("volume_table.crossover_depth_m")]
+    md = np.union1d(s_md[s_md <= shoe], [d for d in key_depths if 0.0 <= d <= shoe])
+    tvd = np.interp(md, np.concatenate([[0.0], s_md]), np.concatenate([[0.0], s_tvd]))
+
+    has_buoyant = not np.isnan(buoyant) and not np.isnan(airlock) and airlock < fc
+    return {
+        "md": md,
+        "tvd": tvd,
+        "fc": fc,
+        # Inside: displacement fluid (or the buoyant-section fluid below the
+        # airlock) down to the landed plug, shoe-track cement below it.
+        # Without a buoyant section its layer is empty (both bounds at fc).
+        "inside_bounds": [airlock if has_buoyant else fc, fc],
+        "inside_rho": [rho["displacement"], buoyant if has_buoyant else rho["displacement"], rho["tail"]],
+        # Annulus: mud / spacer to the top of cement, lead, tail.
+        "annulus_bounds": [toc, tail_top],
+        "annulus_rho": [rho["annulus"], rho["lead"], rho["tail"]],
+        "toc": toc,
+        "tail_top": tail_top,
+        "fcp": num("fcp_mpa"),
+        "bump": num("bump_pressure_mpa"),
+        "assumed": assumed,
+    }
+
+
+def pressure_profiles_batch(incidents: list, keep_profile: bool = False) -> list:
+    """
+    Hydrostatic and differential pressures for many incidents at once.
+
+    Each incident's stations (survey MDs plus float collar, shoe, cement
+    tops, airlock and crossover) are padded into one (incidents x stations)
+    array; densities come from the fluid layout per segment and pressures
+    are cumulative sums of rho * g * dTVD, so thousands of stations over
+    many incidents cost a few array passes. Per incident returns None or:
+      fc_tvd_m, annulus_fc_mpa / inside_fc_mpa (hydrostatic at the float
+      collar), lift_pressure_mpa (annulus minus inside: static part of the
+      final circulating pressure, and what the floats hold after bleed-off),
+      friction_estimate_mpa (recorded FCP minus lift), expected_bump_mpa,
+      bump_differential_fc_mpa / max_bump_differential_mpa (+ _md_m)
+      (inside over outside along the string at the recorded bump pressure),
+      cement_top_m, tail_top_m, stations, assumed (defaulted inputs).
+    keep_profile adds the per-station arrays ("profile").
+    """
+    setups = [_pressure_setup(ud) for ud in incidents]
+    valid = [i for i, setup in enumerate(setups) if setup]
+    results = [None] * len(incidents)
+    if not valid:
+        return results
+
+    n, m = len(valid), max(len(setups[i]["md"]) for i in valid)
+    md, tvd = np.full((n, m), np.nan), np.full((n, m), np.nan)
+    for row, i in enumerate(valid):
+        k = len(setups[i]["md"])
+        md[row, :k], tvd[row, :k] = setups[i]["md"], setups[i]["tvd"]
+
+    def stack(key):
+        return np.array([setups[i][key] for i in valid], dtype=float)
+
+    mid = (md[:, 1:] + md[:, :-1]) / 2.0
+    d_tvd = np.nan_to_num(np.diff(tvd, axis=1))
+
+    def column_mpa(bounds, rho):
+        layer = (mid[:, :, None] >= bounds[:, None, :]).sum(axis=2)
+        seg = np.take_along_axis(rho, layer, axis=1) * GRAVITY * d_tvd / 1e6
+        return np.concatenate([np.zeros((n, 1)), np.cumsum(seg, axis=1)], axis=1)
+
+    inside = column_mpa(stack("inside_bounds"), stack("inside_rho"))
+    annulus = column_mpa(stack("annulus_bounds"), stack("annulus_rho"))
+    fc_idx = np.nanargmin(np.abs(md - stack("fc")[:, None]), axis=1)
+    rows = np.arange(n)
+    lift = annulus[rows, fc_idx] - inside[rows, fc_idx]
+    fcp, bump = stack("fcp"), stack("bump")
+    above_fc = md <= stack("fc")[:, None]
+    bump_diff = np.where(above_fc, bump[:, None] + inside - annulus, -np.inf)
+    max_idx = np.argmax(bump_diff, axis=1)
+
+    def r(x):
+        return None if np.isnan(x) else round(float(x), 2)
+
+    for row, i in enumerate(valid):
+        setup = setups[i]
+        results[i] = {
+            "fc_tvd_m": r(tvd[row, fc_idx[row]]),
+            "annulus_fc_mpa": r(annulus[row, fc_idx[row]]),
+            "inside_fc_mpa": r(inside[row, fc_idx[row]]),
+            "lift_pressure_mpa": r(lift[row]),
+            "friction_estimate_mpa": r(fcp[row] - lift[row]),
+            "expected_bump_mpa": r((lift[row] if np.isnan(fcp[row]) else fcp[row]) + PRESSURE_BUMP_MARGIN_MPA),
+            "bump_differential_fc_mpa": r(bump[row] - lift[row]),
+            "max_bump_differential_mpa": r(bump_diff[row, max_idx[row]]) if not np.isnan(bump[row]) else None,
+            "max_bump_differential_md_m": r(md[row, max_idx[row]]) if not np.isnan(bump[row]) else None,
+            "cement_top_m": r(setup["toc"]),
+            "tail_top_m": r(setup["tail_top"]),
+            "stations": len(setup["md"]),
+            "assumed": setup["assumed"],
+        }
+        if keep_profile:
+            k = len(setup["md"])
+            results[i]["profile"] = {
+                "md_m": md[row, :k], "tvd_m": tvd[row, :k],
+                "inside_mpa": inside[row, :k], "annulus_mpa": annulus[row, :k],
+            }
+    return results
+
+
+def pressure_profile(user_data: dict, keep_profile: bool = False):
+    return pressure_profiles_batch([user_data], keep_profile=keep_profile)[0]
+
+
+def has_hydrostatics_inputs(user_data: dict) -> bool:
+    """
+    Hydrostatics are opt-in: an incident gets user_data["pressure"] (and the
+    report section) only once a fluids entry or a survey is given.
+    """
+    fluids = user_data.get("fluids") or {}
+    return any(v not in (None, "") for v in fluids.values()) or bool((user_data.get("survey") or {}).get("md_m"))
+
+
+def describe_pressure_profile(pp: dict) -> str:
+    text = (
+        f"Hydrostatic lift pressure at the float collar ({pp['fc_tvd_m']} m TVD) is {pp['lift_pressure_mpa']}MPa "
+        f"(annulus {pp['annulus_fc_mpa']}MPa vs inside casing {pp['inside_fc_mpa']}MPa)"
+    )
+    if pp["friction_estimate_mpa"] is not None:
+        text += f", leaving ~{pp['friction_estimate_mpa']}MPa of the recorded FCP as friction"
+    text += f"; expected bump pressure ~{pp['expected_bump_mpa']}MPa."
+    if pp["max_bump_differential_mpa"] is not None:
+        text += (
+            f" At the recorded bump pressure the casing saw up to {pp['max_bump_differential_mpa']}MPa "
+            f"internal differential (at {pp['max_bump_differential_md_m']} mMD)."
+        )
+    if pp["assumed"]:
+        text += f" Assumed typical values for: {', '.join(pp['assumed'])}."
+    return text
+
+
+# ============================================================
+# EDR CHARTS (matplotlib Agg, LTTB downsampling, PNG cache)
+# ============================================================
+
+# Bump when chart styling changes so cached PNGs are re-rendered.
+CHART_RENDER_VERSION = 2
+CHART_MAX_POINTS = 2000
+
+# Standard chart set rendered for every incident with EDR data.
+EDR_CHART_SPECS = [
+    {
+        "name": "spp",
+        "title": "Standpipe Pressure",
+        "channel": "spp_mpa",
+        "ylabel": "SPP (MPa)",
+        "color": "tab:red",
+        "hlines": [
+            ("fcp_mpa", "FCP", "tab:orange"),
+            ("bump_pressure_mpa", "Bump", "tab:purple"),
+            ("bledoff_to_mpa", "Bled-off", "tab:gray"),
+        ],
+        "events": [
+            ("fcp_mpa", "FCP", "tab:orange"),
+            ("bump_pressure_mpa", "Bump", "tab:purple"),
+            ("bledoff_to_mpa", "Bled-off", "tab:gray"),
+        ],
+    },
+    {
+        "name": "pump_rate",
+        "title": "Pump Rate",
+        "channel": "rate_m3_per_min",
+        "ylabel": "Rate (m³/min)",
+        "color": "tab:blue",
+        "hlines": [("pump_rate_m3_per_min", "Design rate", "tab:gray")],
+        "events": [("displacement_start", "Displacement start", "tab:gray")],
+    },
+    {
+        "name": "cumulative_volume",
+        "title": "Cumulative Displacement",
+        "channel": "volume_m3",
+        "ylabel": "Volume (m³)",
+        "color": "tab:green",
+        "hlines": [("displacement_pumped_m3", "Reported displacement", "tab:purple")],
+        "events": [("displacement_pumped_m3", "Pumps off", "tab:purple")],
+    },
+]
+
+# Full size for the Word appendix; compact for the Grok payload.
+CHART_PROFILES = {
+    "full": {"figsize": (8.0, 3.2), "dpi": 150},
+    "compact": {"figsize": (6.0, 2.4), "dpi": 72},
+}
+
+
+def lttb_downsample(x, y, n_out: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Keeps the visual shape
+    (spikes, bump peaks) of a long series with n_out points.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # Bucket edges for the n_out - 2 interior buckets.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+
+    # Average point of each bucket (used as the "next" vertex of the triangle).
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(np.append(edges, n - 1))[: edges.size - 1].clip(min=1)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+def _chart_cache_key(edr_ref: dict, spec: dict, annotations: dict, profile: str) -> str:
+    blob = json.dumps(
+        {
+            "v": CHART_RENDER_VERSION,
+            "data": edr_ref["file_hash"],
+            "spec": spec,
+            "annotations": annotations,
+            "profile": CHART_PROFILES[profile],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _render_chart_png(series: dict, spec: dict, annotations: dict, profile: str) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    t_h = np.asarray(series["time_s"]) / 3600.0
+    y = np.nan_to_num(np.asarray(series[spec["channel"]], dtype="float64"))
+    xs, ys = lttb_downsample(t_h, y, CHART_MAX_POINTS)
+
+    prof = CHART_PROFILES[profile]
+    # Figure + Agg canvas directly (no pyplot) so rendering is thread-safe.
+    fig = Figure(figsize=prof["figsize"], dpi=prof["dpi"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.plot(xs, ys, color=spec["color"], linewidth=1.0)
+    for label, (value, color) in annotations["hlines"].items():
+        ax.axhline(value, color=color, linestyle="--", linewidth=0.8)
+        ax.annotate(
+            f"{label} {value:g}", xy=(xs[-1] if xs.size else 0, value),
+            xytext=(-4, 2), textcoords="offset points", ha="right", fontsize=7, color=color,
+        )
+    for label, (time_s, value, color) in annotations["events"].items():
+        x = time_s / 3600.0
+        ax.axvline(x, color=color, linestyle=":", linewidth=0.8)
+        if value is None:
+            ax.annotate(
+                label, xy=(x, 1.0), xycoords=ax.get_xaxis_transform(),
+                xytext=(2, -8), textcoords="offset points", fontsize=7, color=color,
+            )
+        else:
+            ax.plot([x], [value], marker="o", markersize=3, color=color)
+            ax.annotate(
+                f"{label} {value:g}", xy=(x, value),
+                xytext=(3, 3), textcoords="offset points", fontsize=7, color=color,
+            )
+    ax.set_title(spec["title"], fontsize=9)
+    ax.set_xlabel("Elapsed time (h)", fontsize=8)
+    ax.set_ylabel(spec["ylabel"], fontsize=8)
+    ax.tick_params(labelsize=7)
+    ax.grid(True, linewidth=0.3)
+    fig.tight_layout()
+
+    bio = BytesIO()
+    fig.savefig(bio, format="png")
+    return bio.getvalue()
+
+
+def render_edr_charts(user_data: dict, profile: str = "full", cache_dir: str = CHART_CACHE_DIR):
+    """
+    Render the standard EDR chart set for an incident with user_data["edr"].
+
+    Returns a list in the same shape as encode_uploaded_images():
+      [{"filename", "mime_type", "b64"}]
+    so charts can go straight into build_docx_bytes / the Grok payload.
+    Events detected in the EDR data (user_data["edr_events"]) are marked at
+    their times; a field without a detected event falls back to a horizontal
+    line at the entered value. PNGs are cached on disk by (EDR file hash,
+    chart spec, annotations, profile).
+    """
+    edr_ref = user_data.get("edr")
+    if not edr_ref:
+        return []
+
+    events = user_data.get("edr_events") or {}
+    series = None
+    charts = []
+    for spec in EDR_CHART_SPECS:
+        if spec["channel"] not in edr_ref["channels"]:
+            continue
+        marked = {
+            key: (label, events[key], color)
+            for key, label, color in spec["events"]
+            if isinstance(events.get(key), dict) and events[key].get("time_s") is not None
+        }
+        annotations = {
+            "hlines": {
+                label: (float(user_data[field]), color)
+                for field, label, color in spec["hlines"]
+                if field not in marked and isinstance(user_data.get(field), (int, float))
+            },
+            "events": {
+                label: (float(ev["time_s"]), ev["value"], color)
+                for label, ev, color in marked.values()
+            },
+        }
+        key = _chart_cache_key(edr_ref, spec, annotations, profile)
+        path = os.path.join(cache_dir, f"{key}.png")
+
+        if os.path.exists(path):
+            with open(path, "rb") as fh:
+                png = fh.read()
+        else:
+            if series is None:
+                series = load_edr_series(edr_ref)
+            png = _render_chart_png(series, spec, annotations, profile)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_path, "wb") as fh:
+                fh.write(png)
+            os.replace(tmp_path, path)
+
+        charts.append({
+            "filename": f"EDR – {spec['title']}",
+            "mime_type": "image/png",
+            "b64": base64.b64encode(png).decode("utf-8"),
+        })
+    return charts
+
+
+# ============================================================
+# GROK RATE LIMITING (token buckets, optional cross-process file lock)
+# ============================================================
+
+GROK_RPM_LIMIT = int(os.environ.get("INCIDENT_BUILDER_GROK_RPM", "30"))
+GROK_TPM_LIMIT = int(os.environ.get("INCIDENT_BUILDER_GROK_TPM", "200000"))
+# Set to a shared path to budget across processes (batch workers + server).
+GROK_RATE_STATE_PATH = os.environ.get("INCIDENT_BUILDER_GROK_RATE_FILE") or None
+GROK_429_RETRIES = 3
+
+
+class GrokRateLimiter:
+    """
+    Two token buckets (requests/min and tokens/min) in front of every Grok
+    request. Callers queue FIFO and wait for budget instead of failing.
+
+    With state_path set, bucket levels live in a small JSON file guarded by
+    fcntl.flock so several processes share one budget (FIFO ordering is only
+    guaranteed within a process). The file is only read and written outside
+    the queue's condition, so waiting threads and notify() never block on
+    disk I/O or on other processes' locks.
+    """
+
+    def __init__(self, rpm: int = GROK_RPM_LIMIT, tpm: int = GROK_TPM_LIMIT, state_path=GROK_RATE_STATE_PATH):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = state_path
+        self._cond = threading.Condition()
+        self._state_lock = threading.Lock()  # in-memory bucket state only
+        self._queue = deque()
+        self._state = {"req": float(rpm), "tok": float(tpm), "ts": time.time(), "blocked_until": 0.0}
+
+    # ----- bucket state (memory or shared file) -----------------------------
+
+    def _with_state(self, fn):
+        if not self.state_path:
+            with self._state_lock:
+                return fn(self._state)
+        import fcntl
+
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path, "a+", encoding="utf-8") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                state = json.loads(raw) if raw.strip() else dict(self._state)
+                result = fn(state)
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(state))
+                return result
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _try_take(self, state, tokens: float) -> float:
+        """
+        Refill, then take 1 request + tokens if available. Returns 0.0 on
+        success or the seconds to wait before trying again.
+        """
+        now = time.time()
+        elapsed = max(0.0, now - state["ts"])
+        state["req"] = min(self.rpm, state["req"] + elapsed * self.rpm / 60.0)
+        state["tok"] = min(self.tpm, state["tok"] + elapsed * self.tpm / 60.0)
+        state["ts"] = now
+        if now < state.get("blocked_until", 0.0):
+            return state["blocked_until"] - now
+        need_req = max(0.0, 1.0 - state["req"]) * 60.0 / self.rpm
+        need_tok = max(0.0, tokens - state["tok"]) * 60.0 / self.tpm
+        wait_s = max(need_req, need_tok)
+        if wait_s <= 0.0:
+            state["req"] -= 1.0
+            state["tok"] -= tokens
+        return wait_s
+
+    # ----- public API --------------------------------------------------------
+
+    def acquire(self, tokens: float) -> float:
+        """
+        Block until one request and `tokens` tokens are available; returns the
+        seconds spent waiting. Requests larger than the TPM budget are clamped
+        so they can still go out (on a full bucket).
+        """
+        tokens = min(float(tokens), float(self.tpm))
+        ticket = object()
+        start = time.perf_counter()
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    while self._queue[0] is not ticket:
+                        self._cond.wait(timeout=1.0)
+                # Head of the queue: take budget without holding the condition.
+                wait_s = self._with_state(lambda st: self._try_take(st, tokens))
+                if wait_s <= 0.0:
+                    break
+                with self._cond:
+                    self._cond.wait(timeout=min(wait_s, 5.0))
+        finally:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+        return time.perf_counter() - start
+
+    def try_acquire(self, tokens: float) -> bool:
+        """
+        Take one request and `tokens` only if they are available right now
+        and nobody is queued; never waits (used for speculative hedges).
+        """
+        tokens = min(float(tokens), float(self.tpm))
+        with self._cond:
+            if self._queue:
+                return False
+        return self._with_state(lambda st: self._try_take(st, tokens)) <= 0.0
+
+    def penalize(self, seconds: float):
+        """
+        Pause everyone after a 429 (honours Retry-After).
+        """
+        def block(state):
+            state["blocked_until"] = max(state.get("blocked_until", 0.0), time.time() + seconds)
+        self._with_state(block)
+
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+
+def estimate_grok_tokens(payload: dict) -> int:
+    """
+    Rough token estimate for rate budgeting: ~4 characters per text token,
+    the completion budget, and per-image tiles (85 + 170 per 512 px tile,
+    from the image header via Pillow; ~1 token per 750 bytes if unreadable).
+    """
+    text_chars = 0
+    image_tokens = 0
+    for msg in payload.get("messages", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            text_chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                text_chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                image_tokens += _estimate_image_tokens(part["image_url"]["url"])
+    return int(text_chars / 4) + int(payload.get("max_tokens", 0)) + image_tokens
+
+
+def _estimate_image_tokens(data_url: str) -> int:
+    b64 = data_url.split(",", 1)[-1]
+    try:
+        from PIL import Image
+
+        # Only the header is needed for the size.
+        head = base64.b64decode(b64[:65536] + "=" * (-len(b64[:65536]) % 4))
+        w, h = Image.open(BytesIO(head)).size
+        tiles = -(-w // 512) * -(-h // 512)
+        return 85 + 170 * tiles
+    except Exception:
+        return int(len(b64) * 3 / 4 / 750)
+
+
+def grok_rate_limiter() -> GrokRateLimiter:
+    return shared_resource("grok_rate_limiter", GrokRateLimiter)
+
+
+# ============================================================
+# Grok transport – hedged requests / model fallback + latency log
+# ============================================================
+
+GROK_URL = "https://api.x.ai/v1/chat/completions"
+GROK_TIMEOUT_S = 90
+
+# Hedging: if the first request hasn't answered after the given latency
+# percentile of recent calls, fire a second one and take whichever wins.
+HEDGE_DEFAULT_DELAY_S = 30.0   # used until enough history exists
+HEDGE_MIN_DELAY_S = 5.0
+HEDGE_MIN_HISTORY = 20
+GROK_LATENCY_HISTORY = 500
+# A hedge fired while the primary is still in flight only uses rate budget
+# that is free right now, and at most this many go out per minute.
+HEDGE_MAX_PER_MIN = 6
+# Read timeout (silence between bytes / streamed chunks) is GROK_TIMEOUT_S
+# on every path, so a slow reasoning model fails the same hedged or not.
+GROK_CONNECT_TIMEOUT_S = 10
+
+_hedge_times = deque()  # perf_counter() of recent speculative hedges
+
+
+class HedgeSkipped(RuntimeError):
+    """A speculative hedge was not sent (no free rate budget / hedge cap)."""
+
+_grok_metrics_lock = threading.Lock()
+_grok_latencies = None  # deque of recent un-hedged successful latencies (seconds)
+
+
+def _grok_latency_history():
+    global _grok_latencies
+    with _grok_metrics_lock:
+        if _grok_latencies is None:
+            _grok_latencies = deque(maxlen=GROK_LATENCY_HISTORY)
+            for rec in read_grok_metrics()[-GROK_LATENCY_HISTORY:]:
+                if rec.get("ok") and rec.get("winner") == "primary":
+                    _grok_latencies.append(rec["latency_s"])
+        return _grok_latencies
+
+
+def read_grok_metrics(path: str = None):
+    path = path or GROK_METRICS_PATH
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def _record_grok_call(info: dict):
+    history = _grok_latency_history()
+    with _grok_metrics_lock:
+        if info["ok"] and info["winner"] == "primary":
+            history.append(info["latency_s"])
+        os.makedirs(os.path.dirname(GROK_METRICS_PATH) or ".", exist_ok=True)
+        with open(GROK_METRICS_PATH, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(info) + "\n")
+
+
+def hedge_delay_for_percentile(percentile: float) -> float:
+    """
+    Hedge delay = given percentile of recent primary latencies, clamped to
+    [HEDGE_MIN_DELAY_S, GROK_TIMEOUT_S]. Falls back to HEDGE_DEFAULT_DELAY_S
+    until HEDGE_MIN_HISTORY calls have been seen.
+    """
+    history = list(_grok_latency_history())
+    if len(history) < HEDGE_MIN_HISTORY:
+        return HEDGE_DEFAULT_DELAY_S
+    delay = float(np.percentile(history, percentile))
+    return min(max(delay, HEDGE_MIN_DELAY_S), float(GROK_TIMEOUT_S))
+
+
+def _estimate_latency_saved(censored_at_s: float, winner_latency_s: float) -> float:
+    # The cancelled primary's latency is only known to exceed censored_at_s;
+    # use the mean of historical latencies beyond that point as its estimate.
+    history = np.asarray(list(_grok_latency_history()), dtype="float64")
+    tail = history[history > censored_at_s]
+    expected = float(tail.mean()) if tail.size else censored_at_s
+    return round(max(0.0, expected - winner_latency_s), 2)
+
+
+def _take_hedge_slot() -> bool:
+    now = time.perf_counter()
+    with _grok_metrics_lock:
+        while _hedge_times and now - _hedge_times[0] > 60.0:
+            _hedge_times.popleft()
+        if len(_hedge_times) >= HEDGE_MAX_PER_MIN:
+            return False
+        _hedge_times.append(now)
+        return True
+
+
+def _read_grok_stream(resp, cancel, deadline: float) -> str:
+    """
+    Message content from a streamed (SSE) chat completion. Checks `cancel`
+    between chunks; closing the response drops the connection, which is what
+    stops the server generating (and billing) for an abandoned attempt.
+    """
+    parts = []
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if cancel.is_set():
+                raise HedgeSkipped("cancelled: the other hedged attempt won")
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Grok stream exceeded {GROK_TIMEOUT_S}s")
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)["choices"][0].get("delta") or {}
+            parts.append(delta.get("content") or "")
+    finally:
+        resp.close()
+    return "".join(parts)
+
+
+def _grok_attempt(session, payload: dict, api_key: str, attempt: dict, cancel=None,
+                  speculative: bool = False) -> dict:
+    """
+    One request through the rate limiter. 429s wait (Retry-After or
+    exponential backoff) and re-queue instead of failing. Queue wait, retries
+    and whether the request has left the queue are tracked in `attempt`.
+
+    With `cancel` (an Event) the response is streamed and abandoned once the
+    event is set (see _read_grok_stream). A speculative attempt (a hedge
+    while the primary is still in flight) is only sent if rate budget is
+    free right now, and is not retried after a 429; otherwise it raises
+    HedgeSkipped.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    limiter = grok_rate_limiter()
+    tokens = estimate_grok_tokens(payload)
+    attempt.update(est_tokens=tokens, queue_wait_s=0.0, retries_429=0, sent=False)
+    if cancel is not None:
+        payload = dict(payload, stream=True)
+    timeout = (GROK_CONNECT_TIMEOUT_S, GROK_TIMEOUT_S)
+    deadline = time.perf_counter() + GROK_TIMEOUT_S
+    for retry in range(GROK_429_RETRIES + 1):
+        if speculative:
+            if not limiter.try_acquire(tokens):
+                raise HedgeSkipped("no free rate budget for a hedge")
+        else:
+            attempt["queue_wait_s"] += limiter.acquire(tokens)
+        if cancel is not None and cancel.is_set():
+            raise HedgeSkipped("cancelled: the other hedged attempt won")
+        attempt["sent"] = True
+        resp = session.post(GROK_URL, json=payload, headers=headers, timeout=timeout, stream=cancel is not None)
+        if resp.status_code != 429 or retry == GROK_429_RETRIES or speculative:
+            break
+        resp.close()
+        attempt["retries_429"] += 1
+        retry_after = resp.headers.get("Retry-After", "")
+        limiter.penalize(float(retry_after) if _is_number(retry_after) else 2.0 ** (retry + 1))
+    if resp.status_code == 429:
+        retry_after = resp.headers.get("Retry-After", "")
+        limiter.penalize(float(retry_after) if _is_number(retry_after) else 2.0)
+    if resp.status_code >= 400:
+        resp.close()
+    resp.raise_for_status()
+    if cancel is not None:
+        ai_text = _read_grok_stream(resp, cancel, deadline).strip()
+        with memory_stage("response_parse"):
+            return json.loads(ai_text)
+    with memory_stage("response_parse"):
+        data = resp.json()
+        ai_text = data["choices"][0]["message"]["content"].strip()
+        return json.loads(ai_text)
+
+
+def call_grok(payload: dict, api_key: str, hedge_percentile=None, fallback_model=None):
+    """
+    POST the chat payload and return (parsed_json, call_info).
+
+    With hedge_percentile set, a second request (to fallback_model, or the same
+    model) is fired if the first hasn't returned valid JSON within the hedge
+    delay, or immediately if the first fails. The first valid JSON wins.
+    Both hedged requests stream their responses over the shared session.
+    "Cancelling" the loser sets its event; it closes its response (dropping
+    the connection, so generation stops) at its next streamed chunk, or when
+    its read times out if the server is silent. Tokens it already generated
+    are still billed. A hedge sent while the primary is in flight uses only
+    free rate budget and is capped at HEDGE_MAX_PER_MIN (see _grok_attempt);
+    if it was skipped and the primary then fails, the fallback is still sent
+    as an ordinary attempt.
+
+    call_info is also appended to the Grok metrics log for tuning the delay.
+    Raises the last error if every attempt fails.
+    """
+    info = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "model": payload["model"],
+        "hedged": False,
+        "hedge_delay_s": None,
+        "winner": None,
+        "ok": False,
+        "latency_s": None,
+        "latency_saved_s": 0.0,
+    }
+    start = time.perf_counter()
+    attempts = {"primary": {}, "hedge": {}}
+
+    if hedge_percentile is None:
+        try:
+            session = shared_resource("grok_session", _build_grok_session)
+            parsed = _grok_attempt(session, payload, api_key, attempts["primary"])
+            info.update(ok=True, winner="primary")
+            return parsed, info
+        except Exception as e:
+            e.grok_call = info
+            raise
+        finally:
+            info["latency_s"] = round(time.perf_counter() - start, 2)
+            _finish_call_info(info, attempts)
+            _record_grok_call(info)
+
+    delay = hedge_delay_for_percentile(hedge_percentile)
+    info["hedge_delay_s"] = round(delay, 2)
+    hedge_payload = dict(payload, model=fallback_model or payload["model"])
+
+    # Pooled session for both legs; each streams, so it can be abandoned.
+    session = shared_resource("grok_session", _build_grok_session)
+    cancel = {"primary": threading.Event(), "hedge": threading.Event()}
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="grok")
+    futures = {
+        pool.submit(
+            _grok_attempt, session, payload, api_key, attempts["primary"], cancel["primary"]
+        ): "primary"
+    }
+    hedge_future = None
+    hedge_started = None
+    speculative_tried = False
+    last_error = None
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED, timeout=delay)
+            succeeded = [f for f in done if f.exception() is None]
+            if not succeeded:
+                for f in done:
+                    if isinstance(f.exception(), HedgeSkipped):
+                        # Never sent: the primary failing later still gets a fallback.
+                        info["hedge_skipped"] = str(f.exception())
+                        hedge_future = None
+                    else:
+                        last_error = f.exception()
+                if not done and not attempts["primary"].get("sent"):
+                    # Primary still queued behind the rate limiter: hedging would only add load.
+                    continue
+                # Slow primary -> one speculative hedge (see _grok_attempt);
+                # failed primary -> an ordinary attempt, whatever was skipped.
+                speculative = bool(pending)
+                if hedge_future is None and not (speculative and speculative_tried):
+                    if speculative:
+                        speculative_tried = True
+                        if not _take_hedge_slot():
+                            info["hedge_skipped"] = f"hedge cap ({HEDGE_MAX_PER_MIN}/min) reached"
+                            continue
+                    hedge_started = time.perf_counter() - start
+                    info["hedge_model"] = hedge_payload["model"]
+                    hedge_future = pool.submit(
+                        _grok_attempt, session, hedge_payload, api_key, attempts["hedge"],
+                        cancel["hedge"], speculative,
+                    )
+                    futures[hedge_future] = "hedge"
+                    pending.add(hedge_future)
+                continue
+            winner_future = succeeded[0]
+            winner = futures[winner_future]
+            latency = time.perf_counter() - start
+            info.update(ok=True, winner=winner)
+            primary = next(f for f, name in futures.items() if name == "primary")
+            if winner == "hedge" and not (primary.done() and primary.exception() is not None):
+                info["latency_saved_s"] = _estimate_latency_saved(latency, latency - hedge_started)
+            return winner_future.result(), info
+        raise last_error or RuntimeError("Grok request failed")
+    except Exception as e:
+        e.grok_call = info
+        raise
+    finally:
+        info["latency_s"] = round(time.perf_counter() - start, 2)
+        info["hedged"] = attempts["hedge"].get("sent", False)
+        for event in cancel.values():
+            event.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        _finish_call_info(info, attempts)
+        _record_grok_call(info)
+
+
+def _finish_call_info(info: dict, attempts: dict):
+    # Report the rate-limit figures of the attempt that produced the result.
+    used = attempts.get(info.get("winner") or "primary") or attempts["primary"]
+    info["est_tokens"] = used.get("est_tokens")
+    info["queue_wait_s"] = round(used.get("queue_wait_s", 0.0), 2)
+    info["retries_429"] = used.get("retries_429", 0)
+
+
+def summarize_grok_metrics(records=None) -> dict:
+    """
+    Hedge rate, win rate, latency percentiles and total estimated latency saved
+    from the Grok metrics log.
+    """
+    records = read_grok_metrics() if records is None else records
+    if not records:
+        return {"calls": 0}
+    lat = np.array([r["latency_s"] for r in records if r.get("latency_s") is not None])
+    hedged = [r for r in records if r.get("hedged")]
+    return {
+        "calls": len(records),
+        "failures": sum(1 for r in records if not r.get("ok")),
+        "latency_p50_s": round(float(np.percentile(lat, 50)), 2) if lat.size else None,
+        "latency_p95_s": round(float(np.percentile(lat, 95)), 2) if lat.size else None,
+        "hedge_rate": round(len(hedged) / len(records), 3),
+        "hedge_wins": sum(1 for r in hedged if r.get("winner") == "hedge"),
+        "latency_saved_s": round(sum(r.get("latency_saved_s") or 0.0 for r in records), 1),
+    }
+
+
+# ============================================================
+# Grok call – with optional images
+# ============================================================
+
+# Image types accepted by the uploader (and picked up from watch folders).
+IMAGE_UPLOAD_TYPES = ["png", "jpg", "jpeg", "webp"]
+
+
+def encode_uploaded_images(uploaded_files):
+    """
+    Turn Streamlit uploaded files into a list of dicts:
+    [
+      {
+        "filename": ...,
+        "mime_type": ...,
+        "b64": "<base64 string>"
+      }
+    ]
+    """
+    images = []
+    for f in uploaded_files:
+        raw = f.getvalue()
+        if not raw:
+            continue
+        b64 = base64.b64encode(raw).decode("utf-8")
+        mime = f.type or "image/png"
+        images.append({
+            "filename": f.name,
+            "mime_type": mime,
+            "b64": b64,
+        })
+    return images
+
+
+def encode_image_files(paths):
+    """
+    Same output as encode_uploaded_images(), for image files on disk
+    (headless / batch use).
+    """
+    images = []
+    for path in paths:
+        with open(path, "rb") as fh:
+            raw = fh.read()
+        if not raw:
+            continue
+        images.append({
+            "filename": os.path.basename(path),
+            "mime_type": mimetypes.guess_type(path)[0] or "image/png",
+            "b64": base64.b64encode(raw).decode("utf-8"),
+        })
+    return images
+
+
+def build_system_instruction() -> str:
+    """
+    Compile the Grok system prompt (root-cause module list + rules). It does
+    not depend on the incident, so it is built once and held as a shared resource.
+    """
+    # allowed_modules = [
+    #     "incorrect_pumping_volume",
+    #     "compressibility_ballooning",
+    #     "failure_prior_to_cementing",
+    #     "mismatched_receptacle",
+    #     "debris_on_collar",
+    #     "third_party_integrity"
+    # ]
+
+    allowed_modules = [
+    # Core modules
+    "incorrect_pumping_volume",
+    "compressibility_ballooning",
+    "failure_prior_to_cementing",
+    "mismatched_receptacle",
+    "debris_on_collar",
+    "third_party_integrity",
+
+    # From CIR-25-19+ to 31 series
+    "plug_bumped_early_not_latched",
+    "valve_or_plunger_sticking",
+    "plug_damaged_or_deformed",
+    "float_valve_leakback",
+    "third_party_port_leakage",
+    "plug_misalignment_in_latch",
+    "premature_float_activation",
+    "hydraulic_lock_during_displacement",
+    "damaged_float_shoe_face",
+    "gas_cut_fluid_in_cement",
+    "operational_interruption_during_bump",
+    "mechanical_damage_during_drillout",
+
+    # From CIR-25-12 to 18 series
+    "no_plug_bump_no_test",
+    "plug_landed_but_not_tested",
+    "float_valve_did_not_close",
+    "float_valve_stuck_open",
+    "plug_receptacle_tolerance_issue",
+    "underdisplacement_due_to_rate_cutback",
+    "cement_channel_or_bypass",
+    "fractured_float_body",
+    "plug_assembly_contamination",
+    "flowback_through_toe",
+    "premature_cement_cutoff",
+    "no_wits_data_verification",
+    "cb_sub_failed_burst_disk",
+
+    "float_shoe_damaged_during_run",
+    "float_valve_plugged_by_debris",
+    "float_valve_not_fully_closing",
+    "cold_weather_surface_issue",
+    "underdisplacement_due_to_operational_interruptions",
+    "plug_bypassed_or_not_latched",
+    "float_collar_or_shoe_leakage",
+    "buoyancy_disc_failure",
+
+    "no_plug_bump_inflow",
+    "plug_bypassed_or_damaged",
+    "valve_or_plunger_damaged_during_run",
+    "float_valve_leak_post_cement",
+    "staged_pump_shutdown_pressure_spike",
+    "segmented_plug_design_limitation",
+    "hydraulic_shock_during_burst",
+    "third_party_integrity_failure",
+    "compressibility_exceeds_expected",
+    "pressure_fluctuation_during_staging",
+    "plug_seat_misalignment",
+
+    "incomplete_air_displacement",
+    "compressibility_and_thermal_expansion",
+    "burst_disc_debris_bridging_valves",
+    "third_party_tool_communication",
+    "debris_from_casing_or_lcm",
+    "plug_not_seated_in_float_collar",
+    "connection_leak_above_float",
+    "incorrect_pumping_tolerance_margin",
+    "burst_port_or_toe_sleeve_misconfiguration",
+    "float_valve_partial_closure",
+]
+
+
+    # Build system instructions
+    system_instruction = f"""
+You are an experienced completions/cementing engineer writing an internal incident investigation report for CCAI.
+
+Tone rules:
+- Factual, past-tense, neutral, technical.
+- Use MPa for pressures, m³ for volumes, mMD for measured depth.
+- Do not assign personal blame. Use language like "suggests", "indicates", "appears".
+- Audience is engineering / production / management.
+
+You MUST reason from ONLY the provided facts and any uploaded images. DO NOT invent numbers that are not given.
+
+VERY IMPORTANT:
+- Your narratives MUST explicitly reference the specific observations: pre-cement notes, cleanup behavior, bump pressure,
+  bleed-off pattern, final stabilized pressure, flowback volume/behavior, post-job tests, and any mismatch ID information.
+- Do NOT write generic boilerplate. Each incident must read as specific to the data for that job.
+- If flowback is minimal and pressure drops directly to 0 MPa, strongly consider failure_prior_to_cementing, debris_on_collar, or mismatched_receptacle.
+- If there is continued inflow and pressure stabilizes at non-zero MPa, strongly consider third_party_integrity and compressibility_ballooning.
+- If mismatch IDs are provided, you MUST comment on their relevance in your cause analysis.
+- If images are provided (screenshots, charts, photos), you must interpret them and reference any relevant features (e.g. pressure trend, volumes, TOC indications) in your cause analysis and narratives.
+
+ROOT CAUSE MODULES:
+You may ONLY choose from this exact list (zero or more):
+{allowed_modules}
+
+MEANING OF MODULES (for your reasoning):
+- incorrect_pumping_volume:
+  Pumped nominal bump volume but plug did not seal or hold, or pattern matches under/over displacement concerns.
+- compressibility_ballooning:
+  Flowback that may be explained by fluid compressibility, trapped-volume expansion, ballooning, thermal rebound.
+- failure_prior_to_cementing:
+  Debris / glass / buoyancy-disc fragments / damage that interfered with plug landing BEFORE cementing.
+- mismatched_receptacle:
+  Plug nose ID and float collar receptacle ID do not match, so plug can land but not seal.
+- debris_on_collar:
+  Debris sitting on the float collar landing face so plug cannot seat; bridge plug / packer later tests casing above successfully.
+- third_party_integrity:
+  Leak path above the float equipment (toe subs, sleeves, connections, other accessories), not float equipment failure itself.
+
+COMPRESSIBILITY OUTCOME:
+Return either:
+- "plausible"       -> if observed flowback/inflow could be normal compressibility / ballooning / thermal rebound.
+- "exceeds_normal"  -> if flowback volume and continued inflow clearly indicate a communication path above the float equipment.
+
+NARRATIVE SECTIONS (MAKE THEM JUICY):
+Return 4 long-form fields in "narrative_sections":
+
+1) incident_summary:
+   - 3 to 6 paragraphs.
+   - Walk through the whole sequence chronologically: drilling, running casing/accessories, buoyancy/airlock or toe subs,
+     cleanup circulation, cement pumping, displacement, plug drop/bump attempts, flowback/inflow observations.
+   - Refer explicitly to the key numbers (depths, volumes, pressures, rates, any meaningful timing).
+   - Comment on abnormal SPP, pump behavior, or well response.
+
+2) incident_review:
+   - 1 to 3 paragraphs.
+   - Focus on QA/QC and process: how the equipment is normally inspected, tested, and built.
+   - If relevant, mention debris-handling design features, valve design, latch design, typical testing practices,
+     and how they relate to this job.
+
+3) conclusion:
+   - 2 to 4 paragraphs.
+   - Clearly state the most probable cause(s) of the incident given the data, referencing the selected root cause modules.
+   - Explain how the observed pressures, volumes, bump signatures, and flowback support or contradict each possible cause.
+   - Provide clear recommendations for follow-up, data review, or procedural changes.
+
+4) overall_cause_analysis:
+   - 3 to 6 paragraphs of deeper engineering reasoning.
+   - Compare the observed behavior to what you would expect for:
+        * a clean, successful bump with good integrity,
+        * pure compressibility/thermal effects,
+        * leaks across or above the float equipment,
+        * debris / damage / mismatched hardware at the latch.
+   - Step-by-step logic: what the data says, what it rules out, and why the final selected causes are most consistent.
+
+OUTPUT FORMAT:
+Return STRICT JSON with keys:
+{{
+  "root_cause_blocks": [...],
+  "compressibility_outcome": "plausible" | "exceeds_normal",
+  "narrative_sections": {{
+    "incident_summary": "string",
+    "incident_review": "string",
+    "conclusion": "string",
+    "overall_cause_analysis": "string"
+  }}
+}}
+
+CRITICAL:
+- 'root_cause_blocks' MUST ONLY contain items from this allowed set: {allowed_modules}
+- Do NOT include any extra keys.
+- No markdown, no headings like "INCIDENT SUMMARY:" inside the strings themselves.
+- Just plain text paragraphs in each string, separated by blank lines where natural.
+- Do NOT mention these instructions in your output.
+""".strip()
+    return system_instruction
+
+
+def generate_ai_full_report(user_data: dict, api_key: str, model: str, images=None,
+                            hedge_percentile=None, fallback_model=None, raise_on_error: bool = False) -> dict:
+    """
+    Ask Grok to:
+    - pick applicable root cause modules from our allowed list
+    - classify compressibility outcome
+    - write LONG, detailed narrative sections
+    - explain reasoning in overall_cause_analysis
+    - optionally consider uploaded images (EDR screenshots, etc.)
+
+    images: list of {"filename", "mime_type", "b64"}
+    hedge_percentile / fallback_model: optional request hedging (see call_grok).
+    Call timing is returned under "grok_call". A failed call returns a
+    placeholder result unless raise_on_error.
+    """
+
+    if images is None:
+        images = []
+
+    with memory_stage("request_build"):
+        # Flatten relevant facts into text bullets (order follows INCIDENT_SCHEMA)
+        facts_lines = incident_facts_lines(user_data)
+
+        facts_blob = "\n".join(facts_lines)
+
+        # Static system prompt, compiled once per process
+        system_instruction = shared_resource("system_prompt", build_system_instruction)
+
+        # Build the user content: text + optional images (OpenAI-style content array)
+        # Allow user_content to be a list of dicts with potentially nested dicts as values
+        user_content: list[dict[str, object]] = [
+            {
+                "type": "text",
+                "text": f"FACTS:\n{facts_blob}\n\nIf images are present below, use them to refine your assessment.\n"
+            }
+        ]
+
+        for img in images:
+            data_url = f"data:{img['mime_type']};base64,{img['b64']}"
+            user_content.append({
+                "type": "image_url",
+                "image_url": {"url": data_url}
+            })
+
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": user_content},
+            ],
+            "temperature": 0.25,
+            "max_tokens": 1800,
+        }
+
+    try:
+        with memory_stage("grok_call"):
+            parsed, call_info = call_grok(
+                payload, api_key, hedge_percentile=hedge_percentile, fallback_model=fallback_model
+            )
+        parsed["grok_call"] = call_info
         return parsed
     except Exception as e:
+        if raise_on_error or hasattr(e, "memory_profile"):
+            raise
         # Fallback if Grok fails — keep report generation alive
         return {
+            "grok_call": getattr(e, "grok_call", {}),
             "root_cause_blocks": ["third_party_integrity", "compressibility_ballooning"],
             "compressibility_outcome": "exceeds_normal",
             "narrative_sections": {
@@ -609,354 +2620,2666 @@ CRITICAL:
 
 
 # ============================================================
-# Build report text from user_data + AI result
+# SPECULATIVE GENERATION (Grok call started before "Generate Report")
+# ============================================================
+
+SPECULATION_STABLE_S = 4.0    # inputs must be unchanged this long before prefetching
+SPECULATION_WORKERS = 2
+SPECULATION_TTL_S = 900.0     # finished prefetches are kept this long
+
+
+def grok_input_fingerprint(user_data: dict, model: str, images=None, api_key: str = "",
+                           fallback_model=None) -> str:
+    """
+    Hash of everything that shapes the Grok answer: the FACTS lines, images,
+    model / fallback model and the API key (a result is never served to
+    another key).
+    """
+    h = hashlib.sha256()
+    for part in [model, fallback_model or "", api_key, *incident_facts_lines(user_data)]:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    for img in images or []:
+        h.update(img["b64"].encode("ascii"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _speculative_ai_result(user_data: dict, api_key: str, model: str, images=None,
+                           hedge_percentile=None, fallback_model=None) -> dict:
+    ai_result = generate_ai_full_report(
+        user_data, api_key=api_key, model=model, images=images,
+        hedge_percentile=hedge_percentile, fallback_model=fallback_model, raise_on_error=True,
+    )
+    ai_result["grok_call"]["speculative"] = True
+    return ai_result
+
+
+class SpeculativeGrok:
+    """
+    Grok calls started ahead of "Generate Report", keyed by
+    grok_input_fingerprint().
+
+    Sessions own the entries they start. When a session's inputs change it
+    releases the old fingerprint; an entry nobody owns and no job has claimed
+    is cancelled if still queued, or its result discarded when it lands.
+    claim() hands the Future to the job that generates the report
+    (run_report_pipeline(prefetched=...)); a failed prefetch is never
+    claimed, so the job calls Grok itself. Entries expire ttl_s after their
+    call finishes.
+    """
+
+    def __init__(self, max_workers: int = SPECULATION_WORKERS, ttl_s: float = SPECULATION_TTL_S):
+        self.ttl_s = ttl_s
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grok-speculative")
+        self._lock = threading.Lock()
+        self._entries = {}    # fingerprint -> {"future", "owners", "claimed", "started", "finished"}
+        self._counts = {"started": 0, "claimed": 0, "discarded": 0}
+
+    def _expire(self):
+        now = time.time()
+        for fingerprint, entry in list(self._entries.items()):
+            finished = entry["finished"]
+            if finished is not None and now - finished > self.ttl_s:
+                del self._entries[fingerprint]
+
+    def start(self, fingerprint: str, owner: str, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background unless this fingerprint is
+        already prefetched or in flight; owner keeps the entry alive.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = {
+                    "future": self._pool.submit(fn, *args, **kwargs),
+                    "owners": set(),
+                    "claimed": False,
+                    "started": time.time(),
+                    "finished": None,
+                }
+                self._entries[fingerprint] = entry
+                self._counts["started"] += 1
+                # May run right here if the call already finished, so it
+                # must not take self._lock; a single key store is atomic.
+                entry["future"].add_done_callback(lambda _f, e=entry: e.__setitem__("finished", time.time()))
+            entry["owners"].add(owner)
+            return entry["future"]
+
+    def status(self, fingerprint: str):
+        """
+        None (not started or expired), "running", "ready" or "failed".
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                return None
+            future = entry["future"]
+        if not future.done():
+            return "running"
+        return "failed" if future.cancelled() or future.exception() else "ready"
+
+    def release(self, fingerprint: str, owner: str):
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                return
+            entry["owners"].discard(owner)
+            if not entry["owners"] and not entry["claimed"]:
+                entry["future"].cancel()
+                del self._entries[fingerprint]
+                self._counts["discarded"] += 1
+
+    def claim(self, fingerprint: str):
+        """
+        The Future for this fingerprint (finished or still running), or None
+        if there is none or it failed.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                return None
+            future = entry["future"]
+            if future.done() and (future.cancelled() or future.exception()):
+                return None
+            entry["claimed"] = True
+            self._counts["claimed"] += 1
+            return future
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(1 for entry in self._entries.values() if not entry["future"].done())
+            return {**self._counts, "cached": len(self._entries) - running, "running": running}
+
+
+def speculative_grok() -> SpeculativeGrok:
+    return shared_resource("speculative_grok", SpeculativeGrok)
+
+
+def render_speculation_status(fingerprint: str, owner: str, since: float, start_args: dict):
+    """
+    Start the prefetch once the inputs have been stable for
+    SPECULATION_STABLE_S and show its state. Runs as a timed fragment so it
+    fires while the user is only reading the snapshot.
+    """
+    import streamlit as st
+
+    speculation = speculative_grok()
+    status = speculation.status(fingerprint)
+    if status is None:
+        wait_s = since + SPECULATION_STABLE_S - time.time()
+        if wait_s > 0:
+            st.caption(f"AI narrative prefetch starts in {wait_s:.0f} s if the inputs stay unchanged.")
+            return
+        # Snapshot: the pipeline adds to user_data once the job runs.
+        speculation.start(
+            fingerprint, owner, _speculative_ai_result,
+            **{**start_args, "user_data": copy.deepcopy(start_args["user_data"])},
+        )
+        status = "running"
+    st.caption({
+        "running": "Prefetching the AI narrative in the background…",
+        "ready": "AI narrative prefetched – Generate Report will not wait for Grok.",
+        "failed": "AI narrative prefetch failed; Generate Report will call Grok again.",
+    }[status])
+
+
+# ============================================================
+# Build report text from user_data + AI result
+# ============================================================
+
+VOLUME_SUMMARY_TEMPLATE = """VOLUME / DEPTH SUMMARY
+
+Well TD: {volume_table.well_td_m} m
+Well TVD: {volume_table.well_tvd_m} m
+Shoe Depth: {volume_table.shoe_depth_m} m
+Float Collar Top Depth: {volume_table.float_collar_depth_m} m
+Airlock / CBS Depth: {volume_table.airlock_depth_m} m
+Crossover Depth: {volume_table.crossover_depth_m} m
+
+Casing Volume Calculated:
+  Nominal: {volume_table.casing_vol_nominal_m3} m³
+  Min:     {volume_table.casing_vol_min_m3} m³
+  Max:     {volume_table.casing_vol_max_m3} m³
+
+Volume to Airlock / CBS: {volume_table.volume_to_airlock_m3} m³
+Buoyant Volume (nominal): {volume_table.buoyant_volume_nom_m3} m³
+
+Displacement Volume Pumped: {volume_table.displacement_pumped_m3} m³
+Excess Cement to Surface:  {volume_table.excess_to_surface_m3} m³"""
+
+# Appended to the volume summary only for incidents with user_data["pressure"].
+HYDROSTATICS_SUMMARY_TEMPLATE = """Hydrostatics at Float Collar ({pressure.fc_tvd_m} m TVD):
+  Annulus:       {pressure.annulus_fc_mpa} MPa
+  Inside casing: {pressure.inside_fc_mpa} MPa
+  Lift pressure: {pressure.lift_pressure_mpa} MPa
+Estimated Top of Cement: {pressure.cement_top_m} mMD
+Expected Bump Pressure: {pressure.expected_bump_mpa} MPa"""
+
+
+def report_header_text(user_data: dict) -> str:
+    """The report header block – form data only, so it can be built before Grok returns."""
+    accessories_joined = ", ".join(user_data["accessories"])
+    short_desc = user_data["string_desc"]
+    if len(short_desc) > 60:
+        short_desc = short_desc[:57] + "..."
+    return f"""ENGINEERING REPORT
+
+{user_data['date_of_report']}
+
+Revision: {user_data['revision']}
+Report: {user_data['cir_number']}
+
+{user_data['customer']} – {short_desc}: {user_data['title_line']}
+
+INCIDENT REPORT NUMBER: {user_data['cir_number']}
+CUSTOMER: {user_data['customer']}
+AUTHOR: {user_data['author']}
+Rig: {user_data['rig']}
+SURFACE: {user_data['surface_location']}
+UWI: {user_data['uwi']}
+EQUIPMENT: {accessories_joined}
+""".strip()
+
+
+def report_volume_text(user_data: dict) -> str:
+    """The volume / depth summary block (from numbers only)."""
+    text = render_template(VOLUME_SUMMARY_TEMPLATE, user_data)
+    if user_data.get("pressure"):
+        text += "\n\n" + render_template(HYDROSTATICS_SUMMARY_TEMPLATE, user_data)
+    return text
+
+
+def build_report_text(user_data: dict, ai_result: dict):
+    # Attach Grok decisions back onto data so our templates can see them
+    user_data["compressibility_outcome"] = ai_result.get("compressibility_outcome", "exceeds_normal")
+
+    # 1. Header
+    header_text = report_header_text(user_data)
+
+    # 2. Incident summary (Grok text)
+    incident_summary_text = "INCIDENT SUMMARY\n\n" + ai_result["narrative_sections"]["incident_summary"].strip()
+
+    # 3. Volume / depth summary (from numbers)
+    volume_table_text = report_volume_text(user_data)
+
+    # 4. Incident review (Grok)
+    incident_review_text = "INCIDENT REVIEW\n\n" + ai_result["narrative_sections"]["incident_review"].strip()
+
+    # 5. Potential root causes (our templates, based on Grok selection)
+    root_cause_sections = []
+    root_block_keys = ai_result.get("root_cause_blocks", [])
+    for block_key in root_block_keys:
+        builder = ROOT_CAUSE_BLOCK_BUILDERS.get(block_key)
+        if builder:
+            temp = {
+                **user_data,
+                "post_job": user_data["post_job"],
+                "volume_table": user_data["volume_table"],
+                "compressibility_outcome": user_data.get("compressibility_outcome", "exceeds_normal"),
+            }
+            root_cause_sections.append(builder(temp))
+
+    analysis_extra = ai_result["narrative_sections"].get("overall_cause_analysis", "").strip()
+    if analysis_extra:
+        root_cause_sections.append(
+            "Engineering Assessment / Cause Analysis\n\n" + analysis_extra
+        )
+
+    potential_root_causes_text = "POTENTIAL ROOT CAUSES\n\n" + "\n\n".join(root_cause_sections).strip()
+
+    # 6. Conclusion (Grok)
+    conclusion_text = "CONCLUSION\n\n" + ai_result["narrative_sections"]["conclusion"].strip()
+
+    parts = [
+        header_text,
+        "",
+        incident_summary_text,
+        "",
+        volume_table_text,
+        "",
+        incident_review_text,
+        "",
+        potential_root_causes_text,
+        "",
+        conclusion_text,
+        ""
+    ]
+
+    return "\n".join(parts).strip() + "\n"
+
+
+# ============================================================
+# BLOB STORE (content-addressed images and generated documents)
+# ============================================================
+
+# Unreferenced blobs younger than this survive GC (a put may not have been
+# referenced yet).
+BLOB_GC_GRACE_S = 3600
+# Only keep the zlib-compressed form if it saves at least this fraction.
+BLOB_MIN_COMPRESSION_GAIN = 0.05
+
+_BLOB_HEADER = struct.Struct(">cQ")  # codec (b"Z" zlib / b"R" raw), raw size
+
+
+class BlobStore:
+    """
+    Content-addressed storage under root/:
+      objects/ab/<sha256>    – header + zlib or raw bytes, written once
+      names/<name>           – sha256 for derived-content lookups (cache keys)
+      refs/ab/<sha256>.json  – {"size", "owners"} for that object
+
+    Owners are strings such as "job:<id>". An owner "derived:<sha>" keeps a
+    derivative alive only while <sha> itself has some other owner, so
+    resampled images go when their source does. gc() deletes objects nobody
+    owns; storage grows with unique content, not with the number of reports.
+    Reference updates and gc() hold the store's file lock (shared with other
+    processes), and put(data, owner) stores and references an object under
+    it, so gc() cannot delete an object between the two.
+    """
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+        for sub in ("objects", "names", "refs"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        self._migrate_refs()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _lock(self):
+        return _file_lock(os.path.join(self.root, ".lock"))
+
+    def _ref_path(self, digest: str) -> str:
+        return os.path.join(self.root, "refs", digest[:2], digest + ".json")
+
+    def _read_ref(self, digest: str):
+        return _read_json(self._ref_path(digest), None)
+
+    def _write_ref(self, digest: str, entry):
+        path = self._ref_path(digest)
+        if entry is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_json_atomic(path, entry)
+
+    def _iter_refs(self):
+        refs_dir = os.path.join(self.root, "refs")
+        for sub in os.listdir(refs_dir):
+            for name in os.listdir(os.path.join(refs_dir, sub)):
+                if name.endswith(".json"):
+                    digest = name[:-5]
+                    entry = self._read_ref(digest)
+                    if entry is not None:
+                        yield digest, entry
+
+    def _migrate_refs(self):
+        # Stores written before per-object ref files kept every entry in one refs.json.
+        legacy = os.path.join(self.root, "refs.json")
+        if not os.path.exists(legacy):
+            return
+        with self._lock():
+            for digest, entry in _read_json(legacy, {}).items():
+                if self._read_ref(digest) is None:
+                    self._write_ref(digest, entry)
+            if os.path.exists(legacy):
+                os.remove(legacy)
+
+    # ----- content ---------------------------------------------------------
+
+    @staticmethod
+    def _pack(data: bytes) -> bytes:
+        packed = zlib.compress(data, 6)
+        if len(packed) <= len(data) * (1 - BLOB_MIN_COMPRESSION_GAIN):
+            return _BLOB_HEADER.pack(b"Z", len(data)) + packed
+        return _BLOB_HEADER.pack(b"R", len(data)) + data
+
+    def put(self, data: bytes, owner: str = None) -> str:
+        """
+        Store data (once per content) and return its sha256. With owner, the
+        reference is added under the same lock gc() takes.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        # Compress outside the lock; re-checked under it in case gc() ran.
+        body = None if os.path.exists(path) else self._pack(data)
+        with self._lock():
+            if os.path.exists(path):
+                # Fresh again for gc()'s grace period until it is referenced.
+                os.utime(path)
+            else:
+                if body is None:
+                    body = self._pack(data)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+                with open(tmp, "wb") as fh:
+                    fh.write(body)
+                os.replace(tmp, path)
+            if owner:
+                self._add_refs_locked(owner, [digest])
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), "rb") as fh:
+            codec, _size = _BLOB_HEADER.unpack(fh.read(_BLOB_HEADER.size))
+            body = fh.read()
+        return zlib.decompress(body) if codec == b"Z" else body
+
+    def exists(self, digest: str) -> bool:
+        return bool(digest) and os.path.exists(self._path(digest))
+
+    def size(self, digest: str) -> int:
+        with open(self._path(digest), "rb") as fh:
+            return _BLOB_HEADER.unpack(fh.read(_BLOB_HEADER.size))[1]
+
+    def link(self, name: str, digest: str):
+        """
+        Point a lookup name (e.g. a resample cache key) at a blob.
+        """
+        path = os.path.join(self.root, "names", name)
+        tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(digest)
+        os.replace(tmp, path)
+
+    def resolve(self, name: str):
+        path = os.path.join(self.root, "names", name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as fh:
+            digest = fh.read().strip()
+        return digest if self.exists(digest) else None
+
+    # ----- references ------------------------------------------------------
+
+    def _add_refs_locked(self, owner: str, digests) -> list:
+        missing = []
+        for digest in digests:
+            if not self.exists(digest):
+                missing.append(digest)
+                continue
+            entry = self._read_ref(digest) or {"size": self.size(digest), "owners": []}
+            if owner not in entry["owners"]:
+                entry["owners"].append(owner)
+                self._write_ref(digest, entry)
+        return missing
+
+    def add_refs(self, owner: str, digests) -> list:
+        """
+        Reference existing objects. Returns the digests that are no longer
+        stored (e.g. collected since they were put) and were not referenced.
+        """
+        with self._lock():
+            return self._add_refs_locked(owner, digests)
+
+    def release(self, owner: str, digests=None):
+        """
+        Drop owner's references (only to these digests, if given).
+        """
+        with self._lock():
+            if digests is None:
+                entries = list(self._iter_refs())
+            else:
+                entries = [(d, self._read_ref(d)) for d in digests]
+            for digest, entry in entries:
+                if entry and owner in entry["owners"]:
+                    entry["owners"].remove(owner)
+                    self._write_ref(digest, entry)
+
+    def refcount(self, digest: str) -> int:
+        return len((self._read_ref(digest) or {}).get("owners", []))
+
+    def gc(self, grace_s: float = BLOB_GC_GRACE_S) -> dict:
+        """
+        Drop derived owners whose source is gone, then delete objects (and
+        names pointing at them) with no owners that are older than grace_s.
+        """
+        deleted, freed = 0, 0
+        now = time.time()
+        with self._lock():
+            refs = dict(self._iter_refs())
+            live = {
+                digest for digest, entry in refs.items()
+                if any(not o.startswith("derived:") for o in entry["owners"])
+            }
+            for digest, entry in refs.items():
+                owners = [o for o in entry["owners"] if not o.startswith("derived:") or o[8:] in live]
+                if owners != entry["owners"]:
+                    entry["owners"] = owners
+                    self._write_ref(digest, entry)
+            objects_dir = os.path.join(self.root, "objects")
+            for sub in os.listdir(objects_dir):
+                for digest in os.listdir(os.path.join(objects_dir, sub)):
+                    path = os.path.join(objects_dir, sub, digest)
+                    if ".tmp" in digest or refs.get(digest, {}).get("owners"):
+                        continue
+                    if now - os.path.getmtime(path) < grace_s:
+                        continue
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    deleted += 1
+            for digest, entry in refs.items():
+                if not entry["owners"] and not self.exists(digest):
+                    self._write_ref(digest, None)
+            names_dir = os.path.join(self.root, "names")
+            for name in os.listdir(names_dir):
+                if self.resolve(name) is None:
+                    os.remove(os.path.join(names_dir, name))
+        return {"deleted": deleted, "freed_mb": _mb(freed)}
+
+    def stats(self) -> dict:
+        """
+        Unique objects and bytes on disk vs the bytes the same content would
+        take if every owner kept its own copy.
+        """
+        stored, objects = 0, 0
+        objects_dir = os.path.join(self.root, "objects")
+        for sub in os.listdir(objects_dir):
+            for digest in os.listdir(os.path.join(objects_dir, sub)):
+                objects += 1
+                stored += os.path.getsize(os.path.join(objects_dir, sub, digest))
+        logical = sum(
+            e["size"] * sum(1 for o in e["owners"] if not o.startswith("derived:"))
+            for _digest, e in self._iter_refs()
+        )
+        return {"objects": objects, "stored_mb": _mb(stored), "referenced_mb": _mb(logical)}
+
+
+def blob_store() -> BlobStore:
+    return shared_resource("blob_store", BlobStore)
+
+
+# ============================================================
+# APPENDIX IMAGE PREPARATION (resample, recompress, cache)
+# ============================================================
+
+DOCX_IMAGE_WIDTH_IN = 5.0
+DOCX_IMAGE_DPI = int(os.environ.get("INCIDENT_BUILDER_DOCX_IMAGE_DPI", "150"))
+DOCX_IMAGE_JPEG_QUALITY = 82
+DOCX_SIZE_BUDGET_MB = float(os.environ.get("INCIDENT_BUILDER_DOCX_BUDGET_MB", "10"))
+
+
+def prepare_appendix_image(raw: bytes, width_in: float = DOCX_IMAGE_WIDTH_IN, dpi: int = DOCX_IMAGE_DPI,
+                           store: BlobStore = None) -> bytes:
+    """
+    Resample an uploaded image to its display width in the report
+    (width_in x dpi pixels) and recompress it: photos as JPEG, screenshots /
+    images with transparency as optimised PNG, whichever is smaller when both
+    are allowed. Results are kept in the blob store under (content hash,
+    width, quality), owned by the source image, so revisions and batch exports
+    reuse them. Returns the original bytes if Pillow cannot read the image.
+    """
+    store = store or blob_store()
+    key = hashlib.sha256(raw).hexdigest()
+    target_px = int(round(width_in * dpi))
+    cache_key = f"appendix_{key}_{target_px}_{DOCX_IMAGE_JPEG_QUALITY}"
+    digest = store.resolve(cache_key)
+    if digest:
+        return store.get(digest)
+
+    try:
+        from PIL import Image, ImageOps
+
+        img = Image.open(BytesIO(raw))
+        src_format = img.format
+        img = ImageOps.exif_transpose(img)  # phone photos carry rotation in EXIF
+        if img.width > target_px:
+            img = img.resize((target_px, max(1, round(img.height * target_px / img.width))), Image.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        candidates = {}
+        if not has_alpha:
+            jpg = BytesIO()
+            img.convert("RGB").save(jpg, format="JPEG", quality=DOCX_IMAGE_JPEG_QUALITY, optimize=True)
+            candidates["jpg"] = jpg.getvalue()
+        if has_alpha or src_format != "JPEG":
+            png = BytesIO()
+            img.save(png, format="PNG", optimize=True)
+            candidates["png"] = png.getvalue()
+    except Exception:
+        return raw
+
+    out = min(candidates.values(), key=len)
+    if len(out) >= len(raw):
+        # Already small enough at display size; keep the original.
+        out = raw
+
+    digest = store.put(out, owner=f"derived:{key}")
+    store.link(cache_key, digest)
+    return out
+
+
+def dedupe_images(images):
+    """
+    Collapse identical images (same bytes) into one entry whose caption lists
+    every filename it was uploaded as. Order of first appearance is kept.
+    Returns [{"caption", "raw"}].
+    """
+    groups = {}
+    for idx, img in enumerate(images, start=1):
+        raw = base64.b64decode(img["b64"])
+        key = hashlib.sha256(raw).hexdigest()
+        name = img.get("filename", f"Image {idx}")
+        if key in groups:
+            if name not in groups[key]["names"]:
+                groups[key]["names"].append(name)
+        else:
+            groups[key] = {"names": [name], "raw": raw}
+    return [{"caption": " / ".join(g["names"]), "raw": g["raw"]} for g in groups.values()]
+
+
+def check_docx_size(bio, budget_mb: float = DOCX_SIZE_BUDGET_MB):
+    """
+    Returns (size_mb, warning_or_None) for a built .docx.
+    """
+    size_mb = len(bio.getvalue()) / (1024 * 1024)
+    if size_mb > budget_mb:
+        return round(size_mb, 2), (
+            f"Word report is {size_mb:.1f} MB, over the {budget_mb:g} MB budget. "
+            "Consider fewer / smaller appendix images or a lower INCIDENT_BUILDER_DOCX_IMAGE_DPI."
+        )
+    return round(size_mb, 2), None
+
+
+# ============================================================
+# DOCX STYLING + RENDERING (to BytesIO) + IMAGE APPENDIX
+# ============================================================
+
+def ensure_styles(doc):
+    from docx.shared import Pt
+    from docx.enum.style import WD_STYLE_TYPE
+
+    styles = doc.styles
+
+    if "TitleStyle" not in [s.name for s in styles]:
+        style = styles.add_style("TitleStyle", WD_STYLE_TYPE.PARAGRAPH)
+    else:
+        style = styles["TitleStyle"]
+    style.font.name = "Calibri"
+    style.font.size = Pt(14)
+    style.font.bold = True
+    style.paragraph_format.space_after = Pt(6)
+
+    if "SectionHeader" not in [s.name for s in styles]:
+        style = styles.add_style("SectionHeader", WD_STYLE_TYPE.PARAGRAPH)
+    else:
+        style = styles["SectionHeader"]
+    style.font.name = "Calibri"
+    style.font.size = Pt(12)
+    style.font.bold = True
+    style.all_caps = True
+    style.paragraph_format.space_before = Pt(12)
+    style.paragraph_format.space_after = Pt(6)
+
+    if "BodyText" not in [s.name for s in styles]:
+        style = styles.add_style("BodyText", WD_STYLE_TYPE.PARAGRAPH)
+    else:
+        style = styles["BodyText"]
+    style.font.name = "Calibri"
+    style.font.size = Pt(10.5)
+    style.font.bold = False
+    style.paragraph_format.space_after = Pt(6)
+
+    if "SubHeader" not in [s.name for s in styles]:
+        style = styles.add_style("SubHeader", WD_STYLE_TYPE.PARAGRAPH)
+    else:
+        style = styles["SubHeader"]
+    style.font.name = "Calibri"
+    style.font.size = Pt(11)
+    style.font.bold = True
+    style.paragraph_format.space_before = Pt(6)
+    style.paragraph_format.space_after = Pt(3)
+
+    if "MonoBlock" not in [s.name for s in styles]:
+        style = styles.add_style("MonoBlock", WD_STYLE_TYPE.PARAGRAPH)
+    else:
+        style = styles["MonoBlock"]
+    style.font.name = "Consolas"
+    style.font.size = Pt(10)
+    style.font.bold = False
+    style.paragraph_format.left_indent = Pt(18)
+    style.paragraph_format.space_before = Pt(3)
+    style.paragraph_format.space_after = Pt(3)
+
+
+def split_report_into_structures(report_text):
+    blocks = [b.strip() for b in report_text.split("\n\n") if b.strip()]
+    structured = {
+        "header": [],
+        "incident_summary": [],
+        "volume_table": [],
+        "incident_review": [],
+        "root_causes": [],
+        "conclusion": []
+    }
+
+    current_section = None
+    in_root_causes = False
+    pending_cause_title = None
+    pending_cause_body = []
+
+    def flush_pending_cause():
+        nonlocal pending_cause_title, pending_cause_body
+        if pending_cause_title is not None:
+            structured["root_causes"].append({
+                "title": pending_cause_title,
+                "body_lines": pending_cause_body[:],
+            })
+        pending_cause_title = None
+        pending_cause_body = []
+
+    for block in blocks:
+        first_line = block.split("\n", 1)[0].strip()
+
+        if first_line.startswith("ENGINEERING REPORT"):
+            current_section = "header"
+            structured["header"].append(block)
+
+        elif first_line == "INCIDENT SUMMARY":
+            current_section = "incident_summary"
+            structured["incident_summary"].append(block)
+
+        elif first_line == "VOLUME / DEPTH SUMMARY":
+            current_section = "volume_table"
+            structured["volume_table"].append(block)
+
+        elif first_line == "INCIDENT REVIEW":
+            current_section = "incident_review"
+            structured["incident_review"].append(block)
+
+        elif first_line == "POTENTIAL ROOT CAUSES":
+            current_section = "root_causes"
+            in_root_causes = True
+
+        elif first_line == "CONCLUSION":
+            flush_pending_cause()
+            current_section = "conclusion"
+            in_root_causes = False
+            structured["conclusion"].append(block)
+
+        else:
+            if in_root_causes:
+                flush_pending_cause()
+                lines = block.split("\n")
+                pending_cause_title = lines[0].strip()
+                pending_cause_body = [ln for ln in lines[1:] if ln.strip() != ""]
+            else:
+                if current_section == "header":
+                    structured["header"].append(block)
+                elif current_section == "incident_summary":
+                    structured["incident_summary"].append(block)
+                elif current_section == "volume_table":
+                    structured["volume_table"].append(block)
+                elif current_section == "incident_review":
+                    structured["incident_review"].append(block)
+                elif current_section == "conclusion":
+                    structured["conclusion"].append(block)
+
+    flush_pending_cause()
+    return structured
+
+
+def _docx_header(add, blocks):
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    for block in blocks:
+        lines = block.split("\n")
+        for j, line in enumerate(lines):
+            if j == 0:
+                p = add("TitleStyle")
+                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                run = p.add_run(line.strip())
+                run.bold = True
+            else:
+                p = add("BodyText")
+                p.alignment = WD_ALIGN_PARAGRAPH.LEFT
+                p.add_run(line.strip())
+    add("BodyText").add_run(" ")
+
+
+def _docx_section(add, title: str, blocks, mono: bool = False):
+    if not blocks:
+        return
+    add("SectionHeader").add_run(title)
+    for block in blocks:
+        lines = block.split("\n")
+        if lines[0].strip().upper() == title:
+            lines = lines[1:]
+        for bl in lines:
+            if bl.strip():
+                if mono:
+                    add("MonoBlock").add_run(bl.rstrip())
+                else:
+                    add("BodyText").add_run(bl.strip())
+
+
+def _docx_root_causes(add, causes):
+    if not causes:
+        return
+    add("SectionHeader").add_run("POTENTIAL ROOT CAUSES")
+    for cause in causes:
+        add("SubHeader").add_run(cause["title"])
+        for bl in cause["body_lines"]:
+            if bl.strip():
+                add("BodyText").add_run(bl.strip())
+
+
+def _docx_conclusion(add, blocks):
+    if not blocks:
+        return
+    add("SectionHeader").add_run("CONCLUSION")
+    for block in blocks:
+        lines = block.split("\n")
+        if lines[0].strip().upper() == "CONCLUSION":
+            lines = lines[1:]
+        for bl in lines:
+            text = bl.strip()
+            if not text:
+                continue
+            if text.upper() == "DRILLOUT DE-BRIEF":
+                add("SubHeader").add_run("DRILLOUT DE-BRIEF")
+            else:
+                add("BodyText").add_run(text)
+
+
+def _docx_appendix(doc, charts, images):
+    from docx.shared import Inches
+
+    # APPENDIX – EDR CHARTS
+    if charts:
+        doc.add_page_break()
+        doc.add_paragraph("APPENDIX – EDR CHARTS", style="SectionHeader")
+        for chart in charts:
+            cap_p = doc.add_paragraph(style="BodyText")
+            cap_p.add_run(chart["filename"])
+            raw = base64.b64decode(chart["b64"])
+            run = doc.add_paragraph().add_run()
+            run.add_picture(BytesIO(raw), width=Inches(6))
+
+    # APPENDIX – IMAGES (identical uploads once, resampled to display size)
+    if images:
+        doc.add_page_break()
+        doc.add_paragraph("APPENDIX – JOB IMAGES", style="SectionHeader")
+        for img in dedupe_images(images):
+            cap_p = doc.add_paragraph(style="BodyText")
+            cap_p.add_run(img["caption"])
+            raw = prepare_appendix_image(img["raw"])
+            run = doc.add_paragraph().add_run()
+            run.add_picture(BytesIO(raw), width=Inches(DOCX_IMAGE_WIDTH_IN))
+
+
+class DocxDraft:
+    """
+    A report .docx assembled as far as it can be without the narrative:
+    template styles, header, volume / depth summary and the appendices
+    (charts, resampled images), with an empty anchor paragraph where each
+    AI-dependent section goes. run_report_pipeline() builds it while the Grok
+    call is in flight; finish() fills the anchors from the full report text.
+    """
+
+    NARRATIVE_SECTIONS = ("incident_summary", "incident_review", "root_causes", "conclusion")
+
+    def __init__(self, header_blocks, volume_blocks, images=None, charts=None):
+        from docx import Document
+
+        # Start from the shared, pre-styled template instead of re-creating styles.
+        self.doc = Document(BytesIO(shared_resource("docx_template", _build_docx_template)))
+        self.fixed = (list(header_blocks), list(volume_blocks))
+        self.images, self.charts = images or [], charts or []
+
+        add = self._writer()
+        _docx_header(add, header_blocks)
+        self.anchors = {"incident_summary": self.doc.add_paragraph()}
+        _docx_section(add, "VOLUME / DEPTH SUMMARY", volume_blocks, mono=True)
+        for name in ("incident_review", "root_causes", "conclusion"):
+            self.anchors[name] = self.doc.add_paragraph()
+        _docx_appendix(self.doc, self.charts, self.images)
+
+    @classmethod
+    def for_incident(cls, user_data: dict, images=None, charts=None) -> "DocxDraft":
+        data = split_report_into_structures(report_header_text(user_data) + "\n\n" + report_volume_text(user_data))
+        return cls(data["header"], data["volume_table"], images=images, charts=charts)
+
+    def _writer(self, anchor=None):
+        if anchor is None:
+            return lambda style: self.doc.add_paragraph(style=style)
+        return lambda style: anchor.insert_paragraph_before(style=style)
+
+    def finish(self, report_text) -> BytesIO:
+        """
+        Fill in the narrative sections and save. Falls back to a full build
+        if the report's header / volume summary differ from the draft's.
+        """
+        data = split_report_into_structures(report_text)
+        if (data["header"], data["volume_table"]) != self.fixed:
+            return build_docx_bytes(report_text, images=self.images, charts=self.charts)
+
+        _docx_section(self._writer(self.anchors["incident_summary"]), "INCIDENT SUMMARY", data["incident_summary"])
+        _docx_section(self._writer(self.anchors["incident_review"]), "INCIDENT REVIEW", data["incident_review"])
+        _docx_root_causes(self._writer(self.anchors["root_causes"]), data["root_causes"])
+        _docx_conclusion(self._writer(self.anchors["conclusion"]), data["conclusion"])
+        for anchor in self.anchors.values():
+            anchor._element.getparent().remove(anchor._element)
+
+        bio = BytesIO()
+        self.doc.save(bio)
+        bio.seek(0)
+        return bio
+
+
+def build_docx_bytes(report_text, images=None, filename_hint="output_incident_report.docx", charts=None) -> BytesIO:
+    """
+    Render the sectioned report text into a styled .docx and return as BytesIO.
+    Also optionally append uploaded images as an APPENDIX section.
+    charts: rendered EDR charts (see render_edr_charts), embedded before the images.
+    """
+    data = split_report_into_structures(report_text)
+    return DocxDraft(data["header"], data["volume_table"], images=images, charts=charts).finish(report_text)
+
+# ============================================================
+# HTML / MARKDOWN / JSON PREVIEW (no python-docx)
+# ============================================================
+
+# Mirrors the docx styles in ensure_styles().
+REPORT_HTML_CSS = """
+.cir-report { font-family: Calibri, Arial, sans-serif; font-size: 10.5pt; line-height: 1.35; max-width: 8.5in; }
+.cir-report .title { font-size: 14pt; font-weight: bold; text-align: center; margin-bottom: 6pt; }
+.cir-report .section { font-size: 12pt; font-weight: bold; text-transform: uppercase; margin: 12pt 0 6pt; }
+.cir-report .subheader { font-size: 11pt; font-weight: bold; margin: 6pt 0 3pt; }
+.cir-report p { margin: 0 0 6pt; }
+.cir-report pre { font-family: Consolas, monospace; font-size: 10pt; margin: 3pt 0 3pt 18pt; }
+.cir-report figure { margin: 6pt 0; }
+.cir-report img { max-width: 6in; }
+"""
+
+REPORT_SECTION_TITLES = [
+    ("incident_summary", "INCIDENT SUMMARY"),
+    ("volume_table", "VOLUME / DEPTH SUMMARY"),
+    ("incident_review", "INCIDENT REVIEW"),
+    ("root_causes", "POTENTIAL ROOT CAUSES"),
+    ("conclusion", "CONCLUSION"),
+]
+
+
+def _section_lines(blocks, title: str):
+    """
+    Non-empty lines of a section's blocks with the section title line removed
+    (same rule as build_docx_bytes).
+    """
+    out = []
+    for block in blocks:
+        lines = block.split("\n")
+        if lines[0].strip().upper() == title:
+            lines = lines[1:]
+        out.extend(ln for ln in lines if ln.strip())
+    return out
+
+
+def render_report_html(report_text: str, charts=None, images=None) -> str:
+    """
+    Styled HTML for the report, laid out like the .docx. Pure string work,
+    so it renders in a few milliseconds.
+    charts / images (optional, {"filename", "mime_type", "b64"}) are inlined
+    as data URLs in the appendices.
+    """
+    esc = html.escape
+    data = split_report_into_structures(report_text)
+    out = [f"<style>{REPORT_HTML_CSS}</style>", '<div class="cir-report">']
+
+    for block in data["header"]:
+        for j, line in enumerate(block.split("\n")):
+            cls = ' class="title"' if j == 0 else ""
+            out.append(f"<p{cls}>{esc(line.strip())}</p>")
+
+    for key, title in REPORT_SECTION_TITLES:
+        if not data[key]:
+            continue
+        out.append(f'<div class="section">{esc(title)}</div>')
+        if key == "root_causes":
+            for cause in data["root_causes"]:
+                out.append(f'<div class="subheader">{esc(cause["title"])}</div>')
+                out.extend(f"<p>{esc(bl.strip())}</p>" for bl in cause["body_lines"] if bl.strip())
+        elif key == "volume_table":
+            out.append("<pre>" + esc("\n".join(ln.rstrip() for ln in _section_lines(data[key], title))) + "</pre>")
+        else:
+            for line in _section_lines(data[key], title):
+                text = line.strip()
+                if key == "conclusion" and text.upper() == "DRILLOUT DE-BRIEF":
+                    out.append('<div class="subheader">DRILLOUT DE-BRIEF</div>')
+                else:
+                    out.append(f"<p>{esc(text)}</p>")
+
+    for heading, items in (("APPENDIX – EDR CHARTS", charts), ("APPENDIX – JOB IMAGES", images)):
+        if not items:
+            continue
+        out.append(f'<div class="section">{esc(heading)}</div>')
+        for item in items:
+            out.append(
+                f'<figure><figcaption>{esc(item["filename"])}</figcaption>'
+                f'<img src="data:{item["mime_type"]};base64,{item["b64"]}"></figure>'
+            )
+
+    out.append("</div>")
+    return "\n".join(out)
+
+
+def render_report_markdown(report_text: str) -> str:
+    data = split_report_into_structures(report_text)
+    out = []
+    for i, block in enumerate(data["header"]):
+        lines = [ln.strip() for ln in block.split("\n")]
+        if i == 0:
+            out.append(f"# {lines[0]}")
+            lines = lines[1:]
+        out.extend(f"{ln}  " for ln in lines)
+        out.append("")
+
+    for key, title in REPORT_SECTION_TITLES:
+        if not data[key]:
+            continue
+        out.append(f"## {title.title()}\n")
+        if key == "root_causes":
+            for cause in data["root_causes"]:
+                out.append(f"### {cause['title']}\n")
+                out.extend(f"{bl.strip()}\n" for bl in cause["body_lines"] if bl.strip())
+        elif key == "volume_table":
+            out.append("```\n" + "\n".join(ln.rstrip() for ln in _section_lines(data[key], title)) + "\n```\n")
+        else:
+            out.extend(f"{ln.strip()}\n" for ln in _section_lines(data[key], title))
+    return "\n".join(out).strip() + "\n"
+
+
+def render_report_json(report_text: str, ai_result=None) -> str:
+    payload = {"sections": split_report_into_structures(report_text)}
+    if ai_result is not None:
+        payload["ai_result"] = ai_result
+    return json.dumps(payload, indent=2, ensure_ascii=False, default=str)
+
+
+# ============================================================
+# MEMORY PROFILING (opt-in, per pipeline stage)
+# ============================================================
+
+MEMORY_PROFILE_ENABLED = os.environ.get("INCIDENT_BUILDER_MEMORY_PROFILE", "") == "1"
+# Abort a generation whose traced peak exceeds this many MB (0 = no budget).
+MEMORY_BUDGET_MB = float(os.environ.get("INCIDENT_BUILDER_MEMORY_BUDGET_MB", "0"))
+
+# tracemalloc is process-wide, so only one profiled run at a time; other
+# profiled jobs wait. Only enable profiling when sizing the server.
+_memory_profile_lock = threading.Lock()
+_active_memory_profiler = None
+
+
+def _mb(n_bytes: int) -> float:
+    return round(n_bytes / (1024 * 1024), 2)
+
+
+class MemoryProfiler:
+    """
+    Records, per stage, the peak traced memory (above what was in use when
+    profiling started) and the memory retained when the stage ends. Stages
+    nest ("grok/request_build"). Only stages entered on the profiling thread
+    are recorded; hedged Grok attempts count towards the enclosing stage.
+
+    With budget_mb set, a RuntimeError (summary on e.memory_profile) is raised
+    as soon as a stage finishes over budget – tracemalloc can't interrupt an
+    allocation mid-stage.
+    """
+
+    def __init__(self, budget_mb: float = None, label: str = None):
+        self.budget_mb = budget_mb or None
+        self.label = label
+        self.stages = []
+        self.peak_mb = 0.0
+        self.retained_mb = 0.0
+        self._stack = []
+        self._owner = None
+        self._base = 0
+        self._started_tracing = False
+
+    def __enter__(self):
+        global _active_memory_profiler
+        import tracemalloc
+
+        _memory_profile_lock.acquire()
+        self._owner = threading.get_ident()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+        _active_memory_profiler = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active_memory_profiler
+        import tracemalloc
+
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_mb = max(self.peak_mb, _mb(peak - self._base))
+            self.retained_mb = _mb(current - self._base)
+            self.elapsed_s = round(time.perf_counter() - self._start, 2)
+        finally:
+            _active_memory_profiler = None
+            if self._started_tracing:
+                tracemalloc.stop()
+            _memory_profile_lock.release()
+        return False
+
+    @contextmanager
+    def stage(self, name: str):
+        import tracemalloc
+
+        if threading.get_ident() != self._owner:
+            yield
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        frame = {
+            "name": f"{self._stack[-1]['name']}/{name}" if self._stack else name,
+            "start": current,
+            "peak": current,
+            "t": time.perf_counter(),
+        }
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            frame["peak"] = max(frame["peak"], peak)
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], frame["peak"])
+            tracemalloc.reset_peak()
+            self.stages.append({
+                "stage": frame["name"],
+                "peak_mb": _mb(frame["peak"] - self._base),
+                "retained_mb": _mb(current - frame["start"]),
+                "elapsed_s": round(time.perf_counter() - frame["t"], 3),
+            })
+            self.peak_mb = max(self.peak_mb, self.stages[-1]["peak_mb"])
+        if self.budget_mb and self.peak_mb > self.budget_mb:
+            e = RuntimeError(
+                f"Memory budget exceeded in stage '{frame['name']}': "
+                f"peak {self.peak_mb} MB > {self.budget_mb:g} MB"
+            )
+            e.memory_profile = self.summary()
+            raise e
+
+    def summary(self) -> dict:
+        return {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "label": self.label,
+            "peak_mb": self.peak_mb,
+            "retained_mb": self.retained_mb,
+            "budget_mb": self.budget_mb,
+            "stages": list(self.stages),
+        }
+
+
+def memory_stage(name: str):
+    """
+    Stage marker for the active MemoryProfiler; a no-op when not profiling.
+    """
+    profiler = _active_memory_profiler
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def record_memory_profile(summary: dict):
+    with _grok_metrics_lock:
+        os.makedirs(os.path.dirname(MEMORY_METRICS_PATH) or ".", exist_ok=True)
+        with open(MEMORY_METRICS_PATH, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(summary) + "\n")
+
+
+def summarize_memory_metrics(records=None) -> dict:
+    """
+    Per stage: runs, max and p95 peak MB, mean retained MB – for sizing workers.
+    """
+    records = read_grok_metrics(MEMORY_METRICS_PATH) if records is None else records
+    by_stage = defaultdict(lambda: {"peak": [], "retained": []})
+    for rec in records:
+        by_stage["(total)"]["peak"].append(rec["peak_mb"])
+        by_stage["(total)"]["retained"].append(rec.get("retained_mb") or 0.0)
+        for stage in rec.get("stages", []):
+            by_stage[stage["stage"]]["peak"].append(stage["peak_mb"])
+            by_stage[stage["stage"]]["retained"].append(stage["retained_mb"])
+    return {
+        stage: {
+            "runs": len(v["peak"]),
+            "peak_mb_max": round(max(v["peak"]), 2),
+            "peak_mb_p95": round(float(np.percentile(v["peak"], 95)), 2),
+            "retained_mb_mean": round(float(np.mean(v["retained"])), 2),
+        }
+        for stage, v in by_stage.items()
+    }
+
+
+# ============================================================
+# PIPELINE (no Streamlit – shared by the UI and incident_headless.py)
 # ============================================================
 
-def build_report_text(user_data: dict, ai_result: dict):
-    # Attach Grok decisions back onto data so our templates can see them
-    user_data["compressibility_outcome"] = ai_result.get("compressibility_outcome", "exceeds_normal")
+# Local assembly (charts, resampled appendix images, the docx draft) runs on
+# this pool while the Grok call is in flight.
+ASSEMBLY_WORKERS = 4
 
-    # 1. Header
-    accessories_joined = ", ".join(user_data["accessories"])
-    short_desc = user_data["string_desc"]
-    if len(short_desc) > 60:
-        short_desc = short_desc[:57] + "..."
-    header_text = f"""ENGINEERING REPORT
 
-{user_data['date_of_report']}
+def assemble_report_locally(user_data: dict, images=None, build_docx: bool = True) -> dict:
+    """
+    Everything in a report that does not depend on the AI result: EDR charts
+    and, with build_docx, a DocxDraft (template, header, volume summary,
+    appendices). Without build_docx the appendix images are still resampled
+    so the blob cache is warm for the .docx download.
+    Returns {"charts", "draft"} (draft is None without build_docx).
+    """
+    images = images or []
+    charts = render_edr_charts(user_data)
+    if not build_docx:
+        for img in dedupe_images(images):
+            prepare_appendix_image(img["raw"])
+        return {"charts": charts, "draft": None}
+    return {"charts": charts, "draft": DocxDraft.for_incident(user_data, images=images, charts=charts)}
+
+
+def assembly_pool() -> ThreadPoolExecutor:
+    return shared_resource(
+        "assembly_pool", lambda: ThreadPoolExecutor(max_workers=ASSEMBLY_WORKERS, thread_name_prefix="assembly")
+    )
 
-Revision: {user_data['revision']}
-Report: {user_data['cir_number']}
 
-{user_data['customer']} – {short_desc}: {user_data['title_line']}
+def run_report_pipeline(user_data: dict, api_key: str, model: str, images=None, grok_images=None,
+                        hedge_percentile=None, fallback_model=None, progress=None,
+                        build_docx: bool = True, skip_preflight: bool = False,
+                        profile_memory: bool = None, memory_budget_mb: float = None,
+                        prefetched=None) -> dict:
+    """
+    Full generation for one incident: Monte Carlo uncertainty and
+    hydrostatics (unless already in user_data["uncertainty"] / ["pressure"];
+    hydrostatics only with has_hydrostatics_inputs())
+    -> Grok, with local assembly (charts, appendix images, docx draft; see
+    assemble_report_locally) running alongside -> report text -> docx
+    (narrative sections filled into the draft).
+
+    images: appendix images ({"filename", "mime_type", "b64"}); also sent to Grok
+    unless grok_images is given.
+    hedge_percentile / fallback_model: passed through to generate_ai_full_report.
+    progress: optional callable(stage_name), called as each stage starts.
+    build_docx=False skips python-docx (docx_bytes is None); the UI previews
+    with render_report_html() and builds the .docx only on download.
+    Blocking preflight_check() issues raise ValueError (with the issues on
+    e.preflight) before anything is rendered or sent, unless skip_preflight.
+    profile_memory (default MEMORY_PROFILE_ENABLED) records per-stage memory
+    via MemoryProfiler into the memory metrics log; memory_budget_mb (default
+    MEMORY_BUDGET_MB) aborts with RuntimeError once a stage goes over it.
+    prefetched: optional Future from SpeculativeGrok.claim(); its ai_result
+    is used instead of calling Grok (waiting for it if still running), with
+    a normal call if it failed.
+    Returns {"ai_result", "report_text", "charts", "docx_bytes",
+    "memory_profile"}.
+    """
+    if images is None:
+        images = []
+    if grok_images is None:
+        grok_images = images
+    if progress is None:
+        progress = lambda stage: None
+
+    if not skip_preflight:
+        blocking = preflight_blocking(preflight_check(user_data))
+        if blocking:
+            e = ValueError("Pre-flight check failed: " + " ".join(i["message"] for i in blocking))
+            e.preflight = blocking
+            raise e
+
+    if profile_memory is None:
+        profile_memory = MEMORY_PROFILE_ENABLED
+    if memory_budget_mb is None:
+        memory_budget_mb = MEMORY_BUDGET_MB
+    profiler = MemoryProfiler(memory_budget_mb, label=user_data.get("cir_number")) if profile_memory else None
+
+    def stage(name):
+        progress(name)
+        return memory_stage(name)
 
-INCIDENT REPORT NUMBER: {user_data['cir_number']}
-CUSTOMER: {user_data['customer']}
-AUTHOR: {user_data['author']}
-Rig: {user_data['rig']}
-SURFACE: {user_data['surface_location']}
-UWI: {user_data['uwi']}
-EQUIPMENT: {accessories_joined}
-""".strip()
+    try:
+        with profiler or nullcontext():
+            if "uncertainty" not in user_data:
+                with stage("uncertainty"):
+                    mc = run_uncertainty_analysis(user_data)
+                    if mc:
+                        user_data["uncertainty"] = mc
+            if "pressure" not in user_data and has_hydrostatics_inputs(user_data):
+                with stage("hydrostatics"):
+                    pp = pressure_profile(user_data)
+                    if pp:
+                        user_data["pressure"] = pp
+            # Charts, image resampling and the docx draft don't need the AI
+            # result: build them while the Grok call is in flight.
+            local = assembly_pool().submit(assemble_report_locally, user_data, images, build_docx)
+            with stage("grok"):
+                try:
+                    ai_result = None
+                    if prefetched is not None:
+                        try:
+                            ai_result = prefetched.result()
+                        except Exception:
+                            ai_result = None
+                    if ai_result is None:
+                        ai_result = generate_ai_full_report(
+                            user_data, api_key=api_key, model=model, images=grok_images,
+                            hedge_percentile=hedge_percentile, fallback_model=fallback_model,
+                        )
+                except BaseException:
+                    local.cancel()
+                    raise
+            with stage("assembly"):
+                assembled = local.result()
+                charts_payload = assembled["charts"]
+            with stage("report_text"):
+                report_text = build_report_text(user_data, ai_result)
+            docx_bytes = None
+            if build_docx:
+                with stage("docx"):
+                    docx_bytes = assembled["draft"].finish(report_text)
+    finally:
+        if profiler:
+            record_memory_profile(profiler.summary())
+    return {
+        "ai_result": ai_result,
+        "report_text": report_text,
+        "charts": charts_payload,
+        "docx_bytes": docx_bytes,
+        "memory_profile": profiler.summary() if profiler else None,
+    }
 
-    # 2. Incident summary (Grok text)
-    incident_summary_text = "INCIDENT SUMMARY\n\n" + ai_result["narrative_sections"]["incident_summary"].strip()
 
-    # 3. Volume / depth summary (from numbers)
-    vt = user_data["volume_table"]
-    volume_table_text = f"""VOLUME / DEPTH SUMMARY
+# ============================================================
+# BACKGROUND JOB QUEUE (report generation off the Streamlit thread)
+# ============================================================
 
-Well TD: {vt.get('well_td_m', 'N/A')} m
-Well TVD: {vt.get('well_tvd_m', 'N/A')} m
-Shoe Depth: {vt.get('shoe_depth_m', 'N/A')} m
-Float Collar Top Depth: {vt.get('float_collar_depth_m', 'N/A')} m
-Airlock / CBS Depth: {vt.get('airlock_depth_m', 'N/A')} m
-Crossover Depth: {vt.get('crossover_depth_m', 'N/A')} m
+JOB_WORKERS = int(os.environ.get("INCIDENT_BUILDER_JOB_WORKERS", "2"))
+JOB_STATES = ("queued", "running", "done", "failed")
+# Sections run_report_pipeline() derives from the form data. They are not
+# persisted with a job's input, so rerender() recomputes them with the
+# current engines.
+DERIVED_INPUT_KEYS = ("uncertainty", "pressure")
+
+# Stored reports record hashes of what rendered them (job.json "render_version"
+# for the report text, "docx_render_version" for the Word file) so
+# rerender_reports() can refresh only stale ones from the stored AI result.
+# The hashes cover the source of these functions and the values of these
+# constants; bump REPORT_RENDERER_VERSION for changes they miss (e.g. a
+# python-docx upgrade).
+REPORT_RENDERER_VERSION = 1
+# ROOT_CAUSE_BLOCK_BUILDERS values are lambdas whose source is one line, so
+# the cause_* functions they call are listed themselves.
+REPORT_TEXT_RENDERERS = [
+    "build_report_text", "report_header_text", "report_volume_text", "render_template",
+    "VOLUME_SUMMARY_TEMPLATE", "HYDROSTATICS_SUMMARY_TEMPLATE", "ROOT_CAUSE_BLOCK_BUILDERS",
+    "cause_incorrect_pumping_volume", "cause_compressibility_ballooning", "cause_failure_prior_to_cementing",
+    "cause_mismatched_receptacle", "cause_debris_on_collar", "cause_third_party_integrity",
+    "describe_bleedoff_fit",
+    "run_uncertainty_analysis", "describe_displacement_uncertainty", "describe_flowback_uncertainty",
+    "MC_DRAWS", "MC_CASING_TOLERANCE", "MC_METER_ERROR_SD", "MC_GAUGE_ERROR_SD", "MC_FLOWBACK_READING_SD",
+    "MC_AERATION_FRACTION", "MC_FLUID_COMPRESSIBILITY_PER_MPA", "MC_BALLOONING_PER_MPA",
+    "MC_THERMAL_EXPANSION_PER_C", "MC_WARMBACK_C", "MC_LANDED_FRACTION",
+    "has_hydrostatics_inputs", "pressure_profile", "pressure_profiles_batch", "_pressure_setup",
+    "minimum_curvature_tvd",
+    "describe_pressure_profile", "GRAVITY", "PRESSURE_DEFAULT_DENSITIES", "PRESSURE_BUMP_MARGIN_MPA",
+]
+REPORT_DOCX_RENDERERS = [
+    "build_docx_bytes", "DocxDraft", "_docx_header", "_docx_section", "_docx_root_causes",
+    "_docx_conclusion", "_docx_appendix", "ensure_styles", "split_report_into_structures", "_build_docx_template",
+    "prepare_appendix_image", "DOCX_IMAGE_WIDTH_IN", "DOCX_IMAGE_DPI", "DOCX_IMAGE_JPEG_QUALITY",
+    "render_edr_charts", "CHART_RENDER_VERSION",
+]
+RERENDER_WORKERS = max(1, (os.cpu_count() or 2) - 1)
 
-Casing Volume Calculated:
-  Nominal: {vt.get('casing_vol_nominal_m3', 'N/A')} m³
-  Min:     {vt.get('casing_vol_min_m3', 'N/A')} m³
-  Max:     {vt.get('casing_vol_max_m3', 'N/A')} m³
 
-Volume to Airlock / CBS: {vt.get('volume_to_airlock_m3', 'N/A')} m³
-Buoyant Volume (nominal): {vt.get('buoyant_volume_nom_m3', 'N/A')} m³
+def _render_source(obj) -> str:
+    import inspect
 
-Displacement Volume Pumped: {vt.get('displacement_pumped_m3', 'N/A')} m³
-Excess Cement to Surface:  {vt.get('excess_to_surface_m3', 'N/A')} m³
-""".strip()
+    if isinstance(obj, dict):
+        return "\n".join(f"{key}: {_render_source(value)}" for key, value in sorted(obj.items()))
+    if callable(obj):
+        return inspect.getsource(obj)
+    return repr(obj)
 
-    # 4. Incident review (Grok)
-    incident_review_text = "INCIDENT REVIEW\n\n" + ai_result["narrative_sections"]["incident_review"].strip()
 
-    # 5. Potential root causes (our templates, based on Grok selection)
-    root_cause_sections = []
-    root_block_keys = ai_result.get("root_cause_blocks", [])
-    for block_key in root_block_keys:
-        builder = ROOT_CAUSE_BLOCK_BUILDERS.get(block_key)
-        if builder:
-            temp = {
-                **user_data,
-                "post_job": user_data["post_job"],
-                "volume_table": user_data["volume_table"],
-                "compressibility_outcome": user_data.get("compressibility_outcome", "exceeds_normal"),
-            }
-            root_cause_sections.append(builder(temp))
+def _build_render_versions() -> dict:
+    versions = {}
+    for kind, names in (("text", REPORT_TEXT_RENDERERS), ("docx", REPORT_DOCX_RENDERERS)):
+        h = hashlib.sha256(str(REPORT_RENDERER_VERSION).encode("utf-8"))
+        for name in names:
+            h.update(f"\0{name}\0{_render_source(globals()[name])}".encode("utf-8"))
+        versions[kind] = h.hexdigest()[:16]
+    return versions
 
-    analysis_extra = ai_result["narrative_sections"].get("overall_cause_analysis", "").strip()
-    if analysis_extra:
-        root_cause_sections.append(
-            "Engineering Assessment / Cause Analysis\n\n" + analysis_extra
+
+def report_render_versions() -> dict:
+    """
+    {"text": hash, "docx": hash} for the renderers in this process.
+    """
+    return shared_resource("render_versions", _build_render_versions)
+
+
+def _pid_alive(pid) -> bool:
+    if not pid or pid == os.getpid() or os.name != "posix":
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ReportJobQueue:
+    """
+    In-process queue for report generation with a bounded worker pool.
+
+    Job state is persisted under jobs_dir/<job_id>/ so the UI can poll and
+    fetch results after reruns, page refreshes or from another session:
+      job.json     – status / stage / timings / error
+      input.json   – user_data as submitted, less DERIVED_INPUT_KEYS
+      images.json  – appendix images as submitted ({"filename", "mime_type",
+                     "blob"}; bytes live in the shared BlobStore)
+      result.json  – ai_result + report_text   (when done)
+    The Word file is built on first download (see docx_bytes) and also kept
+    in the BlobStore (job.json "docx_blob"). Each job owns its blobs as
+    "job:<id>" until delete().
+
+    The API key is held in memory only; jobs that were queued or running when
+    the server stopped are marked failed on the next start.
+    """
+
+    def __init__(self, jobs_dir: str = JOBS_DIR, max_workers: int = JOB_WORKERS, recover: bool = True):
+        self.jobs_dir = jobs_dir
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-job")
+        self._docx_locks = defaultdict(threading.Lock)
+        os.makedirs(jobs_dir, exist_ok=True)
+        if recover:
+            self._recover_interrupted()
+
+    # ----- persistence -----------------------------------------------------
+
+    def _job_path(self, job_id: str, name: str = "job.json") -> str:
+        return os.path.join(self.jobs_dir, job_id, name)
+
+    def _write_json(self, path: str, obj):
+        # The server, watch daemon and rerender workers share jobs_dir.
+        tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(obj, fh, indent=2, default=str)
+        os.replace(tmp, path)
+
+    def _update(self, job_id: str, **fields) -> dict:
+        with self._lock:
+            job = self.get(job_id) or {}
+            job.update(fields, updated_at=datetime.now().isoformat(timespec="seconds"))
+            self._write_json(self._job_path(job_id), job)
+            return job
+
+    def _store_images(self, job_id: str, images: list) -> list:
+        store = blob_store()
+        refs = []
+        for img in images:
+            refs.append({
+                "filename": img.get("filename"),
+                "mime_type": img.get("mime_type"),
+                "blob": store.put(base64.b64decode(img["b64"]), owner=f"job:{job_id}"),
+            })
+        return refs
+
+    def _load_images(self, job_id: str) -> list:
+        with open(self._job_path(job_id, "images.json"), "r", encoding="utf-8") as fh:
+            refs = json.load(fh)
+        store = blob_store()
+        return [
+            img if "b64" in img else {
+                "filename": img["filename"],
+                "mime_type": img["mime_type"],
+                "b64": base64.b64encode(store.get(img["blob"])).decode("utf-8"),
+            }
+            for img in refs
+        ]
+
+    def _recover_interrupted(self):
+        # Another live process (server or watch daemon) may share jobs_dir;
+        # only its own dead jobs are failed.
+        for job in self.list_jobs():
+            if job["status"] in ("queued", "running") and not _pid_alive(job.get("pid")):
+                self._update(job["id"], status="failed", error="Interrupted by server restart.")
+
+    # ----- public API ------------------------------------------------------
+
+    def submit(self, user_data: dict, api_key: str, model: str, origin: str = None, **pipeline_kwargs) -> str:
+        """
+        Queue a run_report_pipeline() call; returns the job id immediately.
+        pipeline_kwargs are passed through (images, grok_images, hedging...).
+        origin records where the input came from (default "form").
+        """
+        job_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f") + "-" + os.urandom(2).hex()
+        os.makedirs(os.path.join(self.jobs_dir, job_id), exist_ok=True)
+        self._write_json(
+            self._job_path(job_id, "input.json"),
+            {k: v for k, v in user_data.items() if k not in DERIVED_INPUT_KEYS},
         )
+        self._write_json(
+            self._job_path(job_id, "images.json"),
+            self._store_images(job_id, pipeline_kwargs.get("images") or []),
+        )
+        self._update(
+            job_id,
+            id=job_id,
+            label=f"{user_data.get('cir_number', '?')} rev {user_data.get('revision', '?')}",
+            status="queued",
+            stage=None,
+            model=model,
+            origin=origin or "form",
+            pid=os.getpid(),
+            created_at=datetime.now().isoformat(timespec="seconds"),
+            error=None,
+        )
+        self._pool.submit(self._run, job_id, user_data, api_key, model, pipeline_kwargs)
+        return job_id
+
+    def _run(self, job_id, user_data, api_key, model, pipeline_kwargs):
+        start = time.perf_counter()
+        self._update(job_id, status="running", started_at=datetime.now().isoformat(timespec="seconds"))
+        try:
+            result = run_report_pipeline(
+                user_data, api_key=api_key, model=model,
+                progress=lambda stage: self._update(job_id, stage=stage),
+                build_docx=False,
+                **pipeline_kwargs,
+            )
+            self._write_json(
+                self._job_path(job_id, "result.json"),
+                {"ai_result": result["ai_result"], "report_text": result["report_text"]},
+            )
+            analytics_error = None
+            try:
+                update_analytics(incident_analytics_row(user_data, result["ai_result"], job_id=job_id))
+            except Exception as e:
+                # The report itself is fine; analytics can be rebuilt later.
+                analytics_error = f"{type(e).__name__}: {e}"
+            self._update(
+                job_id, status="done", stage=None,
+                elapsed_s=round(time.perf_counter() - start, 2),
+                grok=result["ai_result"].get("grok_call"),
+                memory=result["memory_profile"],
+                analytics_error=analytics_error,
+                render_version=report_render_versions()["text"],
+            )
+        except Exception as e:
+            self._update(
+                job_id, status="failed", error=f"{type(e).__name__}: {e}",
+                elapsed_s=round(time.perf_counter() - start, 2),
+                memory=getattr(e, "memory_profile", None),
+            )
 
-    potential_root_causes_text = "POTENTIAL ROOT CAUSES\n\n" + "\n\n".join(root_cause_sections).strip()
+    def get(self, job_id: str):
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def list_jobs(self, limit: int = None):
+        """
+        Jobs newest first (job ids sort by submission time).
+        """
+        jobs = []
+        for job_id in sorted(os.listdir(self.jobs_dir), reverse=True):
+            job = self.get(job_id)
+            if job:
+                jobs.append(job)
+            if limit and len(jobs) >= limit:
+                break
+        return jobs
+
+    def result(self, job_id: str):
+        """
+        {"ai_result", "report_text"} for a finished job, else None.
+        """
+        path = self._job_path(job_id, "result.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def has_docx(self, job_id: str) -> bool:
+        job = self.get(job_id) or {}
+        return blob_store().exists(job.get("docx_blob")) or os.path.exists(self._job_path(job_id, "report.docx"))
+
+    def _read_input(self, job_id: str) -> dict:
+        with open(self._job_path(job_id, "input.json"), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def _build_docx(self, job_id: str, report_text: str) -> str:
+        """
+        Render the job's .docx into the blob store and record it; returns
+        the digest.
+        """
+        store = blob_store()
+        user_data = self._read_input(job_id)
+        images = self._load_images(job_id)
+        profiler = MemoryProfiler(MEMORY_BUDGET_MB, label=f"{job_id} docx") if MEMORY_PROFILE_ENABLED else None
+        try:
+            with profiler or nullcontext(), memory_stage("docx"):
+                docx = build_docx_bytes(report_text, images=images, charts=render_edr_charts(user_data))
+        finally:
+            if profiler:
+                record_memory_profile(profiler.summary())
+                self._update(job_id, docx_memory=profiler.summary())
+        digest = store.put(docx.getvalue(), owner=f"job:{job_id}")
+        self._update(job_id, docx_blob=digest, docx_render_version=report_render_versions()["docx"])
+        return digest
+
+    def docx_bytes(self, job_id: str) -> BytesIO:
+        """
+        The job's .docx, built from the stored report text, images and cached
+        EDR charts on first request and kept in the blob store afterwards.
+        """
+        store = blob_store()
+        with self._docx_locks[job_id]:
+            legacy_path = self._job_path(job_id, "report.docx")
+            if os.path.exists(legacy_path):
+                with open(legacy_path, "rb") as fh:
+                    return BytesIO(fh.read())
+            digest = (self.get(job_id) or {}).get("docx_blob")
+            if not store.exists(digest):
+                digest = self._build_docx(job_id, self.result(job_id)["report_text"])
+            return BytesIO(store.get(digest))
+
+    def rerender(self, job_id: str, force: bool = False) -> str:
+        """
+        Bring a finished report up to the current renderers from its stored
+        input and AI result (no Grok call). The report text is rebuilt if its
+        render_version is stale; a Word file that was already built is
+        rebuilt if the text or the docx renderers changed. Returns "text",
+        "docx", "current" or "skipped" (not finished).
+        """
+        job = self.get(job_id) or {}
+        result = self.result(job_id)
+        if job.get("status") != "done" or result is None:
+            return "skipped"
+        versions = report_render_versions()
+        legacy_path = self._job_path(job_id, "report.docx")
+        has_docx = blob_store().exists(job.get("docx_blob")) or os.path.exists(legacy_path)
+        text_stale = force or job.get("render_version") != versions["text"]
+        docx_stale = has_docx and (text_stale or job.get("docx_render_version") != versions["docx"])
+        if not text_stale and not docx_stale:
+            return "current"
+
+        with self._docx_locks[job_id]:
+            if text_stale:
+                user_data = self._read_input(job_id)
+                # Older jobs stored these; recompute so engine changes show up.
+                for key in DERIVED_INPUT_KEYS:
+                    user_data.pop(key, None)
+                mc = run_uncertainty_analysis(user_data)
+                if mc:
+                    user_data["uncertainty"] = mc
+                pp = pressure_profile(user_data) if has_hydrostatics_inputs(user_data) else None
+                if pp:
+                    user_data["pressure"] = pp
+                result["report_text"] = build_report_text(user_data, result["ai_result"])
+                self._write_json(self._job_path(job_id, "result.json"), result)
+                self._update(job_id, render_version=versions["text"], rendered_at=datetime.now().isoformat(timespec="seconds"))
+            if docx_stale:
+                old_digest = job.get("docx_blob")
+                self._build_docx(job_id, result["report_text"])
+                if old_digest and old_digest != (self.get(job_id) or {}).get("docx_blob"):
+                    blob_store().release(f"job:{job_id}", [old_digest])
+                if os.path.exists(legacy_path):
+                    os.remove(legacy_path)
+        return "text" if text_stale else "docx"
+
+    def delete(self, job_id: str):
+        """
+        Remove a finished / failed job and release its blobs (reclaimed by
+        BlobStore.gc()).
+        """
+        blob_store().release(f"job:{job_id}")
+        shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+
+
+_rerender_queue = None
+
+
+def _rerender_worker_init(jobs_dir: str):
+    global _rerender_queue
+    _rerender_queue = ReportJobQueue(jobs_dir, max_workers=1, recover=False)
+
+
+def _rerender_in_worker(job_id: str, force: bool):
+    try:
+        return job_id, _rerender_queue.rerender(job_id, force=force), None
+    except Exception as e:
+        return job_id, "failed", f"{type(e).__name__}: {e}"
 
-    # 6. Conclusion (Grok)
-    conclusion_text = "CONCLUSION\n\n" + ai_result["narrative_sections"]["conclusion"].strip()
 
-    parts = [
-        header_text,
-        "",
-        incident_summary_text,
-        "",
-        volume_table_text,
-        "",
-        incident_review_text,
-        "",
-        potential_root_causes_text,
-        "",
-        conclusion_text,
-        ""
+def rerender_reports(jobs_dir: str = JOBS_DIR, workers: int = RERENDER_WORKERS, force: bool = False,
+                     dry_run: bool = False, progress=None) -> dict:
+    """
+    ReportJobQueue.rerender() over every stored report whose render hashes
+    are stale, in a process pool (rendering is CPU-bound). Jobs rendered by
+    the current renderers are skipped without reading their results.
+    dry_run only counts. progress: optional callable(done, total).
+    Returns {"checked", "stale", "text", "docx", "failed", "errors", "elapsed_s"}.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    versions = report_render_versions()
+    queue = ReportJobQueue(jobs_dir, max_workers=1, recover=False)
+    jobs = [job for job in queue.list_jobs() if job["status"] == "done"]
+    stale = [
+        job["id"] for job in jobs
+        if force
+        or job.get("render_version") != versions["text"]
+        or (job.get("docx_blob") and job.get("docx_render_version") != versions["docx"])
+        or os.path.exists(queue._job_path(job["id"], "report.docx"))
     ]
+    summary = {"checked": len(jobs), "stale": len(stale), "text": 0, "docx": 0, "failed": 0, "errors": {}}
+    if stale and not dry_run:
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_rerender_worker_init,
+                                 initargs=(jobs_dir,)) as pool:
+            futures = [pool.submit(_rerender_in_worker, job_id, force) for job_id in stale]
+            for done, future in enumerate(as_completed(futures), 1):
+                job_id, outcome, error = future.result()
+                if outcome in summary:
+                    summary[outcome] += 1
+                if error:
+                    summary["errors"][job_id] = error
+                if progress:
+                    progress(done, len(stale))
+    summary["elapsed_s"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def render_job_panel(job_queue: ReportJobQueue, limit: int = 15):
+    """
+    Streamlit panel listing recent jobs (all users on this server) and the
+    details / download for one selected finished report. Only the selected
+    job's result is read from disk, so polling stays cheap.
+    """
+    import streamlit as st
 
-    return "\n".join(parts).strip() + "\n"
+    jobs = job_queue.list_jobs(limit=limit)
+    if not jobs:
+        st.caption("No report jobs yet.")
+        return
+
+    st.table([
+        {
+            "job": job["id"],
+            "incident": job["label"],
+            "source": job.get("origin") or "form",
+            "status": job["status"] + (f" ({job['stage']})" if job.get("stage") else ""),
+            "elapsed_s": job.get("elapsed_s"),
+            "error": job.get("error") or "",
+        }
+        for job in jobs
+    ])
+
+    done = {job["id"]: job for job in jobs if job["status"] == "done"}
+    if not done:
+        return
+    job_id = st.selectbox(
+        "Open finished report", list(done), format_func=lambda j: f"{done[j]['label']} ({j})",
+        key="open_job_id",
+    )
+    result = job_queue.result(job_id)
+    if result is None:
+        return
+
+    call = result["ai_result"].get("grok_call") or {}
+    if call.get("latency_s") is not None:
+        st.caption(
+            f"Grok: {call['latency_s']} s"
+            + (f" (hedged after {call['hedge_delay_s']} s, winner: {call['winner']})" if call.get("hedged") else "")
+            + f" – rate-limit queue wait {call.get('queue_wait_s', 0.0)} s"
+            + (f", {call['retries_429']} × 429 retried" if call.get("retries_429") else "")
+            + (" – prefetched before Generate was clicked" if call.get("speculative") else "")
+        )
+    memory = done[job_id].get("memory")
+    if memory:
+        st.caption(
+            f"Memory: peak {memory['peak_mb']} MB, retained {memory['retained_mb']} MB"
+            + (f" (budget {memory['budget_mb']:g} MB)" if memory.get("budget_mb") else "")
+        )
+        with st.expander("Memory by stage", expanded=False):
+            st.table(memory["stages"])
+    if done[job_id].get("render_version") != report_render_versions()["text"]:
+        st.caption("Rendered with older report templates; `incident_headless.py rerender` refreshes it.")
+    with st.expander("Show raw AI JSON (root causes & narratives)", expanded=False):
+        st.json(result["ai_result"])
+
+    report_text = result["report_text"]
+    file_stem = f"{done[job_id]['label'].split(' rev ')[0].replace(' ', '_')}_incident_report"
+    tab_html, tab_md, tab_json = st.tabs(["Preview", "Markdown", "JSON"])
+    with tab_html:
+        st.markdown(render_report_html(report_text), unsafe_allow_html=True)
+    with tab_md:
+        markdown = render_report_markdown(report_text)
+        st.code(markdown, language="markdown")
+        st.download_button("Download Markdown", markdown, file_name=f"{file_stem}.md", key=f"md-{job_id}")
+    with tab_json:
+        report_json = render_report_json(report_text, result["ai_result"])
+        st.download_button("Download JSON", report_json, file_name=f"{file_stem}.json", key=f"json-{job_id}")
+
+    # python-docx only runs when someone actually wants the Word file.
+    if job_queue.has_docx(job_id) or st.button("Build Word Report (.docx)", key=f"build-{job_id}"):
+        docx = job_queue.docx_bytes(job_id)
+        size_mb, size_warning = check_docx_size(docx)
+        st.caption(f"Word report: {size_mb} MB (budget {DOCX_SIZE_BUDGET_MB:g} MB)")
+        if size_warning:
+            st.warning(size_warning)
+        st.download_button(
+            label="Download Word Report (.docx)",
+            data=docx,
+            file_name=f"{file_stem}.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            key=f"download-{job_id}",
+        )
 
 
 # ============================================================
-# DOCX STYLING + RENDERING (to BytesIO) + IMAGE APPENDIX
+# WATCH-FOLDER INGESTION (draft reports from files dropped by field staff)
 # ============================================================
 
-def ensure_styles(doc):
-    styles = doc.styles
+WATCH_STATE_PATH = os.path.join(DATA_DIR, "watch_state.json")
+WATCH_DEBOUNCE_S = 30.0                # a group must be quiet this long before ingestion
+WATCH_POLL_S = 5.0
+WATCH_MAX_INFLIGHT = 2 * JOB_WORKERS   # drafts queued / running at once; the rest wait on disk
+WATCH_EDR_EXTENSIONS = (".csv", ".txt", ".asc")
+WATCH_IMAGE_EXTENSIONS = tuple(f".{ext}" for ext in IMAGE_UPLOAD_TYPES)
+WATCH_PARTIAL_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload", ".download")
 
-    if "TitleStyle" not in [s.name for s in styles]:
-        style = styles.add_style("TitleStyle", WD_STYLE_TYPE.PARAGRAPH)
-    else:
-        style = styles["TitleStyle"]
-    style.font.name = "Calibri"
-    style.font.size = Pt(14)
-    style.font.bold = True
-    style.paragraph_format.space_after = Pt(6)
 
-    if "SectionHeader" not in [s.name for s in styles]:
-        style = styles.add_style("SectionHeader", WD_STYLE_TYPE.PARAGRAPH)
-    else:
-        style = styles["SectionHeader"]
-    style.font.name = "Calibri"
-    style.font.size = Pt(12)
-    style.font.bold = True
-    style.all_caps = True
-    style.paragraph_format.space_before = Pt(12)
-    style.paragraph_format.space_after = Pt(6)
+def watch_group_key(relpath: str):
+    """
+    CIR group for a path relative to the watch folder: its top-level folder,
+    or for loose files the name up to the first "_" ("CIR-123_edr.csv").
+    None for files to ignore (hidden, Office lock files, partial uploads).
+    """
+    parts = relpath.replace(os.sep, "/").split("/")
+    name = parts[-1]
+    if any(part.startswith(".") for part in parts) or name.startswith("~$"):
+        return None
+    if name.lower().endswith(WATCH_PARTIAL_SUFFIXES):
+        return None
+    if len(parts) > 1:
+        return parts[0]
+    return os.path.splitext(name)[0].split("_", 1)[0]
 
-    if "BodyText" not in [s.name for s in styles]:
-        style = styles.add_style("BodyText", WD_STYLE_TYPE.PARAGRAPH)
-    else:
-        style = styles["BodyText"]
-    style.font.name = "Calibri"
-    style.font.size = Pt(10.5)
-    style.font.bold = False
-    style.paragraph_format.space_after = Pt(6)
 
-    if "SubHeader" not in [s.name for s in styles]:
-        style = styles.add_style("SubHeader", WD_STYLE_TYPE.PARAGRAPH)
-    else:
-        style = styles["SubHeader"]
-    style.font.name = "Calibri"
-    style.font.size = Pt(11)
-    style.font.bold = True
-    style.paragraph_format.space_before = Pt(6)
-    style.paragraph_format.space_after = Pt(3)
+def load_watch_group(paths: list):
+    """
+    (user_data, images) from one group's files: exactly one incident JSON,
+    at most one EDR export, at most one survey (CSV with "survey" in the
+    name), any number of photos. Other files are ignored.
+    Raises ValueError when the group cannot make an incident.
+    """
+    by_ext = defaultdict(list)
+    for path in sorted(paths):
+        by_ext[os.path.splitext(path)[1].lower()].append(path)
+    json_paths = by_ext[".json"]
+    edr_paths = [p for ext in WATCH_EDR_EXTENSIONS for p in by_ext[ext]]
+    survey_paths = [p for p in edr_paths if "survey" in os.path.basename(p).lower()]
+    edr_paths = [p for p in edr_paths if p not in survey_paths]
+    image_paths = [p for ext in WATCH_IMAGE_EXTENSIONS for p in by_ext[ext]]
+
+    if len(json_paths) != 1:
+        raise ValueError(f"expected one incident JSON, found {len(json_paths)}")
+    if len(edr_paths) > 1:
+        raise ValueError(f"expected at most one EDR export, found {len(edr_paths)}")
+    if len(survey_paths) > 1:
+        raise ValueError(f"expected at most one survey, found {len(survey_paths)}")
+    with open(json_paths[0], "r", encoding="utf-8") as fh:
+        user_data = json.load(fh)
+    if not isinstance(user_data, dict):
+        raise ValueError(f"{os.path.basename(json_paths[0])} is not an incident object")
+    if edr_paths:
+        attach_edr_export(user_data, edr_paths[0])
+    if survey_paths:
+        user_data["survey"] = parse_survey(survey_paths[0])
+    return user_data, encode_image_files(image_paths)
+
+
+class WatchFolderIngestor:
+    """
+    Turns per-CIR file groups in a shared folder into draft report jobs.
+
+    Each scan only stats files, groups them with watch_group_key() and
+    fingerprints each group by (path, size, mtime). A group is ingested once
+    its fingerprint has been observed unchanged for debounce_s and its newest
+    file is at least that old. Copies that preserve mtimes (a CIR folder whose
+    JSON lands before its photos) therefore still wait for the file set to
+    settle, and a backlog found at startup goes after debounce_s. Ingesting runs
+    load_watch_group() and preflight_check(); blocking issues reject the group
+    (unless force), otherwise it goes to the ReportJobQueue with origin
+    "watch:<group>".
+
+    At most max_inflight drafts are queued or running at a time and the rest
+    wait on disk, oldest first, so a backlog of hundreds of folders never
+    holds every photo in memory. Outcomes and fingerprints are kept in
+    state_path: restarts skip groups already handled and adding or changing
+    a file in a group ingests it again. Failed jobs are not retried unless
+    retry_failed is set.
+    """
 
-    if "MonoBlock" not in [s.name for s in styles]:
-        style = styles.add_style("MonoBlock", WD_STYLE_TYPE.PARAGRAPH)
-    else:
-        style = styles["MonoBlock"]
-    style.font.name = "Consolas"
-    style.font.size = Pt(10)
-    style.font.bold = False
-    style.paragraph_format.left_indent = Pt(18)
-    style.paragraph_format.space_before = Pt(3)
-    style.paragraph_format.space_after = Pt(3)
+    def __init__(self, watch_dir: str, job_queue: ReportJobQueue, api_key: str, model: str,
+                 debounce_s: float = WATCH_DEBOUNCE_S, max_inflight: int = WATCH_MAX_INFLIGHT,
+                 force: bool = False, retry_failed: bool = False, state_path: str = WATCH_STATE_PATH):
+        self.watch_dir = watch_dir
+        self.job_queue = job_queue
+        self.api_key = api_key
+        self.model = model
+        self.debounce_s = debounce_s
+        self.max_inflight = max(1, max_inflight)
+        self.force = force
+        self.state_path = state_path
+        self._seen = {}        # group -> (fingerprint, first seen at)
+        self._inflight = {}    # group -> job id
+
+        with _file_lock(f"{state_path}.lock"):
+            state = _read_json(state_path, {})
+            if retry_failed:
+                state = {k: rec for k, rec in state.items() if rec.get("status") != "failed"}
+                _write_json_atomic(state_path, state)
+        # Drafts a previous run left queued are followed up (the queue marks
+        # them failed if that run died).
+        self._inflight = {k: rec["job_id"] for k, rec in state.items() if rec.get("status") == "queued"}
+
+    # ----- state -----------------------------------------------------------
+
+    def state(self) -> dict:
+        return _read_json(self.state_path, {})
+
+    def _record(self, group: str, record: dict):
+        with _file_lock(f"{self.state_path}.lock"):
+            state = _read_json(self.state_path, {})
+            state[group] = {
+                **state.get(group, {}), **record,
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            _write_json_atomic(self.state_path, state)
+
+    # ----- scanning --------------------------------------------------------
+
+    def scan(self) -> dict:
+        """
+        {group: {"files": [relpath], "fingerprint", "newest_mtime"}} without
+        reading any file.
+        """
+        files = defaultdict(list)
+        stack = [self.watch_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    rel = os.path.relpath(entry.path, self.watch_dir)
+                    group = watch_group_key(rel)
+                    if group is not None:
+                        info = entry.stat()
+                        files[group].append((rel, info.st_size, info.st_mtime_ns))
+        groups = {}
+        for group, entries in files.items():
+            entries.sort()
+            groups[group] = {
+                "files": [rel for rel, _, _ in entries],
+                "fingerprint": hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()[:16],
+                "newest_mtime": max(mtime for _, _, mtime in entries) / 1e9,
+            }
+        return groups
+
+    def _reap(self) -> int:
+        finished = 0
+        for group, job_id in list(self._inflight.items()):
+            job = self.job_queue.get(job_id) or {"status": "failed", "error": "Job record missing."}
+            if job["status"] in ("done", "failed"):
+                self._record(group, {"status": job["status"], "error": job.get("error")})
+                del self._inflight[group]
+                finished += 1
+        return finished
+
+    def _ingest(self, group: str, info: dict) -> str:
+        record = {"fingerprint": info["fingerprint"], "files": info["files"], "job_id": None, "issues": [], "error": None}
+        try:
+            user_data, images = load_watch_group([os.path.join(self.watch_dir, rel) for rel in info["files"]])
+            user_data.setdefault("cir_number", group)
+            issues = preflight_check(user_data)
+        except Exception as e:
+            # One malformed group is rejected; it must not stop the daemon.
+            record.update(status="rejected", error=f"{type(e).__name__}: {e}")
+            self._record(group, record)
+            return "rejected"
+        record["issues"] = [f"{i['severity']}: {i['message']}" for i in issues]
+        if preflight_blocking(issues) and not self.force:
+            record.update(status="rejected", error="pre-flight check failed")
+        else:
+            record.update(status="queued", job_id=self.job_queue.submit(
+                user_data, self.api_key, self.model, origin=f"watch:{group}", images=images,
+            ))
+            self._inflight[group] = record["job_id"]
+        self._record(group, record)
+        return record["status"]
+
+    def tick(self, now: float = None) -> dict:
+        """
+        One scan: follow up finished drafts, then ingest ready groups into
+        free slots. Returns counts for logging.
+        """
+        now = time.time() if now is None else now
+        counts = {"finished": self._reap(), "queued": 0, "rejected": 0}
+        groups = self.scan()
+        state = self.state()
+        self._seen = {g: seen for g, seen in self._seen.items() if g in groups}
+
+        ready, waiting = [], 0
+        for group, info in groups.items():
+            if group in self._inflight or state.get(group, {}).get("fingerprint") == info["fingerprint"]:
+                continue
+            seen = self._seen.get(group)
+            if seen is None or seen[0] != info["fingerprint"]:
+                self._seen[group] = (info["fingerprint"], now)
+                waiting += 1
+            elif now - max(seen[1], info["newest_mtime"]) < self.debounce_s:
+                waiting += 1
+            else:
+                ready.append(group)
+
+        ready.sort(key=lambda g: groups[g]["newest_mtime"])
+        slots = self.max_inflight - len(self._inflight)
+        for group in ready[:max(slots, 0)]:
+            counts[self._ingest(group, groups[group])] += 1
+        counts.update(
+            groups=len(groups), inflight=len(self._inflight),
+            pending=waiting + max(len(ready) - max(slots, 0), 0),
+        )
+        return counts
+
+    def run(self, poll_s: float = WATCH_POLL_S, once: bool = False, stop_event=None, on_tick=None) -> dict:
+        """
+        Poll until stop_event is set, or with once until nothing is pending
+        or in flight (drain a backlog and exit).
+        """
+        counts = {}
+        while not (stop_event and stop_event.is_set()):
+            counts = self.tick()
+            if on_tick:
+                on_tick(counts)
+            if once and not counts["pending"] and not counts["inflight"]:
+                break
+            if stop_event:
+                stop_event.wait(poll_s)
+            else:
+                time.sleep(poll_s)
+        return counts
 
 
-def split_report_into_structures(report_text):
-    blocks = [b.strip() for b in report_text.split("\n\n") if b.strip()]
-    structured = {
-        "header": [],
-        "incident_summary": [],
-        "volume_table": [],
-        "incident_review": [],
-        "root_causes": [],
-        "conclusion": []
+# ============================================================
+# ANALYTICS ROLLUPS (maintained incrementally as reports are saved)
+# ============================================================
+
+ANALYTICS_DIMENSIONS = ["rig", "customer", "accessory", "month"]
+ANALYTICS_METRICS = [
+    "fcp_mpa",
+    "bump_pressure_mpa",
+    "bledoff_to_mpa",
+    "displacement_pumped_m3",
+    "cement_lead_m3",
+    "circulated_volume_m3",
+]
+
+# Accessory description keyword -> accessory type (first match wins).
+ACCESSORY_TYPES = [
+    ("float shoe", "Float Shoe"),
+    ("float collar", "Float Collar"),
+    ("plug", "Cement Plug"),
+    ("toe", "Toe Port / Sleeve"),
+    ("frac sleeve", "Frac Sleeve"),
+    ("airlock", "Airlock / CBS"),
+    ("cbs", "Airlock / CBS"),
+    ("buoyancy", "Buoyancy Sub"),
+]
+
+_json_files_lock = threading.Lock()
+
+
+@contextmanager
+def _file_lock(lock_path: str):
+    """
+    Thread lock plus, where available, an fcntl lock on lock_path so batch
+    processes and the server can update the same files.
+    """
+    with _json_files_lock:
+        os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+        with open(lock_path, "a", encoding="utf-8") as fh:
+            try:
+                import fcntl
+            except ImportError:
+                fcntl = None
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _write_json_atomic(path: str, obj):
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(obj, fh, default=str)
+    os.replace(tmp, path)
+
+
+def accessory_type(desc: str) -> str:
+    low = desc.lower()
+    for keyword, label in ACCESSORY_TYPES:
+        if keyword in low:
+            return label
+    return "Other"
+
+
+def incident_analytics_row(user_data: dict, ai_result: dict, job_id=None) -> dict:
+    """
+    Compact per-incident record for analytics (one per CIR; later saves replace
+    earlier ones).
+    """
+    row = {
+        "key": str(user_data.get("cir_number") or job_id),
+        "job_id": job_id,
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        "cir_number": user_data.get("cir_number"),
+        "revision": user_data.get("revision"),
+        "rig": user_data.get("rig") or "Unknown",
+        "customer": user_data.get("customer") or "Unknown",
+        "month": str(user_data.get("date_of_report") or "")[:7] or "Unknown",
+        "accessory": sorted({accessory_type(a) for a in user_data.get("accessories") or []}),
+        "root_causes": list(dict.fromkeys(ai_result.get("root_cause_blocks") or [])),
+        "compressibility_outcome": ai_result.get("compressibility_outcome") or "unknown",
     }
+    for metric in ANALYTICS_METRICS:
+        val = user_data.get(metric)
+        row[metric] = float(val) if isinstance(val, (int, float)) else None
+    return row
+
+
+def _apply_row(rollups: dict, row: dict, sign: int):
+    rollups["incidents"] = rollups.get("incidents", 0) + sign
+    by = rollups.setdefault("by", {})
+    for dim in ANALYTICS_DIMENSIONS:
+        values = row[dim] if isinstance(row[dim], list) else [row[dim]]
+        for value in values:
+            agg = by.setdefault(dim, {}).setdefault(
+                value, {"incidents": 0, "root_causes": {}, "compressibility": {}, "metrics": {}}
+            )
+            agg["incidents"] += sign
+            for counts, key in [(agg["root_causes"], rc) for rc in row["root_causes"]] + [
+                (agg["compressibility"], row["compressibility_outcome"])
+            ]:
+                counts[key] = counts.get(key, 0) + sign
+                if counts[key] <= 0:
+                    del counts[key]
+            for metric in ANALYTICS_METRICS:
+                x = row.get(metric)
+                if x is None:
+                    continue
+                n, total, total_sq = agg["metrics"].get(metric, [0, 0.0, 0.0])
+                agg["metrics"][metric] = [n + sign, total + sign * x, total_sq + sign * x * x]
+            if agg["incidents"] <= 0:
+                del by[dim][value]
+
+
+def _incident_row_path(analytics_dir: str, key: str) -> str:
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(analytics_dir, "rows", digest[:2], digest + ".json")
+
+
+def _write_incident_row(analytics_dir: str, row: dict):
+    path = _incident_row_path(analytics_dir, row["key"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_json_atomic(path, row)
+
+
+def _iter_incident_rows(analytics_dir: str):
+    rows_dir = os.path.join(analytics_dir, "rows")
+    for sub in sorted(os.listdir(rows_dir)) if os.path.isdir(rows_dir) else []:
+        for name in sorted(os.listdir(os.path.join(rows_dir, sub))):
+            if name.endswith(".json"):
+                row = _read_json(os.path.join(rows_dir, sub, name), None)
+                if row is not None:
+                    yield row
+
+
+def _migrate_incident_rows(analytics_dir: str):
+    # Caller holds the analytics lock. Older stores kept every row in one file.
+    legacy = os.path.join(analytics_dir, "incident_rows.json")
+    if not os.path.exists(legacy):
+        return
+    for row in _read_json(legacy, {}).values():
+        if not os.path.exists(_incident_row_path(analytics_dir, row["key"])):
+            _write_incident_row(analytics_dir, row)
+    os.remove(legacy)
+
+
+def update_analytics(row: dict, analytics_dir: str = ANALYTICS_DIR):
+    """
+    Fold one saved report into the rollups. If the CIR was saved before, its
+    previous contribution is subtracted first, so revisions don't double count.
+    Each save reads and writes the CIR's own row file plus rollups.json, whose
+    size grows with the number of distinct rigs / customers / accessory types
+    / months, not with the number of incidents.
+    """
+    rollups_path = os.path.join(analytics_dir, "rollups.json")
+    row_path = _incident_row_path(analytics_dir, row["key"])
+    with _file_lock(os.path.join(analytics_dir, ".lock")):
+        _migrate_incident_rows(analytics_dir)
+        rollups = _read_json(rollups_path, {"incidents": 0, "by": {}})
+        old = _read_json(row_path, None)
+        if old:
+            _apply_row(rollups, old, -1)
+        _apply_row(rollups, row, +1)
+        rollups["updated_at"] = row["saved_at"]
+        rollups["version"] = os.urandom(8).hex()
+        _write_incident_row(analytics_dir, row)
+        _write_json_atomic(rollups_path, rollups)
+
+
+def load_rollups(analytics_dir: str = ANALYTICS_DIR) -> dict:
+    return _read_json(os.path.join(analytics_dir, "rollups.json"), {"incidents": 0, "by": {}})
+
+
+def rollup_frame(rollups: dict, dimension: str):
+    """
+    pandas DataFrame for one dimension: incidents, root-cause counts,
+    compressibility outcome counts and metric means/std per value.
+    """
+    import pandas as pd
+
+    records = []
+    for value, agg in rollups.get("by", {}).get(dimension, {}).items():
+        rec = {dimension: value, "incidents": agg["incidents"]}
+        rec.update({f"rc:{k}": v for k, v in agg["root_causes"].items()})
+        rec.update({f"compressibility:{k}": v for k, v in agg["compressibility"].items()})
+        for metric, (n, total, total_sq) in agg["metrics"].items():
+            if n > 0:
+                mean = total / n
+                rec[f"{metric}:mean"] = round(mean, 2)
+                rec[f"{metric}:std"] = round(max(0.0, total_sq / n - mean * mean) ** 0.5, 2)
+        records.append(rec)
+    if not records:
+        return pd.DataFrame(columns=[dimension, "incidents"])
+    df = pd.DataFrame.from_records(records).set_index(dimension).sort_values("incidents", ascending=False)
+    count_cols = [c for c in df.columns if c.startswith(("rc:", "compressibility:"))]
+    df[count_cols] = df[count_cols].fillna(0).astype(int)
+    return df
+
+
+_rows_frame_cache = {}
+_rows_frame_lock = threading.Lock()
+
+
+def load_incident_rows_frame(analytics_dir: str = ANALYTICS_DIR):
+    """
+    All per-incident rows as a DataFrame for drill-downs. The row files are
+    only re-read when rollups.json has a new version (a save or rebuild in
+    any process); otherwise the frame from the last call is returned, so
+    treat it as read-only.
+    """
+    import pandas as pd
+
+    version = load_rollups(analytics_dir).get("version")
+    with _rows_frame_lock:
+        cached = _rows_frame_cache.get(analytics_dir)
+        if version is not None and cached and cached[0] == version:
+            return cached[1]
+    if os.path.exists(os.path.join(analytics_dir, "incident_rows.json")):
+        with _file_lock(os.path.join(analytics_dir, ".lock")):
+            _migrate_incident_rows(analytics_dir)
+    frame = pd.DataFrame.from_records(list(_iter_incident_rows(analytics_dir)))
+    with _rows_frame_lock:
+        _rows_frame_cache[analytics_dir] = (version, frame)
+    return frame
+
+
+def rebuild_analytics(jobs_dir: str = JOBS_DIR, analytics_dir: str = ANALYTICS_DIR) -> int:
+    """
+    Recompute rollups from every finished job (backfill / repair). Returns the
+    number of incidents.
+    """
+    rows = {}
+    for job_id in sorted(os.listdir(jobs_dir)) if os.path.isdir(jobs_dir) else []:
+        result = _read_json(os.path.join(jobs_dir, job_id, "result.json"), None)
+        user_data = _read_json(os.path.join(jobs_dir, job_id, "input.json"), None)
+        if result and user_data:
+            row = incident_analytics_row(user_data, result["ai_result"], job_id=job_id)
+            rows[row["key"]] = row
+    rollups = {"incidents": 0, "by": {}}
+    for row in rows.values():
+        _apply_row(rollups, row, +1)
+    rollups["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    rollups["version"] = os.urandom(8).hex()
+    with _file_lock(os.path.join(analytics_dir, ".lock")):
+        legacy = os.path.join(analytics_dir, "incident_rows.json")
+        if os.path.exists(legacy):
+            os.remove(legacy)
+        shutil.rmtree(os.path.join(analytics_dir, "rows"), ignore_errors=True)
+        for row in rows.values():
+            _write_incident_row(analytics_dir, row)
+        _write_json_atomic(os.path.join(analytics_dir, "rollups.json"), rollups)
+    return len(rows)
+
+
+def render_analytics_page(api_key: str = "", model: str = DEFAULT_GROK_MODEL):
+    """
+    Streamlit analytics view: rollups by dimension, chart, drill-down, CSV,
+    and the fleet summary report.
+    """
+    import streamlit as st
+
+    st.subheader("Incident analytics")
+    rollups = load_rollups()
+    st.caption(f"{rollups.get('incidents', 0)} incidents – updated {rollups.get('updated_at', 'never')}")
+    if st.button("Rebuild from stored reports"):
+        n = rebuild_analytics()
+        st.success(f"Rebuilt analytics from {n} incidents.")
+        rollups = load_rollups()
+
+    dimension = st.selectbox("Group by", ANALYTICS_DIMENSIONS, index=0)
+    df = rollup_frame(rollups, dimension)
+    if df.empty:
+        st.info("No saved reports yet.")
+        return
+
+    rc_cols = [c for c in df.columns if c.startswith("rc:")]
+    if rc_cols:
+        st.bar_chart(df[rc_cols].rename(columns=lambda c: c[3:]))
+    st.dataframe(df)
+    st.download_button(
+        "Download rollup CSV", df.to_csv().encode("utf-8"),
+        file_name=f"incident_rollup_by_{dimension}.csv", mime="text/csv",
+    )
+
+    st.markdown("#### Drill-down")
+    value = st.selectbox(f"{dimension.title()}", list(df.index))
+    rows = load_incident_rows_frame()
+    if dimension == "accessory":
+        mask = rows["accessory"].apply(lambda types: value in types)
+    else:
+        mask = rows[dimension] == value
+    detail = rows[mask].drop(columns=["key"]).sort_values("saved_at", ascending=False)
+    st.dataframe(detail)
+    st.download_button(
+        "Download incidents CSV", detail.to_csv(index=False).encode("utf-8"),
+        file_name=f"incidents_{dimension}_{str(value).replace(' ', '_')}.csv", mime="text/csv",
+    )
+
+    st.markdown("#### Fleet summary report")
+    months = sorted(rollups.get("by", {}).get("month", {}))
+    col1, col2 = st.columns(2)
+    with col1:
+        since = st.selectbox("From month", months, index=0)
+    with col2:
+        until = st.selectbox("To month", months, index=len(months) - 1)
+    if st.button("Build fleet summary (.docx)"):
+        if not api_key:
+            st.error("Please enter your GROK_API_KEY in the sidebar.")
+            return
+        incidents = fleet_incidents(since=since, until=until)
+        bar = st.progress(0.0, text="Summarising incidents…")
+        fleet = summarise_fleet(
+            incidents, api_key, model,
+            progress=lambda done, total: bar.progress(done / total, text=f"Summarised {done}/{total} incidents"),
+        )
+        bar.empty()
+        st.caption(
+            f"{len(incidents)} incidents, {fleet['calls']} Grok calls ({fleet['cached_calls']} cached, "
+            f"{fleet['failed_calls']} failed), ~{fleet['est_tokens']:,} tokens, {fleet['elapsed_s']} s"
+        )
+        st.download_button(
+            "Download fleet summary (.docx)", build_fleet_docx(fleet, incidents),
+            file_name=f"fleet_summary_{since}_{until}.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+
+
+# ============================================================
+# FLEET SUMMARY (map-reduce over stored incidents)
+# ============================================================
+
+FLEET_CACHE_VERSION = 1
+FLEET_BATCH_SIZE = 10            # digests merged per Grok call
+FLEET_CONCURRENCY = 4            # parallel Grok calls (the rate limiter still applies)
+FLEET_DIGEST_INPUT_CHARS = 6000  # report text sent per incident, so cost per incident is bounded
+
+FLEET_DIGEST_PROMPT = """
+You are a senior cementing / float equipment engineer preparing a quarterly fleet review.
+Summarise ONE incident report into a compact digest.
 
-    current_section = None
-    in_root_causes = False
-    pending_cause_title = None
-    pending_cause_body = []
+Return STRICT JSON with keys:
+{
+  "digest": "2-3 sentences, at most 70 words: what happened, the most probable cause, what was done",
+  "findings": ["up to 3 short findings useful across incidents"]
+}
+No markdown, no extra keys.
+""".strip()
 
-    def flush_pending_cause():
-        nonlocal pending_cause_title, pending_cause_body
-        if pending_cause_title is not None:
-            structured["root_causes"].append({
-                "title": pending_cause_title,
-                "body_lines": pending_cause_body[:],
-            })
-        pending_cause_title = None
-        pending_cause_body = []
+FLEET_MERGE_PROMPT = """
+You are a senior cementing / float equipment engineer preparing a quarterly fleet review.
+Merge the incident / group digests below into ONE digest for the whole group.
+Emphasise recurring causes, rigs or equipment, and recommendations; keep one-off details only if significant.
 
-    for block in blocks:
-        first_line = block.split("\n", 1)[0].strip()
+Return STRICT JSON with keys:
+{
+  "digest": "at most 150 words",
+  "findings": ["up to 6 recurring findings, each saying roughly how many incidents it covers"]
+}
+No markdown, no extra keys.
+""".strip()
 
-        if first_line.startswith("ENGINEERING REPORT"):
-            current_section = "header"
-            structured["header"].append(block)
 
-        elif first_line == "INCIDENT SUMMARY":
-            current_section = "incident_summary"
-            structured["incident_summary"].append(block)
+def fleet_incidents(jobs_dir: str = JOBS_DIR, since: str = None, until: str = None) -> list:
+    """
+    Latest finished report per CIR, optionally limited to report months
+    since..until ("YYYY-MM", inclusive). Oldest first.
+    """
+    latest = {}
+    for job_id in sorted(os.listdir(jobs_dir)) if os.path.isdir(jobs_dir) else []:
+        result = _read_json(os.path.join(jobs_dir, job_id, "result.json"), None)
+        user_data = _read_json(os.path.join(jobs_dir, job_id, "input.json"), None)
+        if not result or not user_data:
+            continue
+        month = str(user_data.get("date_of_report") or "")[:7]
+        if (since and month < since) or (until and month > until):
+            continue
+        latest[str(user_data.get("cir_number") or job_id)] = {
+            "job_id": job_id,
+            "user_data": user_data,
+            "ai_result": result["ai_result"],
+            "report_text": result["report_text"],
+        }
+    return sorted(latest.values(), key=lambda inc: str(inc["user_data"].get("date_of_report") or ""))
 
-        elif first_line == "VOLUME / DEPTH SUMMARY":
-            current_section = "volume_table"
-            structured["volume_table"].append(block)
 
-        elif first_line == "INCIDENT REVIEW":
-            current_section = "incident_review"
-            structured["incident_review"].append(block)
+def _fleet_grok(system_prompt: str, text: str, api_key: str, model: str, cache_key: list,
+                cache_dir: str = FLEET_CACHE_DIR):
+    """
+    One digest / merge call, cached on disk by its inputs. Returns
+    (parsed, est_tokens, cached).
+    """
+    key = hashlib.sha256(
+        json.dumps([FLEET_CACHE_VERSION, model, system_prompt, cache_key]).encode("utf-8")
+    ).hexdigest()
+    path = os.path.join(cache_dir, f"{key}.json")
+    cached = _read_json(path, None)
+    if cached:
+        return cached, 0, True
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text},
+        ],
+        "temperature": 0.2,
+        "max_tokens": 500,
+    }
+    parsed, info = call_grok(payload, api_key)
+    parsed = {"digest": str(parsed.get("digest", "")).strip(), "findings": list(parsed.get("findings") or [])}
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json_atomic(path, parsed)
+    return parsed, info.get("est_tokens") or 0, False
 
-        elif first_line == "POTENTIAL ROOT CAUSES":
-            current_section = "root_causes"
-            in_root_causes = True
 
-        elif first_line == "CONCLUSION":
-            flush_pending_cause()
-            current_section = "conclusion"
-            in_root_causes = False
-            structured["conclusion"].append(block)
+def digest_incident(incident: dict, api_key: str, model: str) -> dict:
+    """
+    Map step: one stored incident -> {"digest", "findings", "label", ...}.
+    Falls back to the report's own summary if Grok fails.
+    """
+    ud, ai = incident["user_data"], incident["ai_result"]
+    label = f"{ud.get('cir_number')} – {ud.get('rig') or 'Unknown rig'} ({ud.get('date_of_report')})"
+    text = (
+        f"INCIDENT: {label}\n"
+        f"Customer: {ud.get('customer')}\n"
+        f"Root cause modules: {', '.join(ai.get('root_cause_blocks') or [])}\n"
+        f"Compressibility outcome: {ai.get('compressibility_outcome')}\n\n"
+        f"REPORT:\n{incident['report_text'][:FLEET_DIGEST_INPUT_CHARS]}"
+    )
+    try:
+        parsed, tokens, cached = _fleet_grok(FLEET_DIGEST_PROMPT, text, api_key, model, [text])
+        ok = True
+    except Exception as e:
+        summary = (ai.get("narrative_sections") or {}).get("incident_summary", "")
+        parsed = {"digest": summary.strip()[:400], "findings": [], "error": str(e)}
+        tokens, cached, ok = 0, False, False
+    return {**parsed, "label": label, "tokens": tokens, "cached": cached, "ok": ok}
 
-        else:
-            if in_root_causes:
-                flush_pending_cause()
-                lines = block.split("\n")
-                pending_cause_title = lines[0].strip()
-                pending_cause_body = [ln for ln in lines[1:] if ln.strip() != ""]
-            else:
-                if current_section == "header":
-                    structured["header"].append(block)
-                elif current_section == "incident_summary":
-                    structured["incident_summary"].append(block)
-                elif current_section == "volume_table":
-                    structured["volume_table"].append(block)
-                elif current_section == "incident_review":
-                    structured["incident_review"].append(block)
-                elif current_section == "conclusion":
-                    structured["conclusion"].append(block)
 
-    flush_pending_cause()
-    return structured
+def merge_digests(digests: list, api_key: str, model: str) -> dict:
+    """
+    Reduce step: a batch of digests -> one group digest.
+    """
+    text = "\n\n".join(
+        f"[{d['label']}]\n{d['digest']}\nFindings: {'; '.join(d['findings'])}" for d in digests
+    )
+    label = f"{len(digests)} digests"
+    try:
+        parsed, tokens, cached = _fleet_grok(FLEET_MERGE_PROMPT, text, api_key, model, [text])
+        ok = True
+    except Exception as e:
+        parsed = {
+            "digest": " ".join(d["digest"] for d in digests)[:1200],
+            "findings": list(dict.fromkeys(f for d in digests for f in d["findings"]))[:6],
+            "error": str(e),
+        }
+        tokens, cached, ok = 0, False, False
+    return {**parsed, "label": label, "tokens": tokens, "cached": cached, "ok": ok}
 
 
-def build_docx_bytes(report_text, images=None, filename_hint="output_incident_report.docx") -> BytesIO:
+def summarise_fleet(incidents: list, api_key: str, model: str, batch_size: int = FLEET_BATCH_SIZE,
+                    concurrency: int = FLEET_CONCURRENCY, progress=None) -> dict:
     """
-    Render the sectioned report text into a styled .docx and return as BytesIO.
-    Also optionally append uploaded images as an APPENDIX section.
+    Digest every incident, then merge digests batch_size at a time, level by
+    level, until one remains. Calls per level run concurrently; the number of
+    calls is about n * (1 + 1 / (batch_size - 1)), i.e. linear in incidents.
+    progress: optional callable(done, total), called on the calling thread.
     """
-    if images is None:
-        images = []
+    if progress is None:
+        progress = lambda done, total: None
+    start = time.perf_counter()
+    digests, calls = [], []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fleet") as pool:
+        for i, d in enumerate(pool.map(lambda inc: digest_incident(inc, api_key, model), incidents), 1):
+            digests.append(d)
+            progress(i, len(incidents))
+        calls.extend(digests)
+        level, levels = digests, 0
+        while len(level) > 1:
+            batches = [level[i:i + batch_size] for i in range(0, len(level), batch_size)]
+            level = list(pool.map(lambda batch: merge_digests(batch, api_key, model), batches))
+            calls.extend(level)
+            levels += 1
+    return {
+        "summary": level[0] if level else None,
+        "digests": digests,
+        "merge_levels": levels,
+        "calls": sum(1 for c in calls if not c["cached"]),
+        "cached_calls": sum(1 for c in calls if c["cached"]),
+        "failed_calls": sum(1 for c in calls if not c["ok"]),
+        "est_tokens": sum(c["tokens"] for c in calls),
+        "elapsed_s": round(time.perf_counter() - start, 1),
+    }
 
-    doc = Document()
-    ensure_styles(doc)
-    data = split_report_into_structures(report_text)
 
-    # HEADER
-    for block in data["header"]:
-        lines = block.split("\n")
-        for j, line in enumerate(lines):
-            if j == 0:
-                p = doc.add_paragraph(style="TitleStyle")
-                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                run = p.add_run(line.strip())
-                run.bold = True
-            else:
-                p = doc.add_paragraph(style="BodyText")
-                p.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                p.add_run(line.strip())
-    doc.add_paragraph(" ", style="BodyText")
-
-    # INCIDENT SUMMARY
-    if data["incident_summary"]:
-        doc.add_paragraph("INCIDENT SUMMARY", style="SectionHeader")
-        for block in data["incident_summary"]:
-            lines = block.split("\n")
-            if lines[0].strip().upper() == "INCIDENT SUMMARY":
-                lines = lines[1:]
-            for bl in lines:
-                if bl.strip():
-                    p = doc.add_paragraph(style="BodyText")
-                    p.add_run(bl.strip())
-
-    # VOLUME / DEPTH SUMMARY
-    if data["volume_table"]:
-        doc.add_paragraph("VOLUME / DEPTH SUMMARY", style="SectionHeader")
-        for block in data["volume_table"]:
-            lines = block.split("\n")
-            if lines[0].strip().upper() == "VOLUME / DEPTH SUMMARY":
-                lines = lines[1:]
-            for bl in lines:
-                if bl.strip():
-                    p = doc.add_paragraph(style="MonoBlock")
-                    p.add_run(bl.rstrip())
-
-    # INCIDENT REVIEW
-    if data["incident_review"]:
-        doc.add_paragraph("INCIDENT REVIEW", style="SectionHeader")
-        for block in data["incident_review"]:
-            lines = block.split("\n")
-            if lines[0].strip().upper() == "INCIDENT REVIEW":
-                lines = lines[1:]
-            for bl in lines:
-                if bl.strip():
-                    p = doc.add_paragraph(style="BodyText")
-                    p.add_run(bl.strip())
-
-    # POTENTIAL ROOT CAUSES
-    if data["root_causes"]:
-        doc.add_paragraph("POTENTIAL ROOT CAUSES", style="SectionHeader")
-        for cause in data["root_causes"]:
-            p = doc.add_paragraph(style="SubHeader")
-            p.add_run(cause["title"])
-            for bl in cause["body_lines"]:
-                if bl.strip():
-                    body_p = doc.add_paragraph(style="BodyText")
-                    body_p.add_run(bl.strip())
-
-    # CONCLUSION
-    if data["conclusion"]:
-        doc.add_paragraph("CONCLUSION", style="SectionHeader")
-        for block in data["conclusion"]:
-            lines = block.split("\n")
-            if lines[0].strip().upper() == "CONCLUSION":
-                lines = lines[1:]
-            for bl in lines:
-                text = bl.strip()
-                if not text:
-                    continue
-                if text.upper() == "DRILLOUT DE-BRIEF":
-                    p = doc.add_paragraph(style="SubHeader")
-                    p.add_run("DRILLOUT DE-BRIEF")
-                else:
-                    p = doc.add_paragraph(style="BodyText")
-                    p.add_run(text)
+def build_fleet_docx(fleet: dict, incidents: list, title: str = "FLEET INCIDENT SUMMARY") -> BytesIO:
+    """
+    Combined Word report: overall digest and recurring findings, root-cause
+    and compressibility frequency tables, then one row per incident.
+    """
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    doc = Document(BytesIO(shared_resource("docx_template", _build_docx_template)))
+
+    def table(headers, rows):
+        t = doc.add_table(rows=1, cols=len(headers), style="Table Grid")
+        for cell, text in zip(t.rows[0].cells, headers):
+            cell.text = text
+            cell.paragraphs[0].runs[0].bold = True
+        for row in rows:
+            for cell, text in zip(t.add_row().cells, row):
+                cell.text = str(text)
+
+    p = doc.add_paragraph(style="TitleStyle")
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    p.add_run(title).bold = True
+    dates = [str(inc["user_data"].get("date_of_report") or "") for inc in incidents]
+    doc.add_paragraph(
+        f"{len(incidents)} incidents" + (f", {min(dates)} to {max(dates)}" if dates else "")
+        + f" – generated {datetime.now().strftime('%Y-%m-%d')}",
+        style="BodyText",
+    )
 
-    # APPENDIX – IMAGES
-    if images:
-        doc.add_page_break()
-        doc.add_paragraph("APPENDIX – JOB IMAGES", style="SectionHeader")
-        for idx, img in enumerate(images, start=1):
-            caption = img.get("filename", f"Image {idx}")
-            # caption
-            cap_p = doc.add_paragraph(style="BodyText")
-            cap_p.add_run(caption)
-            # picture
-            raw = base64.b64decode(img["b64"])
-            run = doc.add_paragraph().add_run()
-            run.add_picture(BytesIO(raw), width=Inches(5))
+    summary = fleet.get("summary") or {}
+    doc.add_paragraph("OVERALL SUMMARY", style="SectionHeader")
+    for para in str(summary.get("digest", "")).split("\n"):
+        if para.strip():
+            doc.add_paragraph(para.strip(), style="BodyText")
+    if summary.get("findings"):
+        doc.add_paragraph("RECURRING FINDINGS", style="SectionHeader")
+        for finding in summary["findings"]:
+            doc.add_paragraph(f"• {finding}", style="BodyText")
+
+    n = max(len(incidents), 1)
+    causes = defaultdict(int)
+    outcomes = defaultdict(int)
+    for inc in incidents:
+        for block in dict.fromkeys(inc["ai_result"].get("root_cause_blocks") or []):
+            causes[block] += 1
+        outcomes[inc["ai_result"].get("compressibility_outcome") or "unknown"] += 1
+    doc.add_paragraph("ROOT CAUSE FREQUENCY", style="SectionHeader")
+    table(
+        ["Root cause module", "Incidents", "Share"],
+        [(k.replace("_", " "), v, f"{v / n:.0%}") for k, v in sorted(causes.items(), key=lambda kv: -kv[1])],
+    )
+    doc.add_paragraph("COMPRESSIBILITY OUTCOMES", style="SectionHeader")
+    table(
+        ["Outcome", "Incidents", "Share"],
+        [(k.replace("_", " "), v, f"{v / n:.0%}") for k, v in sorted(outcomes.items(), key=lambda kv: -kv[1])],
+    )
+
+    doc.add_page_break()
+    doc.add_paragraph("INCIDENTS", style="SectionHeader")
+    table(
+        ["CIR", "Date", "Rig", "Customer", "Root causes", "Digest"],
+        [
+            (
+                inc["user_data"].get("cir_number"), inc["user_data"].get("date_of_report"),
+                inc["user_data"].get("rig"), inc["user_data"].get("customer"),
+                ", ".join(inc["ai_result"].get("root_cause_blocks") or []).replace("_", " "),
+                digest["digest"],
+            )
+            for inc, digest in zip(incidents, fleet["digests"])
+        ],
+    )
 
     bio = BytesIO()
     doc.save(bio)
     bio.seek(0)
     return bio
 
+
 def parse_float_or_none(text: str):
     """
     Helper for manual input mode.
@@ -975,16 +5298,738 @@ def parse_float_or_none(text: str):
         return text
 
 
+# ============================================================
+# INCIDENT SCHEMA (drives the manual form, parsing and facts)
+# ============================================================
+
+# (section id, heading, number of columns)
+INCIDENT_FORM_SECTIONS = [
+    ("header", "Header / identity", 3),
+    ("string", "String description & accessories", 1),
+    ("geometry", "Pre-cement / well geometry", 3),
+    ("cement", "Cement job", 4),
+    ("pressures", "Pressures / flowback", 3),
+    ("volume", "Volume / depth summary", 3),
+    ("fluids", "Fluids / hydrostatics (optional; once any is entered, blanks use typical values)", 4),
+    ("post_job", "Post-job / drillout", 3),
+    ("mismatch", "Optional mismatch info (leave blank if not suspected)", 2),
+]
+# Sections whose blank fields are left out of user_data rather than stored as None.
+OPTIONAL_FORM_SECTIONS = {"fluids"}
+
+# key: user_data path ("volume_table.well_td_m" is nested)
+# type: text | textarea | float | list (comma-separated) | range (kept as typed,
+#       numeric or "lo-hi" with optional unit; parsed by IncidentFrame)
+# wide: render full width below the section's columns
+# same_as: no widget, copied from another field
+INCIDENT_SCHEMA = [
+    {"key": "cir_number", "label": "CIR Number", "type": "text", "default": "CIR-25-XX", "section": "header"},
+    {"key": "date_of_report", "label": "Date of Report", "unit": "YYYY-MM-DD", "type": "text",
+     "default": lambda: datetime.today().strftime("%Y-%m-%d"), "section": "header"},
+    {"key": "customer", "label": "Customer", "type": "text", "default": "", "section": "header"},
+    {"key": "revision", "label": "Revision #", "type": "text", "default": "0", "section": "header"},
+    {"key": "author", "label": "Author", "type": "text", "default": "Your Name, P.Eng", "section": "header"},
+    {"key": "rig", "label": "Rig", "type": "text", "default": "", "section": "header"},
+    {"key": "surface_location", "label": "Surface Location", "type": "text", "default": "",
+     "section": "header", "wide": True},
+    {"key": "uwi", "label": "UWI", "type": "text", "default": "", "section": "header", "wide": True},
+    {"key": "title_line", "label": "Title Line (short incident title)", "type": "text",
+     "default": "Citadel No Bump & Pressure Test", "section": "header", "wide": True},
+
+    {"key": "string_desc", "label": "Casing String Description", "type": "text",
+     "default": '4-1/2" 22.47kg/m L80 LTC x 5-1/2" 34.23kg/m L80 LTC long string production casing',
+     "section": "string"},
+    {"key": "accessories", "label": "Accessories (comma-separated)", "type": "list",
+     "default": "15K Citadel SV Float Shoe, 15K Citadel SV Float Collar, "
+                "Citadel Latch Cement Plug, 2 x NCS Toe Ports, 62 x NCS Frac Sleeves, NCS Airlock",
+     "section": "string"},
+
+    {"key": "hole_size_mm", "label": "Hole size", "unit": "mm", "type": "float", "default": "171",
+     "section": "geometry"},
+    {"key": "td_mmd", "label": "TD", "unit": "mMD", "type": "float", "default": "5283.0", "section": "geometry"},
+    {"key": "set_depth_mmd", "label": "Casing set depth / landed depth", "unit": "mMD", "type": "float",
+     "default": "5281.19", "section": "geometry"},
+    {"key": "pre_cement_notes", "label": "Pre-cement notes (SPP erratic, inflow/no inflow, debris/glass, etc.)",
+     "type": "textarea", "section": "geometry", "wide": True,
+     "default": "No report of inflow prior to cement. Standpipe pressure became erratic during cleanup."},
+    {"key": "circulated_volume_m3", "label": "Cleanup circulation volume before cement", "unit": "m³",
+     "type": "float", "default": "127.61", "section": "geometry", "wide": True},
+
+    {"key": "cement_lead_m3", "label": "Cement lead volume", "unit": "m³", "type": "float", "default": "82.46",
+     "section": "cement"},
+    {"key": "cement_tail_m3", "label": "Cement tail volume", "unit": "m³", "note": "blank if none",
+     "type": "float", "default": "", "section": "cement"},
+    {"key": "displacement_pumped_m3", "label": "Displacement pumped", "unit": "m³", "type": "float",
+     "default": "45.6", "section": "cement"},
+    {"key": "pump_rate_m3_per_min", "label": "Pump rate", "unit": "m³/min", "type": "float", "default": "1.0",
+     "section": "cement"},
+
+    {"key": "fcp_mpa", "label": "FCP during displacement", "unit": "MPa", "type": "float", "default": "18.54",
+     "section": "pressures"},
+    {"key": "bump_pressure_mpa", "label": "Bump pressure reached", "unit": "MPa", "type": "float",
+     "default": "22.46", "section": "pressures"},
+    {"key": "bledoff_to_mpa", "label": "Pressure bled down / stabilized at", "unit": "MPa", "type": "float",
+     "default": "13.56", "section": "pressures"},
+    {"key": "flowback_volume", "label": "Flowback volume / behavior", "type": "text",
+     "default": "≈1.0 m³ and still flowing", "section": "pressures", "wide": True},
+
+    {"key": "volume_table.well_td_m", "label": "Well TD", "unit": "m", "type": "float", "default": "5283",
+     "section": "volume"},
+    {"key": "volume_table.well_tvd_m", "label": "Well TVD", "unit": "m", "type": "float", "default": "1624.8",
+     "section": "volume"},
+    {"key": "volume_table.airlock_depth_m", "label": "Airlock / CBS depth", "unit": "m", "type": "float",
+     "default": "2558.61", "section": "volume"},
+    {"key": "volume_table.shoe_depth_m", "label": "Shoe depth", "unit": "m", "type": "float",
+     "default": "5280.72", "section": "volume"},
+    {"key": "volume_table.float_collar_depth_m", "label": "Float collar top depth", "unit": "m",
+     "type": "float", "default": "5267.62", "section": "volume"},
+    {"key": "volume_table.crossover_depth_m", "label": "Crossover depth", "unit": "m", "type": "float",
+     "default": "1682.08", "section": "volume"},
+    {"key": "volume_table.casing_vol_nominal_m3", "label": "Casing vol nominal", "unit": "m³", "type": "float",
+     "default": "45.2", "section": "volume"},
+    {"key": "volume_table.casing_vol_min_m3", "label": "Casing vol min", "unit": "m³", "type": "float",
+     "default": "43.5", "section": "volume"},
+    {"key": "volume_table.casing_vol_max_m3", "label": "Casing vol max", "unit": "m³", "type": "float",
+     "default": "47.1", "section": "volume"},
+    {"key": "volume_table.volume_to_airlock_m3", "label": "Volume to Airlock/CBS", "unit": "m³",
+     "type": "float", "default": "25.1", "section": "volume"},
+    {"key": "volume_table.buoyant_volume_nom_m3", "label": "Buoyant volume nominal", "unit": "m³",
+     "type": "float", "default": "20.1", "section": "volume"},
+    {"key": "volume_table.excess_to_surface_m3", "label": "Excess cement to surface", "unit": "m³",
+     "note": "blank if n/a", "type": "float", "default": "", "section": "volume"},
+    {"key": "volume_table.displacement_pumped_m3", "same_as": "displacement_pumped_m3", "section": "volume"},
+
+    {"key": "fluids.displacement_density_kg_m3", "label": "Displacement fluid density", "unit": "kg/m³",
+     "type": "float", "default": "", "section": "fluids"},
+    {"key": "fluids.annulus_density_kg_m3", "label": "Annulus mud / spacer density", "unit": "kg/m³",
+     "type": "float", "default": "", "section": "fluids"},
+    {"key": "fluids.lead_density_kg_m3", "label": "Lead cement density", "unit": "kg/m³", "type": "float",
+     "default": "", "section": "fluids"},
+    {"key": "fluids.tail_density_kg_m3", "label": "Tail cement density", "unit": "kg/m³", "type": "float",
+     "default": "", "section": "fluids"},
+    {"key": "fluids.buoyant_section_density_kg_m3", "label": "Fluid below airlock", "unit": "kg/m³",
+     "note": "blank if displacement fluid", "type": "float", "default": "", "section": "fluids"},
+    {"key": "fluids.cement_top_m", "label": "Top of cement", "unit": "mMD", "note": "blank = from volumes",
+     "type": "float", "default": "", "section": "fluids"},
+    {"key": "fluids.tail_top_m", "label": "Top of tail", "unit": "mMD", "note": "blank = from volumes",
+     "type": "float", "default": "", "section": "fluids"},
+    {"key": "fluids.casing_od_mm", "label": "Casing OD", "unit": "mm", "note": "blank = from string",
+     "type": "float", "default": "", "section": "fluids"},
+
+    {"key": "post_job.retest_pressure_mpa", "label": "Retest / rig pump pressure seen", "unit": "MPa",
+     "type": "range", "default": "18-20", "section": "post_job"},
+    {"key": "post_job.bridge_plug_hold_mpa", "label": "Bridge plug / packer held MPa", "type": "range",
+     "default": "21", "section": "post_job"},
+    {"key": "post_job.bridge_plug_hold_min", "label": "Bridge plug / packer hold time", "unit": "min",
+     "type": "range", "default": "11", "section": "post_job"},
+    {"key": "post_job.tag_depth_m", "label": "Tag depth after job", "unit": "mMD", "type": "range",
+     "default": "N/A", "section": "post_job"},
+    {"key": "post_job.squeeze_summary", "label": "Squeeze summary / remedial volumes", "type": "text",
+     "default": "N/A", "section": "post_job"},
+
+    {"key": "mismatch_receptacle_receptacle_id_in", "label": "Float collar receptacle ID", "unit": "inches",
+     "type": "range", "default": "", "section": "mismatch"},
+    {"key": "mismatch_receptacle_plug_nose_id_in", "label": "Plug nose ID", "unit": "inches", "type": "range",
+     "default": "", "section": "mismatch"},
+]
+
+# Derived / attached data that is summarised separately in the facts blob.
+FACTS_SKIP_KEYS = {
+    "volume_table", "post_job", "edr", "edr_events", "bleedoff_fit", "uncertainty", "pressure", "survey",
+}
+
+
+def schema_label(field: dict) -> str:
+    label = field["label"]
+    if field.get("unit"):
+        label += f" ({field['unit']})"
+    if field.get("note"):
+        label += f" [{field['note']}]"
+    return label
+
+
+def schema_default(field: dict) -> str:
+    default = field.get("default", "")
+    return default() if callable(default) else default
+
+
+def parse_schema_value(field: dict, raw):
+    if field["type"] == "float":
+        return parse_float_or_none(raw)
+    if field["type"] == "list":
+        return [a.strip() for a in str(raw or "").split(",") if a.strip()]
+    return raw
+
+
+def _get_path(data: dict, path: str, default=None):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return default
+        data = data[part]
+    return data
+
+
+def _set_path(data: dict, path: str, value):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        data = data.setdefault(part, {})
+    data[leaf] = value
+
+
+def build_user_data(raw_values: dict) -> dict:
+    """
+    Assemble user_data (same shape as the mock cases) from raw form strings
+    keyed by schema path. Missing keys fall back to the schema default;
+    blank fields in OPTIONAL_FORM_SECTIONS are left out.
+    """
+    user_data = {}
+    for field in INCIDENT_SCHEMA:
+        if "same_as" in field:
+            continue
+        raw = raw_values.get(field["key"], schema_default(field))
+        if field["section"] in OPTIONAL_FORM_SECTIONS and str(raw if raw is not None else "").strip() == "":
+            continue
+        _set_path(user_data, field["key"], parse_schema_value(field, raw))
+    for field in INCIDENT_SCHEMA:
+        if "same_as" in field:
+            _set_path(user_data, field["key"], _get_path(user_data, field["same_as"]))
+    return user_data
+
+
+def incident_facts_lines(user_data: dict) -> list:
+    """
+    "- key: value" lines for the Grok facts blob: schema fields present in
+    user_data first (nested ones as dotted keys), then any extra keys
+    (top-level, or nested under a schema group), then EDR summaries.
+    """
+    lines = []
+    schema_keys = {field["key"] for field in INCIDENT_SCHEMA}
+    schema_roots = {key.split(".")[0] for key in schema_keys}
+    for field in INCIDENT_SCHEMA:
+        value = _get_path(user_data, field["key"], _ABSENT)
+        if value is not _ABSENT:
+            lines.append(f"- {field['key']}: {value}")
+    for key, val in user_data.items():
+        if key in schema_roots:
+            if isinstance(val, dict):
+                lines.extend(f"- {key}.{k}: {v}" for k, v in val.items() if f"{key}.{k}" not in schema_keys)
+        elif key not in FACTS_SKIP_KEYS:
+            lines.append(f"- {key}: {val}")
+    if user_data.get("edr"):
+        lines.append(f"- edr_data: {summarize_edr_ref(user_data['edr'])}")
+    for line in summarize_edr_events(user_data.get("edr_events") or {}):
+        lines.append(f"- edr_detected.{line}")
+    for k, v in (user_data.get("bleedoff_fit") or {}).items():
+        lines.append(f"- edr_bleedoff_fit.{k}: {v}")
+    for k, v in (user_data.get("uncertainty") or {}).items():
+        lines.append(f"- monte_carlo.{k}: {v}")
+    survey = user_data.get("survey") or {}
+    if survey.get("md_m"):
+        lines.append(
+            f"- survey: {len(survey['md_m'])} stations to {survey['md_m'][-1]} mMD / {survey['tvd_m'][-1]} mTVD"
+        )
+    for k, v in (user_data.get("pressure") or {}).items():
+        lines.append(f"- hydrostatics.{k}: {v}")
+    return lines
+
+
+def render_template(template: str, user_data: dict, missing: str = "N/A") -> str:
+    """
+    Fill "{volume_table.well_td_m}"-style placeholders from user_data paths.
+    """
+    out = []
+    for literal, field, _spec, _conv in string.Formatter().parse(template):
+        out.append(literal)
+        if field is not None:
+            out.append(str(_get_path(user_data, field, missing)))
+    return "".join(out)
+
+
+def render_incident_form() -> dict:
+    """
+    Manual entry form generated from INCIDENT_SCHEMA. Wrapped in st.form so
+    typing doesn't rerun the script; user_data updates on "Apply".
+    """
+    import streamlit as st
+
+    raw_values = {}
+    with st.form("manual_entry"):
+        for section, heading, n_cols in INCIDENT_FORM_SECTIONS:
+            st.markdown(f"#### {heading}")
+            fields = [f for f in INCIDENT_SCHEMA if f["section"] == section and "same_as" not in f]
+            columnar = [f for f in fields if not f.get("wide") and f["type"] != "textarea"]
+            cols = st.columns(n_cols)
+            for i, field in enumerate(columnar):
+                with cols[i % n_cols]:
+                    raw_values[field["key"]] = _schema_widget(st, field)
+            for field in fields:
+                if field not in columnar:
+                    raw_values[field["key"]] = _schema_widget(st, field)
+        st.form_submit_button("Apply changes")
+    return build_user_data(raw_values)
+
+
+def _schema_widget(st, field: dict):
+    widget = st.text_area if field["type"] in ("textarea", "list") else st.text_input
+    return widget(schema_label(field), schema_default(field), key=f"form:{field['key']}")
+
+
+# ============================================================
+# INCIDENT FRAME (columnar incidents for batch work)
+# ============================================================
+
+# Schema unit -> {typed unit suffix: factor to the schema unit}
+INCIDENT_UNIT_FACTORS = {
+    "MPa": {"mpa": 1.0, "kpa": 0.001, "psi": 0.00689476, "bar": 0.1},
+    "m": {"m": 1.0, "ft": 0.3048},
+    "mMD": {"m": 1.0, "mmd": 1.0, "ft": 0.3048},
+    "mm": {"mm": 1.0, "in": 25.4},
+    "m³": {"m3": 1.0, "m³": 1.0, "bbl": 0.158987},
+    "m³/min": {"m3/min": 1.0, "m³/min": 1.0, "bpm": 0.158987, "bbl/min": 0.158987},
+    "min": {"min": 1.0, "h": 60.0, "hr": 60.0, "s": 1.0 / 60.0},
+    "inches": {"in": 1.0, "inches": 1.0, '"': 1.0, "mm": 1.0 / 25.4},
+}
+
+_RANGE_RE = re.compile(
+    r"^\s*([-+]?\d*\.?\d+)\s*(?:(?:-|–|to)\s*([-+]?\d*\.?\d+))?\s*([a-zA-Z³0-9/\"]+)?\s*$"
+)
+
+EXTRAS_COLUMN = "_extras"
+# _get_path() default that tells a missing path from a stored None.
+_ABSENT = object()
+
+
+def parse_numeric_range(value, unit=None):
+    """
+    Number, "18-20", "21 MPa" or "3000 psi" -> (lo, hi) in the schema unit.
+    Returns (nan, nan) for None / text such as "N/A".
+    """
+    if value is None:
+        return np.nan, np.nan
+    if isinstance(value, (int, float)):
+        return float(value), float(value)
+    m = _RANGE_RE.match(str(value))
+    if not m:
+        return np.nan, np.nan
+    lo = float(m.group(1))
+    hi = float(m.group(2)) if m.group(2) else lo
+    factor = 1.0
+    if m.group(3):
+        factor = INCIDENT_UNIT_FACTORS.get(unit, {}).get(m.group(3).lower())
+        if factor is None:
+            return np.nan, np.nan
+    return lo * factor, hi * factor
+
+
+class IncidentFrame:
+    """
+    Many incidents as one pandas DataFrame, one row per incident, laid out
+    from INCIDENT_SCHEMA:
+
+    - float / range fields -> "<key>:lo" and "<key>:hi" float64 columns in the
+      schema unit, plus a categorical "<key>:raw" holding the typed string
+      when the value wasn't a plain number (so "18-20" round-trips)
+    - text fields -> categorical columns (rig, customer, author repeat a lot)
+    - accessories -> one newline-joined categorical column
+    - anything outside the schema (EDR refs, fits...) -> one object column
+
+    to_user_data() gives back the dict shape the rest of the app uses.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    def __len__(self):
+        return len(self.df)
+
+    @staticmethod
+    def numeric_fields():
+        return [f for f in INCIDENT_SCHEMA if _is_numeric_field(f)]
+
+    @classmethod
+    def from_user_data(cls, incidents) -> "IncidentFrame":
+        import pandas as pd
+
+        incidents = list(incidents)
+        columns = {}
+        for field in INCIDENT_SCHEMA:
+            key = field["key"]
+            values = [_get_path(ud, key) for ud in incidents]
+            if _is_numeric_field(field):
+                unit = _schema_field(field.get("same_as", key)).get("unit")
+                bounds = np.array([parse_numeric_range(v, unit) for v in values], dtype=np.float64)
+                bounds = bounds.reshape(len(values), 2)
+                columns[f"{key}:lo"] = bounds[:, 0]
+                columns[f"{key}:hi"] = bounds[:, 1]
+                columns[f"{key}:raw"] = pd.Categorical(
+                    [v if isinstance(v, str) else None for v in values]
+                )
+            elif field["type"] == "list":
+                columns[key] = pd.Categorical(["\n".join(v or []) for v in values])
+            else:
+                columns[key] = pd.Categorical(values)
+        schema_roots = {f["key"].split(".")[0] for f in INCIDENT_SCHEMA}
+        nested_roots = sorted({f["key"].split(".")[0] for f in INCIDENT_SCHEMA if "." in f["key"]})
+        extras = []
+        for ud in incidents:
+            extra = {k: v for k, v in ud.items() if k not in schema_roots}
+            for root in nested_roots:
+                nested = {
+                    k: v for k, v in (ud.get(root) or {}).items()
+                    if _schema_field(f"{root}.{k}") is None
+                }
+                if nested:
+                    extra.setdefault("_nested", {})[root] = nested
+            # Schema paths the incident never had (e.g. the optional "fluids"
+            # group, or the blank fields within it).
+            absent = [root for root in nested_roots if root not in ud]
+            absent += [
+                f["key"] for f in INCIDENT_SCHEMA
+                if f["key"].split(".")[0] not in absent and _get_path(ud, f["key"], _ABSENT) is _ABSENT
+            ]
+            if absent:
+                extra["_absent"] = absent
+            extras.append(extra or None)
+        columns[EXTRAS_COLUMN] = pd.Series(extras, dtype=object)
+        return cls(pd.DataFrame(columns))
+
+    def to_user_data(self, i: int) -> dict:
+        """
+        Row i (positional) back to a user_data dict.
+        """
+        row = self.df.iloc[i]
+        user_data = {}
+        for field in INCIDENT_SCHEMA:
+            key = field["key"]
+            if _is_numeric_field(field):
+                raw = row[f"{key}:raw"]
+                lo = row[f"{key}:lo"]
+                value = raw if isinstance(raw, str) else (None if np.isnan(lo) else float(lo))
+            elif field["type"] == "list":
+                value = [a for a in str(row[key]).split("\n") if a]
+            else:
+                value = row[key]
+                value = None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+            _set_path(user_data, key, value)
+        extras = dict(row[EXTRAS_COLUMN] or {})
+        for root, nested in extras.pop("_nested", {}).items():
+            user_data[root].update(nested)
+        for path in extras.pop("_absent", []):
+            root, _, leaf = path.partition(".")
+            if leaf:
+                user_data[root].pop(leaf, None)
+            else:
+                user_data.pop(root, None)
+        user_data.update(extras)
+        return user_data
+
+    def iter_user_data(self):
+        for i in range(len(self.df)):
+            yield self.to_user_data(i)
+
+    def lo(self, key: str):
+        return self.df[f"{key}:lo"].to_numpy()
+
+    def hi(self, key: str):
+        return self.df[f"{key}:hi"].to_numpy()
+
+    def text(self, key: str):
+        """
+        A field as the strings str(user_data value) would give, vectorised.
+        """
+        import pandas as pd
+
+        if f"{key}:lo" not in self.df:
+            col = self.df[key].astype(object)
+            return col.where(col.notna(), "None").astype(str)
+        lo = self.df[f"{key}:lo"]
+        raw = self.df[f"{key}:raw"].astype(object)
+        num = pd.Series(lo.to_numpy().astype(str), index=lo.index).where(lo.notna(), "None")
+        return raw.where(raw.notna(), num).astype(str)
+
+    def render(self, template: str):
+        """
+        Vectorised render_template(): one string per incident.
+        """
+        import pandas as pd
+
+        out = pd.Series([""] * len(self.df), index=self.df.index, dtype=object)
+        for literal, field, _spec, _conv in string.Formatter().parse(template):
+            out = out + literal
+            if field is not None:
+                out = out + self.text(field)
+        return out
+
+    def validate(self):
+        """
+        Field-level checks over all incidents at once. Returns a DataFrame of
+        (incident, field, message).
+        """
+        import pandas as pd
+
+        issues = []
+        for field in self.numeric_fields():
+            if "same_as" in field:
+                continue
+            key = field["key"]
+            lo, hi = self.lo(key), self.hi(key)
+            raw = self.df[f"{key}:raw"]
+            checks = [
+                (raw.notna().to_numpy() & np.isnan(lo) & (field["type"] == "float"),
+                 "not a number"),
+                (lo > hi, "range low end above high end"),
+                (lo < 0, "negative value"),
+            ]
+            for mask, message in checks:
+                for i in np.flatnonzero(mask):
+                    issues.append({"incident": int(i), "field": key, "message": message})
+        return pd.DataFrame(issues, columns=["incident", "field", "message"])
+
+    def classify_displacement(self):
+        """
+        Displacement pumped vs calculated casing volume: under / within / over /
+        unknown per incident.
+        """
+        pumped = self.lo("displacement_pumped_m3")
+        vmin = self.lo("volume_table.casing_vol_min_m3")
+        vmax = self.lo("volume_table.casing_vol_max_m3")
+        known = ~(np.isnan(pumped) | np.isnan(vmin) | np.isnan(vmax))
+        return np.select(
+            [~known, pumped < vmin, pumped > vmax],
+            ["unknown", "under", "over"],
+            default="within",
+        )
+
+    def memory_bytes(self) -> int:
+        return int(self.df.memory_usage(deep=True).sum())
+
+
+def _is_numeric_field(field: dict) -> bool:
+    return field.get("type") in ("float", "range") or "same_as" in field
+
+
+def _schema_field(key: str):
+    for field in INCIDENT_SCHEMA:
+        if field["key"] == key:
+            return field
+    return None
+
+
+# ============================================================
+# PRE-FLIGHT CHECKS (catch inconsistent numbers before calling Grok)
+# ============================================================
+
+PREFLIGHT_SEVERITIES = ("block", "warn")
+
+# Displacement this far outside the casing min/max volume blocks generation;
+# anything outside min/max only warns.
+PREFLIGHT_DISPLACEMENT_BLOCK_FRACTION = 0.25
+
+# check(v) gets v(key) -> float64 array (range low end, schema units, NaN when
+# blank) and returns a boolean array; True means the rule fires. Comparisons
+# with NaN are False, so blank fields never fire. "supersedes" silences a
+# milder rule wherever this one fires.
+PREFLIGHT_RULES = [
+    {
+        "id": "tvd_above_td", "severity": "block",
+        "check": lambda v: v("volume_table.well_tvd_m") > v("volume_table.well_td_m"),
+        "message": "Well TVD ({volume_table.well_tvd_m} m) is greater than well TD ({volume_table.well_td_m} m).",
+    },
+    {
+        "id": "shoe_above_collar", "severity": "block",
+        "check": lambda v: v("volume_table.shoe_depth_m") < v("volume_table.float_collar_depth_m"),
+        "message": "Shoe depth ({volume_table.shoe_depth_m} m) is shallower than the float collar "
+                   "({volume_table.float_collar_depth_m} m).",
+    },
+    {
+        "id": "shoe_below_td", "severity": "block",
+        "check": lambda v: v("volume_table.shoe_depth_m") > v("volume_table.well_td_m"),
+        "message": "Shoe depth ({volume_table.shoe_depth_m} m) is below well TD ({volume_table.well_td_m} m).",
+    },
+    {
+        "id": "set_depth_below_td", "severity": "block",
+        "check": lambda v: v("set_depth_mmd") > v("td_mmd"),
+        "message": "Casing set depth ({set_depth_mmd} mMD) is below TD ({td_mmd} mMD).",
+    },
+    {
+        "id": "bledoff_above_bump", "severity": "block",
+        "check": lambda v: v("bledoff_to_mpa") > v("bump_pressure_mpa"),
+        "message": "Bled-off pressure ({bledoff_to_mpa} MPa) is above the bump pressure ({bump_pressure_mpa} MPa).",
+    },
+    {
+        "id": "casing_volume_order", "severity": "block",
+        "check": lambda v: (v("volume_table.casing_vol_min_m3") > v("volume_table.casing_vol_nominal_m3"))
+        | (v("volume_table.casing_vol_nominal_m3") > v("volume_table.casing_vol_max_m3")),
+        "message": "Casing volumes are out of order (min {volume_table.casing_vol_min_m3}, nominal "
+                   "{volume_table.casing_vol_nominal_m3}, max {volume_table.casing_vol_max_m3} m³).",
+    },
+    {
+        "id": "displacement_far_outside_casing_volume", "severity": "block",
+        "supersedes": "displacement_outside_casing_volume",
+        "check": lambda v: (
+            v("displacement_pumped_m3")
+            < v("volume_table.casing_vol_min_m3") * (1 - PREFLIGHT_DISPLACEMENT_BLOCK_FRACTION)
+        ) | (
+            v("displacement_pumped_m3")
+            > v("volume_table.casing_vol_max_m3") * (1 + PREFLIGHT_DISPLACEMENT_BLOCK_FRACTION)
+        ),
+        "message": "Displacement pumped ({displacement_pumped_m3} m³) is far outside the casing volume "
+                   "range ({volume_table.casing_vol_min_m3}–{volume_table.casing_vol_max_m3} m³).",
+    },
+    {
+        "id": "displacement_outside_casing_volume", "severity": "warn",
+        "check": lambda v: (v("displacement_pumped_m3") < v("volume_table.casing_vol_min_m3"))
+        | (v("displacement_pumped_m3") > v("volume_table.casing_vol_max_m3")),
+        "message": "Displacement pumped ({displacement_pumped_m3} m³) is outside the casing volume range "
+                   "({volume_table.casing_vol_min_m3}–{volume_table.casing_vol_max_m3} m³).",
+    },
+    {
+        "id": "bump_below_fcp", "severity": "warn",
+        "check": lambda v: v("bump_pressure_mpa") < v("fcp_mpa"),
+        "message": "Bump pressure ({bump_pressure_mpa} MPa) is below FCP ({fcp_mpa} MPa) – confirm the plug bumped.",
+    },
+    {
+        "id": "airlock_below_collar", "severity": "warn",
+        "check": lambda v: v("volume_table.airlock_depth_m") > v("volume_table.float_collar_depth_m"),
+        "message": "Airlock / CBS depth ({volume_table.airlock_depth_m} m) is below the float collar "
+                   "({volume_table.float_collar_depth_m} m).",
+    },
+    {
+        "id": "airlock_volume_above_casing", "severity": "warn",
+        "check": lambda v: v("volume_table.volume_to_airlock_m3") > v("volume_table.casing_vol_max_m3"),
+        "message": "Volume to Airlock / CBS ({volume_table.volume_to_airlock_m3} m³) exceeds the casing max "
+                   "volume ({volume_table.casing_vol_max_m3} m³).",
+    },
+]
+
+
+def _run_preflight_rules(v) -> list:
+    """
+    Evaluate every rule; returns [(rule, fired boolean array)].
+    """
+    with np.errstate(invalid="ignore"):
+        results = {rule["id"]: np.asarray(rule["check"](v), dtype=bool) for rule in PREFLIGHT_RULES}
+    for rule in PREFLIGHT_RULES:
+        if rule.get("supersedes"):
+            results[rule["supersedes"]] &= ~results[rule["id"]]
+    return [(rule, results[rule["id"]]) for rule in PREFLIGHT_RULES]
+
+
+def _preflight_field_issues(user_data: dict) -> list:
+    issues = []
+    for field in INCIDENT_SCHEMA:
+        if field.get("type") != "float":
+            continue
+        value = _get_path(user_data, field["key"])
+        if isinstance(value, str):
+            issues.append({
+                "id": "not_a_number", "severity": "warn", "field": field["key"],
+                "message": f"{schema_label(field)}: '{value}' is not a number.",
+            })
+        elif isinstance(value, (int, float)) and value < 0:
+            issues.append({
+                "id": "negative_value", "severity": "block", "field": field["key"],
+                "message": f"{schema_label(field)} is negative ({value}).",
+            })
+    return issues
+
+
+def preflight_check(user_data: dict) -> list:
+    """
+    Consistency checks for one incident, cheap enough to run on every rerun.
+    Returns [{"id", "severity", "message"}], blocking issues first.
+    """
+    cache = {}
+
+    def v(key):
+        if key not in cache:
+            unit = _schema_field(key).get("unit")
+            cache[key] = np.array([parse_numeric_range(_get_path(user_data, key), unit)[0]])
+        return cache[key]
+
+    issues = _preflight_field_issues(user_data)
+    for rule, fired in _run_preflight_rules(v):
+        if fired[0]:
+            issues.append({
+                "id": rule["id"], "severity": rule["severity"],
+                "message": render_template(rule["message"], user_data),
+            })
+    return sorted(issues, key=lambda i: PREFLIGHT_SEVERITIES.index(i["severity"]))
+
+
+def preflight_frame(frame: IncidentFrame):
+    """
+    The same rules over an IncidentFrame at once. Returns a DataFrame of
+    (incident, id, severity, message) for the rows that fire.
+    """
+    import pandas as pd
+
+    issues = []
+    for rule, fired in _run_preflight_rules(frame.lo):
+        for i in np.flatnonzero(fired):
+            issues.append({
+                "incident": int(i), "id": rule["id"], "severity": rule["severity"],
+                "message": render_template(rule["message"], frame.to_user_data(int(i))),
+            })
+    return pd.DataFrame(issues, columns=["incident", "id", "severity", "message"])
+
+
+def preflight_blocking(issues: list) -> list:
+    return [i for i in issues if i["severity"] == "block"]
+
+
+
 def main():
+    import streamlit as st
+
     st.set_page_config(page_title="Incident Report Builder", layout="wide")
 
+    # Keep one registry (prompt, HTTP session, docx template, job queue) for the
+    # whole server process, and warm it up once.
+    use_shared_registry(st.cache_resource(shared_registry)())
+    st.cache_resource(warm_up_shared_resources)()
+
     st.title("Incident Report Builder")
 
+    page = st.sidebar.radio("Page", ["Build report", "Analytics"], horizontal=True)
+
     # Sidebar: config
     st.sidebar.header("Grok Configuration")
     api_key = st.sidebar.text_input("GROK_API_KEY", type="password")
     model = st.sidebar.text_input("Model ID", value=DEFAULT_GROK_MODEL)
 
+    hedge_enabled = st.sidebar.checkbox("Hedge slow Grok requests", value=False)
+    hedge_percentile = None
+    fallback_model = None
+    if hedge_enabled:
+        hedge_percentile = st.sidebar.slider("Hedge after latency percentile", 50, 99, 95)
+        fallback_model = st.sidebar.text_input("Fallback model ID (blank = same model)", "") or None
+        st.sidebar.caption(
+            f"Current hedge delay: {hedge_delay_for_percentile(hedge_percentile):.1f} s"
+        )
+
+    speculate = st.sidebar.checkbox(
+        "Prefetch the AI narrative while I review the snapshot", value=False,
+        help="Starts the Grok call once the inputs have been unchanged for a few seconds; "
+             "a prefetch for inputs you then change is discarded.",
+    )
+
+    with st.sidebar.expander("Performance", expanded=False):
+        st.write("Process memory (MB):", process_memory_mb())
+        st.write("Shared resources:")
+        st.table(shared_registry().stats())
+        st.write("Grok calls:", summarize_grok_metrics())
+        st.write("Grok requests waiting for rate budget:", grok_rate_limiter().queue_length())
+        st.write("Speculative Grok calls:", speculative_grok().stats())
+        st.write("Blob store:", blob_store().stats())
+        if MEMORY_PROFILE_ENABLED:
+            st.write("Report memory by stage (MB):")
+            st.table(summarize_memory_metrics())
+
+    if page == "Analytics":
+        render_analytics_page(api_key, model)
+        return
+
     st.sidebar.markdown("---")
     mode = st.sidebar.selectbox(
         "Incident data source",
@@ -1006,7 +6051,19 @@ def main():
     )
 
     uploaded_files = st.sidebar.file_uploader(
-        "Upload images", type=["png", "jpg", "jpeg", "webp"], accept_multiple_files=True
+        "Upload images", type=IMAGE_UPLOAD_TYPES, accept_multiple_files=True
+    )
+
+    st.sidebar.markdown("---")
+    edr_file = st.sidebar.file_uploader(
+        "Upload Pason EDR export (CSV / ASCII)", type=["csv", "txt", "asc"]
+    )
+    survey_file = st.sidebar.file_uploader(
+        "Upload directional survey (CSV: MD + TVD, or MD + Inc + Azi)", type=["csv", "txt"]
+    )
+    charts_to_grok = st.sidebar.checkbox(
+        "Send compact EDR charts to Grok instead of uploaded screenshots",
+        value=False,
     )
 
     # ===== INCIDENT INPUT AREA =====
@@ -1023,221 +6080,143 @@ def main():
     else:
         # MANUAL ENTRY MODE
         st.subheader("Incident input – Manual entry")
-
-        st.markdown("#### Header / identity")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            cir_number = st.text_input("CIR Number", "CIR-25-XX")
-            revision = st.text_input("Revision #", "0")
-        with col2:
-            date_of_report = st.text_input(
-                "Date of Report (YYYY-MM-DD)",
-                datetime.today().strftime("%Y-%m-%d"),
-            )
-            author = st.text_input("Author", "Your Name, P.Eng")
-        with col3:
-            customer = st.text_input("Customer", "")
-            rig = st.text_input("Rig", "")
-
-        surface_location = st.text_input("Surface Location", "")
-        uwi = st.text_input("UWI", "")
-        title_line = st.text_input("Title Line (short incident title)", "Citadel No Bump & Pressure Test")
-
-        st.markdown("#### String description & accessories")
-        string_desc = st.text_input(
-            "Casing String Description",
-            '4-1/2" 22.47kg/m L80 LTC x 5-1/2" 34.23kg/m L80 LTC long string production casing',
-        )
-        accessories_raw = st.text_area(
-            "Accessories (comma-separated)",
-            "15K Citadel SV Float Shoe, 15K Citadel SV Float Collar, "
-            "Citadel Latch Cement Plug, 2 x NCS Toe Ports, 62 x NCS Frac Sleeves, NCS Airlock",
-        )
-        accessories = [a.strip() for a in accessories_raw.split(",") if a.strip()]
-
-        st.markdown("#### Pre-cement / well geometry")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            hole_size_mm = parse_float_or_none(st.text_input("Hole size (mm)", "171"))
-        with col2:
-            td_mmd = parse_float_or_none(st.text_input("TD (mMD)", "5283.0"))
-        with col3:
-            set_depth_mmd = parse_float_or_none(st.text_input("Casing set depth / landed depth (mMD)", "5281.19"))
-
-        pre_cement_notes = st.text_area(
-            "Pre-cement notes (SPP erratic, inflow/no inflow, debris/glass, etc.)",
-            "No report of inflow prior to cement. Standpipe pressure became erratic during cleanup.",
-        )
-        circulated_volume_m3 = parse_float_or_none(
-            st.text_input("Cleanup circulation volume before cement (m³)", "127.61")
-        )
-
-        st.markdown("#### Cement job")
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            cement_lead_m3 = parse_float_or_none(st.text_input("Cement lead volume (m³)", "82.46"))
-        with col2:
-            cement_tail_m3 = parse_float_or_none(st.text_input("Cement tail volume (m³) [blank if none]", ""))
-        with col3:
-            displacement_pumped_m3 = parse_float_or_none(st.text_input("Displacement pumped (m³)", "45.6"))
-        with col4:
-            pump_rate_m3_per_min = parse_float_or_none(st.text_input("Pump rate (m³/min)", "1.0"))
-
-        st.markdown("#### Pressures / flowback")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            fcp_mpa = parse_float_or_none(st.text_input("FCP during displacement (MPa)", "18.54"))
-        with col2:
-            bump_pressure_mpa = parse_float_or_none(st.text_input("Bump pressure reached (MPa)", "22.46"))
-        with col3:
-            bledoff_to_mpa = parse_float_or_none(st.text_input("Pressure bled down / stabilized at (MPa)", "13.56"))
-
-        flowback_volume = st.text_input(
-            "Flowback volume / behavior",
-            "≈1.0 m³ and still flowing",
-        )
-
-        st.markdown("#### Volume / depth summary")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            vt_well_td_m = parse_float_or_none(st.text_input("Well TD (m)", "5283"))
-            vt_shoe_depth_m = parse_float_or_none(st.text_input("Shoe depth (m)", "5280.72"))
-        with col2:
-            vt_well_tvd_m = parse_float_or_none(st.text_input("Well TVD (m)", "1624.8"))
-            vt_float_collar_depth_m = parse_float_or_none(
-                st.text_input("Float collar top depth (m)", "5267.62")
-            )
-        with col3:
-            vt_airlock_depth_m = parse_float_or_none(st.text_input("Airlock / CBS depth (m)", "2558.61"))
-            vt_crossover_depth_m = parse_float_or_none(st.text_input("Crossover depth (m)", "1682.08"))
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            vt_nom = parse_float_or_none(st.text_input("Casing vol nominal (m³)", "45.2"))
-        with col2:
-            vt_min = parse_float_or_none(st.text_input("Casing vol min (m³)", "43.5"))
-        with col3:
-            vt_max = parse_float_or_none(st.text_input("Casing vol max (m³)", "47.1"))
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            vt_vol_to_airlock = parse_float_or_none(st.text_input("Volume to Airlock/CBS (m³)", "25.1"))
-        with col2:
-            vt_buoyant_nom = parse_float_or_none(st.text_input("Buoyant volume nominal (m³)", "20.1"))
-        with col3:
-            vt_excess_surface = parse_float_or_none(
-                st.text_input("Excess cement to surface (m³) [blank if n/a]", "")
+        user_data = render_incident_form()
+
+    # ===== EDR TIME SERIES =====
+    if edr_file is not None:
+        try:
+            user_data["edr"] = ingest_edr_export(edr_file)
+            st.caption("EDR data: " + summarize_edr_ref(user_data["edr"]))
+        except ValueError as e:
+            st.warning(f"Could not import EDR export: {e}")
+
+    if user_data.get("edr"):
+        try:
+            series = load_edr_series(user_data["edr"])
+            events = detect_cementing_events(series)
+        except Exception as e:
+            st.warning(f"Could not detect events in the EDR data: {e}")
+            events = {}
+        if events:
+            use_detected = st.checkbox(
+                "Use EDR-detected FCP / bump / bled-off / displacement values", value=False
             )
-
-        st.markdown("#### Post-job / drillout")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            post_retest_pressure = st.text_input("Retest / rig pump pressure seen (MPa)", "18-20")
-        with col2:
-            post_bridge_hold_mpa = st.text_input("Bridge plug / packer held MPa", "21")
-        with col3:
-            post_bridge_hold_min = st.text_input("Bridge plug / packer hold time (min)", "11")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            post_tag_depth_m = st.text_input("Tag depth after job (mMD)", "N/A")
-        with col2:
-            post_squeeze_summary = st.text_input("Squeeze summary / remedial volumes", "N/A")
-
-        st.markdown("#### Optional mismatch info (leave blank if not suspected)")
-        col1, col2 = st.columns(2)
-        with col1:
-            mismatch_rec = st.text_input('Float collar receptacle ID (inches)', "")
-        with col2:
-            mismatch_plug = st.text_input('Plug nose ID (inches)', "")
-
-        # Build user_data dict matching the mock structure
-        user_data = {
-            "cir_number": cir_number,
-            "date_of_report": date_of_report,
-            "revision": revision,
-            "customer": customer,
-            "rig": rig,
-            "surface_location": surface_location,
-            "uwi": uwi,
-            "author": author,
-            "title_line": title_line,
-            "string_desc": string_desc,
-            "accessories": accessories,
-            "hole_size_mm": hole_size_mm,
-            "td_mmd": td_mmd,
-            "set_depth_mmd": set_depth_mmd,
-            "pre_cement_notes": pre_cement_notes,
-            "circulated_volume_m3": circulated_volume_m3,
-            "cement_lead_m3": cement_lead_m3,
-            "cement_tail_m3": cement_tail_m3,
-            "displacement_pumped_m3": displacement_pumped_m3,
-            "pump_rate_m3_per_min": pump_rate_m3_per_min,
-            "fcp_mpa": fcp_mpa,
-            "bump_pressure_mpa": bump_pressure_mpa,
-            "bledoff_to_mpa": bledoff_to_mpa,
-            "flowback_volume": flowback_volume,
-            "volume_table": {
-                "well_td_m": vt_well_td_m,
-                "well_tvd_m": vt_well_tvd_m,
-                "shoe_depth_m": vt_shoe_depth_m,
-                "float_collar_depth_m": vt_float_collar_depth_m,
-                "airlock_depth_m": vt_airlock_depth_m,
-                "crossover_depth_m": vt_crossover_depth_m,
-                "casing_vol_nominal_m3": vt_nom,
-                "casing_vol_min_m3": vt_min,
-                "casing_vol_max_m3": vt_max,
-                "volume_to_airlock_m3": vt_vol_to_airlock,
-                "buoyant_volume_nom_m3": vt_buoyant_nom,
-                "displacement_pumped_m3": displacement_pumped_m3,
-                "excess_to_surface_m3": vt_excess_surface,
-            },
-            "post_job": {
-                "retest_pressure_mpa": post_retest_pressure,
-                "bridge_plug_hold_mpa": post_bridge_hold_mpa,
-                "bridge_plug_hold_min": post_bridge_hold_min,
-                "tag_depth_m": post_tag_depth_m,
-                "squeeze_summary": post_squeeze_summary,
-            },
-            "mismatch_receptacle_receptacle_id_in": mismatch_rec,
-            "mismatch_receptacle_plug_nose_id_in": mismatch_plug,
-        }
+            filled = apply_edr_events(user_data, events, overwrite=use_detected)
+            window = extract_bleedoff_window(series, events)
+            fit = fit_bleedoff_decay(*window) if window is not None else None
+            if fit:
+                user_data["bleedoff_fit"] = fit
+            with st.expander("EDR-detected events", expanded=use_detected):
+                st.table([
+                    {"event": k, **ev} for k, ev in events.items() if k != "interruptions"
+                ])
+                if events["interruptions"]:
+                    st.write(f"Pumping interruptions during displacement: {len(events['interruptions'])}")
+                if filled:
+                    st.caption("Pre-filled from EDR: " + ", ".join(filled))
+                if fit:
+                    st.write(describe_bleedoff_fit(fit))
+
+    if survey_file is not None:
+        try:
+            user_data["survey"] = parse_survey(survey_file)
+            st.caption(f"Survey: {len(user_data['survey']['md_m'])} stations from {user_data['survey']['source']}")
+        except ValueError as e:
+            st.warning(f"Could not import survey: {e}")
+
+    # ===== UNCERTAINTY =====
+    mc = run_uncertainty_analysis(user_data)
+    if mc:
+        user_data["uncertainty"] = mc
+        with st.expander("Displacement / flowback uncertainty (Monte Carlo)", expanded=False):
+            st.write(describe_displacement_uncertainty(mc))
+            st.write(describe_flowback_uncertainty(mc))
+
+    pp = pressure_profile(user_data) if has_hydrostatics_inputs(user_data) else None
+    if pp:
+        user_data["pressure"] = pp
+        with st.expander("Hydrostatic / differential pressure", expanded=False):
+            st.write(describe_pressure_profile(pp))
 
     # ===== SNAPSHOT + GENERATION =====
     st.subheader("Incident Snapshot")
     st.json(user_data)
 
+    preflight = preflight_check(user_data)
+    blocking = preflight_blocking(preflight)
+    for issue in preflight:
+        (st.error if issue["severity"] == "block" else st.warning)(issue["message"])
+    override_preflight = False
+    if blocking:
+        override_preflight = st.checkbox("Generate anyway (ignore pre-flight errors)", value=False)
+
     st.markdown("When you're happy, click **Generate Report** to call Grok and build the Word file.")
 
     generate_button = st.button("Generate Report")
 
+    # One queue per server process, shared by every session and kept across reruns.
+    job_queue = shared_resource("job_queue", ReportJobQueue)
+
+    # Speculative prefetch: the Grok call for exactly these inputs starts in
+    # the background once they have been stable for a few seconds.
+    speculation = speculative_grok()
+    owner = st.session_state.setdefault("speculation_owner", os.urandom(8).hex())
+    can_generate = bool(api_key) and (not blocking or override_preflight)
+    images_payload, grok_images, spec_fp = [], None, None
+    if generate_button or (speculate and can_generate):
+        images_payload = encode_uploaded_images(uploaded_files) if uploaded_files else []
+        if charts_to_grok and user_data.get("edr"):
+            grok_images = render_edr_charts(user_data, profile="compact")
+    if speculate and can_generate:
+        spec_images = grok_images if grok_images is not None else images_payload
+        spec_fp = grok_input_fingerprint(user_data, model, spec_images, api_key, fallback_model)
+    if st.session_state.get("speculation_fp") != spec_fp:
+        if st.session_state.get("speculation_fp"):
+            speculation.release(st.session_state["speculation_fp"], owner)
+        st.session_state["speculation_fp"] = spec_fp
+        # Mock cases are stable by definition; edited inputs must settle first.
+        st.session_state["speculation_since"] = time.time() - (
+            0.0 if mode == "Manual entry" or uploaded_files or edr_file else SPECULATION_STABLE_S
+        )
+    if spec_fp:
+        start_args = dict(
+            user_data=user_data, api_key=api_key, model=model, images=spec_images,
+            hedge_percentile=hedge_percentile, fallback_model=fallback_model,
+        )
+        status_args = (spec_fp, owner, st.session_state["speculation_since"], start_args)
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=1)(render_speculation_status)(*status_args)
+        else:
+            render_speculation_status(*status_args)
+
     if generate_button:
         if not api_key:
             st.error("Please enter your GROK_API_KEY in the sidebar.")
             return
+        if blocking and not override_preflight:
+            st.error("Fix the pre-flight errors above (or tick 'Generate anyway') before calling Grok.")
+            return
 
-        with st.spinner("Calling Grok and generating report..."):
-            images_payload = encode_uploaded_images(uploaded_files) if uploaded_files else []
-            ai_result = generate_ai_full_report(
-                user_data, api_key=api_key, model=model, images=images_payload
-            )
-            report_text = build_report_text(user_data, ai_result)
-            docx_bytes = build_docx_bytes(report_text, images=images_payload)
-
-        st.success("Report generated.")
-
-        with st.expander("Show raw AI JSON (root causes & narratives)", expanded=False):
-            st.json(ai_result)
+        prefetched = speculation.claim(spec_fp) if spec_fp else None
+        job_id = job_queue.submit(
+            user_data, api_key=api_key, model=model,
+            images=images_payload, grok_images=grok_images,
+            hedge_percentile=hedge_percentile, fallback_model=fallback_model,
+            skip_preflight=override_preflight, prefetched=prefetched,
+        )
+        st.success(
+            f"Report queued ({job_id})"
+            + (" using the prefetched AI narrative" if prefetched else "")
+            + ". You can keep working or queue more incidents."
+        )
 
-        with st.expander("Show assembled report text (for debugging)", expanded=False):
-            st.text(report_text)
+    st.subheader("Report jobs")
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=2)(render_job_panel)(job_queue)
+    else:
+        st.button("Refresh jobs")
+        render_job_panel(job_queue)
 
-        st.download_button(
-            label="Download Word Report (.docx)",
-            data=docx_bytes,
-            file_name=f"{user_data['cir_number'].replace(' ', '_')}_incident_report.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Keep caches, job state and metrics out of the working tree.
+os.environ.setdefault("INCIDENT_BUILDER_DATA_DIR", tempfile.mkdtemp(prefix="incident_builder_tests_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+import json
+import os
+
+import streamlit_incident_builder as sib
+
+AI_RESULT = {"root_cause_blocks": ["debris"], "compressibility_outcome": "plausible"}
+
+
+def row(ud, job_id):
+    return sib.incident_analytics_row(ud, AI_RESULT, job_id=job_id)
+
+
+def test_revisions_replace_earlier_saves(tmp_path):
+    d = str(tmp_path)
+    ud = sib.get_mock_user_data_case1()
+    sib.update_analytics(row(ud, "j1"), d)
+    ud["fcp_mpa"] = 21.0
+    sib.update_analytics(row(ud, "j2"), d)
+    sib.update_analytics(row(sib.get_mock_user_data_case2(), "j3"), d)
+
+    rollups = sib.load_rollups(d)
+    assert rollups["incidents"] == 2
+    rig = rollups["by"]["rig"][ud["rig"]]
+    assert rig["incidents"] == 1 and rig["metrics"]["fcp_mpa"] == [1, 21.0, 441.0]
+    frame = sib.load_incident_rows_frame(d)
+    assert sorted(frame["job_id"]) == ["j2", "j3"]
+    assert not os.path.exists(tmp_path / "incident_rows.json")
+
+
+def test_rows_frame_reloads_after_a_save(tmp_path):
+    d = str(tmp_path)
+    sib.update_analytics(row(sib.get_mock_user_data_case1(), "j1"), d)
+    first = sib.load_incident_rows_frame(d)
+    assert sib.load_incident_rows_frame(d) is first
+    sib.update_analytics(row(sib.get_mock_user_data_case2(), "j2"), d)
+    assert len(sib.load_incident_rows_frame(d)) == 2
+
+
+def test_legacy_rows_file_is_migrated(tmp_path):
+    d = str(tmp_path)
+    old = row(sib.get_mock_user_data_case1(), "j1")
+    rollups = {"incidents": 0, "by": {}}
+    sib._apply_row(rollups, old, +1)
+    (tmp_path / "incident_rows.json").write_text(json.dumps({old["key"]: old}))
+    (tmp_path / "rollups.json").write_text(json.dumps(rollups))
+
+    sib.update_analytics(row(sib.get_mock_user_data_case1(), "j2"), d)
+    assert sib.load_rollups(d)["incidents"] == 1
+    assert list(sib.load_incident_rows_frame(d)["job_id"]) == ["j2"]
+    assert not os.path.exists(tmp_path / "incident_rows.json")
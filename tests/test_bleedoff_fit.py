@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import streamlit_incident_builder as sib
+
+T = np.arange(0.0, 1800.0)
+
+
+def test_recovers_exponential_relaxation():
+    fit = sib.fit_bleedoff_decay(T, 20.0 + 5.0 * np.exp(-T / 60.0))
+    # tau comes off a log grid ~15% apart.
+    assert fit["tau_s"] == pytest.approx(60.0, rel=0.1)
+    assert fit["asymptote_mpa"] == pytest.approx(20.0, abs=0.05)
+    assert fit["amplitude_mpa"] == pytest.approx(5.0, abs=0.1)
+    assert fit["leak_rate_mpa_per_min"] < sib.LEAK_RATE_THRESHOLD_MPA_PER_MIN
+    assert fit["r2"] > 0.99
+    assert fit["verdict"] == "compressibility_relaxation"
+
+
+def test_recovers_linear_leak():
+    fit = sib.fit_bleedoff_decay(T, 20.0 - 0.1 * T / 60.0)
+    assert fit["leak_rate_mpa_per_min"] == pytest.approx(0.1, abs=0.002)
+    assert fit["verdict"] == "sustained_leak"
+
+
+def test_flat_window_is_inconclusive():
+    fit = sib.fit_bleedoff_decay(T, np.full_like(T, 14.0))
+    assert fit["asymptote_mpa"] == pytest.approx(14.0)
+    assert fit["r2"] is None
+    assert fit["verdict"] == "inconclusive"
+
+
+def test_batch_matches_single_fits():
+    rng = np.random.default_rng(0)
+    windows = [
+        (T, 20.0 + 5.0 * np.exp(-T / 60.0)),
+        None,
+        (T[:5], T[:5]),
+        (T, 18.0 + 2.0 * np.exp(-T / 300.0) - 0.05 * T / 60.0 + rng.normal(0.0, 0.02, T.size)),
+    ]
+    batch = sib.fit_bleedoff_decay_batch(windows)
+    assert batch[1] is None and batch[2] is None
+    assert batch[0] == sib.fit_bleedoff_decay(*windows[0])
+    assert batch[3] == sib.fit_bleedoff_decay(*windows[3])
+
+
+def test_batches_larger_than_one_chunk():
+    windows = [(T, 20.0 + a * np.exp(-T / 60.0)) for a in np.linspace(1.0, 5.0, sib.DECAY_BATCH + 3)]
+    batch = sib.fit_bleedoff_decay_batch(windows)
+    assert [f["amplitude_mpa"] for f in batch] == pytest.approx([w[1][0] - 20.0 for w in windows], abs=0.1)
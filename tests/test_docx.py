@@ -0,0 +1,67 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+
+import streamlit_incident_builder as sib
+
+AI_RESULT = {
+    "narrative_sections": {
+        "incident_summary": "Summary line.\nSecond line.",
+        "incident_review": "Review.",
+        "overall_cause_analysis": "Analysis.",
+        "conclusion": "Conclusion.\nDRILLOUT DE-BRIEF\nDrilled out.",
+    },
+    "root_cause_blocks": list(sib.ROOT_CAUSE_BLOCK_BUILDERS)[:2],
+    "compressibility_outcome": "plausible",
+}
+
+
+def document_xml(bio) -> bytes:
+    return zipfile.ZipFile(bio).read("word/document.xml")
+
+
+def sequential_build(report_text) -> bytes:
+    # Every section appended in report order, the way the report was built
+    # before the draft / anchor split.
+    from docx import Document
+
+    data = sib.split_report_into_structures(report_text)
+    doc = Document(BytesIO(sib._build_docx_template()))
+    add = lambda style: doc.add_paragraph(style=style)  # noqa: E731
+    sib._docx_header(add, data["header"])
+    sib._docx_section(add, "INCIDENT SUMMARY", data["incident_summary"])
+    sib._docx_section(add, "VOLUME / DEPTH SUMMARY", data["volume_table"], mono=True)
+    sib._docx_section(add, "INCIDENT REVIEW", data["incident_review"])
+    sib._docx_root_causes(add, data["root_causes"])
+    sib._docx_conclusion(add, data["conclusion"])
+    sib._docx_appendix(doc, [], [])
+    bio = BytesIO()
+    doc.save(bio)
+    return document_xml(bio)
+
+
+@pytest.mark.parametrize("mock", [sib.get_mock_user_data_case1, sib.get_mock_user_data_case2])
+def test_draft_matches_sequential_build(mock):
+    ud = mock()
+    text = sib.build_report_text(ud, AI_RESULT)
+    expected = sequential_build(text)
+    assert document_xml(sib.DocxDraft.for_incident(mock()).finish(text)) == expected
+    assert document_xml(sib.build_docx_bytes(text)) == expected
+
+
+def test_empty_narrative_leaves_no_anchor_paragraphs():
+    ai = {"narrative_sections": {"incident_summary": "", "incident_review": "", "conclusion": ""}}
+    text = sib.build_report_text(sib.get_mock_user_data_case1(), ai)
+    xml = document_xml(sib.DocxDraft.for_incident(sib.get_mock_user_data_case1()).finish(text))
+    assert xml == sequential_build(text)
+
+
+def test_changed_header_falls_back_to_full_build():
+    draft = sib.DocxDraft.for_incident(sib.get_mock_user_data_case1())
+    ud = sib.get_mock_user_data_case1()
+    ud["rig"] = "Another Rig 7"
+    text = sib.build_report_text(ud, AI_RESULT)
+    xml = document_xml(draft.finish(text))
+    assert b"Another Rig 7" in xml
+    assert xml == document_xml(sib.build_docx_bytes(text))
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import streamlit_incident_builder as sib
+
+
+def synthetic_job():
+    """
+    1 Hz job: 10 min of cement, a 10 min plug-drop shutdown, displacement at
+    15 MPa with a 60 s stop, a 100 s ramp to a 25 MPa bump, then the pumps
+    stop and pressure relaxes to 20 MPa with a 60 s time constant.
+    """
+    t = np.arange(0.0, 7700.0)
+    q = np.zeros_like(t)
+    q[t < 600] = 1.0
+    q[(t >= 1200) & (t < 4100)] = 1.0
+    q[(t >= 2500) & (t < 2560)] = 0.0
+    p = np.full_like(t, 2.0)
+    p[t < 600] = 10.0
+    p[(t >= 1200) & (t < 4000)] = 15.0
+    ramp = (t >= 4000) & (t < 4100)
+    p[ramp] = 15.0 + 0.1 * (t[ramp] - 4000.0)
+    off = t >= 4100
+    p[off] = 20.0 + 5.0 * np.exp(-(t[off] - 4100.0) / 60.0)
+    return {"time_s": t, "spp_mpa": p, "rate_m3_per_min": q, "volume_m3": np.cumsum(q) / 60.0}
+
+
+def test_detects_displacement_bump_and_bleedoff():
+    ev = sib.detect_cementing_events(synthetic_job())
+    assert ev["displacement_start"]["time_s"] == 1200.0
+    assert ev["displacement_start"]["confidence"] == "high"
+    assert ev["fcp_mpa"]["value"] == pytest.approx(15.0)
+    assert ev["bump_onset"]["time_s"] == 4000.0
+    assert ev["bump_pressure_mpa"] == {"value": 25.0, "time_s": 4100.0, "confidence": "high"}
+    assert ev["bledoff_to_mpa"]["value"] == pytest.approx(20.0, abs=0.2)
+    assert ev["bledoff_to_mpa"]["confidence"] == "high"
+    # 2900 s at 1 m³/min less the 60 s stop.
+    assert ev["displacement_pumped_m3"]["value"] == pytest.approx(2840.0 / 60.0, abs=0.05)
+    [stop] = ev["interruptions"]
+    assert stop["start_s"] == 2499.0 and stop["end_s"] == 2560.0
+
+
+def test_rate_derived_from_volume():
+    series = synthetic_job()
+    del series["rate_m3_per_min"]
+    ev = sib.detect_cementing_events(series)
+    assert ev["bump_pressure_mpa"]["value"] == 25.0
+    assert ev["fcp_mpa"]["value"] == pytest.approx(15.0)
+
+
+def test_no_pumping_gives_no_events():
+    t = np.arange(0.0, 600.0)
+    series = {"time_s": t, "spp_mpa": np.full_like(t, 5.0), "rate_m3_per_min": np.zeros_like(t)}
+    assert sib.detect_cementing_events(series) == {}
+
+
+def test_apply_fills_only_blank_fields():
+    ev = sib.detect_cementing_events(synthetic_job())
+    ud = {"fcp_mpa": 19.0, "bump_pressure_mpa": "", "volume_table": {}}
+    filled = sib.apply_edr_events(ud, ev)
+    assert "fcp_mpa" not in filled and ud["fcp_mpa"] == 19.0
+    assert ud["bump_pressure_mpa"] == 25.0
+    assert ud["volume_table"]["displacement_pumped_m3"] == ud["displacement_pumped_m3"]
+    assert ud["edr_events"] is ev
+
+
+def test_bleedoff_window_starts_at_pump_stop():
+    series = synthetic_job()
+    t, p = sib.extract_bleedoff_window(series, sib.detect_cementing_events(series))
+    assert t[0] == 0.0 and t[-1] == 3599.0
+    assert p[0] == pytest.approx(25.0)
+
+
+@pytest.mark.parametrize("columns", [("Time (s)", "Pump Rate (m3/min)"), ("Time (s)", "Standpipe Pressure (kPa)")])
+def test_export_missing_a_channel_does_not_crash(tmp_path, columns):
+    job = synthetic_job()
+    values = {"Time (s)": job["time_s"], "Pump Rate (m3/min)": job["rate_m3_per_min"],
+              "Standpipe Pressure (kPa)": job["spp_mpa"] * 1000.0}
+    path = tmp_path / "export.csv"
+    rows = zip(*(values[c] for c in columns))
+    path.write_text(",".join(columns) + "\n" + "\n".join(",".join(map(str, r)) for r in rows) + "\n")
+    ud = {}
+    events = sib.attach_edr_export(ud, str(path))
+    if "Pump Rate (m3/min)" in columns:
+        assert events["displacement_start"]["time_s"] == 1200.0
+        assert "fcp_mpa" not in events
+        assert "bump_pressure_mpa" not in events
+    else:
+        assert events == {}
+    assert ud["edr"]
@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+import pytest
+
+import streamlit_incident_builder as sib
+
+G = sib.GRAVITY
+
+
+def vertical_incident(**fluids):
+    ud = sib.get_mock_user_data_case1()
+    ud["volume_table"].update(well_tvd_m=2000.0, float_collar_depth_m=1980.0, shoe_depth_m=2000.0,
+                              airlock_depth_m=None, crossover_depth_m=None, excess_to_surface_m3=None)
+    ud["cement_tail_m3"] = 5.0
+    ud["fluids"] = {
+        "displacement_density_kg_m3": 1000.0,
+        "annulus_density_kg_m3": 1200.0,
+        "lead_density_kg_m3": 1500.0,
+        "tail_density_kg_m3": 1900.0,
+        "cement_top_m": 1000.0,
+        "tail_top_m": 1500.0,
+        **fluids,
+    }
+    return ud
+
+
+def test_vertical_column_matches_hand_calculation():
+    pp = sib.pressure_profile(vertical_incident())
+    # Inside: 1980 m of water. Annulus: 1000 m mud, 500 m lead, 480 m tail.
+    inside = 1000.0 * G * 1980.0 / 1e6
+    annulus = (1200.0 * 1000.0 + 1500.0 * 500.0 + 1900.0 * 480.0) * G / 1e6
+    assert pp["fc_tvd_m"] == 1980.0
+    assert pp["inside_fc_mpa"] == pytest.approx(inside, abs=0.01)
+    assert pp["annulus_fc_mpa"] == pytest.approx(annulus, abs=0.01)
+    assert pp["lift_pressure_mpa"] == pytest.approx(annulus - inside, abs=0.01)
+    assert pp["cement_top_m"] == 1000.0 and pp["tail_top_m"] == 1500.0
+    assert "displacement" not in pp["assumed"]
+
+
+def test_buoyant_section_below_airlock():
+    ud = vertical_incident(buoyant_section_density_kg_m3=0.0)
+    ud["volume_table"]["airlock_depth_m"] = 1200.0
+    pp = sib.pressure_profile(ud)
+    assert pp["inside_fc_mpa"] == pytest.approx(1000.0 * G * 1200.0 / 1e6, abs=0.01)
+
+
+def test_shoe_track_below_float_collar():
+    # 20 m of tail slurry inside the shoe track, with and without a buoyant section.
+    plain = vertical_incident()
+    buoyant = vertical_incident(buoyant_section_density_kg_m3=0.0)
+    buoyant["volume_table"]["airlock_depth_m"] = 1200.0
+    for ud in (plain, buoyant):
+        pp = sib.pressure_profile(ud, keep_profile=True)
+        prof = pp["profile"]
+        inside_shoe = prof["inside_mpa"][list(prof["md_m"]).index(2000.0)]
+        assert inside_shoe == pytest.approx(pp["inside_fc_mpa"] + 1900.0 * G * 20.0 / 1e6, abs=0.01)
+
+
+def test_batch_matches_single_incident():
+    a, b = vertical_incident(), vertical_incident(annulus_density_kg_m3=1100.0)
+    b["survey"] = {"md_m": [0.0, 1000.0, 2000.0], "tvd_m": [0.0, 1000.0, 1900.0]}
+    assert sib.pressure_profiles_batch([a, b, {}]) == [sib.pressure_profile(a), sib.pressure_profile(b), None]
+
+
+def test_minimum_curvature_straight_and_arc():
+    # Straight hole at 30 degrees: TVD = MD cos(30).
+    tvd = sib.minimum_curvature_tvd([0.0, 1000.0], [30.0, 30.0], [45.0, 45.0])
+    assert tvd[-1] == pytest.approx(1000.0 * math.cos(math.radians(30.0)))
+    # Quarter circle of radius 500 m from vertical to horizontal: TVD gain = radius.
+    tvd = sib.minimum_curvature_tvd([0.0, 500.0 * math.pi / 2], [0.0, 90.0], [0.0, 0.0])
+    assert tvd[-1] == pytest.approx(500.0)
+    # Vertical stations: TVD = MD.
+    md = np.linspace(0.0, 3000.0, 31)
+    assert sib.minimum_curvature_tvd(md, np.zeros(31), np.zeros(31)) == pytest.approx(md)
+
+
+def test_hydrostatics_are_opt_in():
+    ud = sib.get_mock_user_data_case1()
+    assert not sib.has_hydrostatics_inputs(ud)
+    assert "Hydrostatics" not in sib.report_volume_text(ud)
+    ud = vertical_incident()
+    assert sib.has_hydrostatics_inputs(ud)
+    ud["pressure"] = sib.pressure_profile(ud)
+    assert "Lift pressure: " in sib.report_volume_text(ud)
@@ -0,0 +1,9 @@
+import incident_headless
+
+
+def test_cold_import_within_budget():
+    # Best of three so one slow start on a loaded machine doesn't fail the run.
+    runs = [incident_headless.measure_cold_import() for _ in range(3)]
+    assert all(eager == [] for _, eager in runs), runs
+    best = min(elapsed for elapsed, _ in runs)
+    assert best <= incident_headless.IMPORT_BUDGET_S, f"cold import {best * 1000:.0f} ms"
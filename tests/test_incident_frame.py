@@ -0,0 +1,29 @@
+import streamlit_incident_builder as sib
+
+
+def test_mock_cases_round_trip():
+    incidents = [sib.get_mock_user_data_case1(), sib.get_mock_user_data_case2()]
+    frame = sib.IncidentFrame.from_user_data(incidents)
+    assert len(frame) == 2
+    assert list(frame.iter_user_data()) == incidents
+
+
+def test_ranges_extras_and_missing_groups_round_trip():
+    ud = sib.get_mock_user_data_case1()
+    ud["fcp_mpa"] = "18-20"
+    ud["edr_events"] = {"bump_pressure_mpa": {"value": 23.0, "time_s": 4100.0, "confidence": "high"}}
+    ud["post_job"]["field_note"] = "not in the schema"
+    partial = sib.get_mock_user_data_case2()
+    partial["fluids"] = {"displacement_density_kg_m3": 1030.0}
+    minimal = {"cir_number": "CIR-1"}
+    incidents = [ud, partial, minimal]
+    frame = sib.IncidentFrame.from_user_data(incidents)
+    assert list(frame.iter_user_data()) == incidents
+    assert frame.lo("fcp_mpa")[0] == 18.0 and frame.hi("fcp_mpa")[0] == 20.0
+
+
+def test_render_matches_render_template():
+    incidents = [sib.get_mock_user_data_case1(), sib.get_mock_user_data_case2()]
+    frame = sib.IncidentFrame.from_user_data(incidents)
+    template = "{cir_number}: {rig}, bump {bump_pressure_mpa} MPa, FC at {volume_table.float_collar_depth_m} m"
+    assert list(frame.render(template)) == [sib.render_template(template, ud) for ud in incidents]
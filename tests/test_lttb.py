@@ -0,0 +1,30 @@
+import numpy as np
+
+import streamlit_incident_builder as sib
+
+
+def test_short_series_unchanged():
+    x, y = np.arange(10.0), np.arange(10.0) ** 2
+    xs, ys = sib.lttb_downsample(x, y, 10)
+    assert (xs == x).all() and (ys == y).all()
+    xs, ys = sib.lttb_downsample(x, y, 2)
+    assert xs.size == 10
+
+
+def test_length_endpoints_and_order():
+    x = np.arange(10000.0)
+    y = np.sin(x / 300.0)
+    xs, ys = sib.lttb_downsample(x, y, 500)
+    assert xs.size == ys.size == 500
+    assert xs[0] == 0.0 and xs[-1] == 9999.0
+    assert (np.diff(xs) > 0).all()
+    assert (ys == np.sin(xs / 300.0)).all()
+
+
+def test_keeps_spikes():
+    x = np.arange(20000.0)
+    y = np.zeros_like(x)
+    y[[1234, 7777, 15001]] = [25.0, -8.0, 12.0]
+    xs, ys = sib.lttb_downsample(x, y, 200)
+    assert {1234.0, 7777.0, 15001.0} <= set(xs)
+    assert ys.max() == 25.0 and ys.min() == -8.0
@@ -0,0 +1,46 @@
+import pytest
+
+import streamlit_incident_builder as sib
+
+
+def test_reproducible_for_the_same_inputs():
+    ud = sib.get_mock_user_data_case1()
+    assert sib.run_uncertainty_analysis(ud) == sib.run_uncertainty_analysis(sib.get_mock_user_data_case1())
+    assert sib.run_uncertainty_analysis(ud, seed=1) != sib.run_uncertainty_analysis(ud, seed=2)
+
+
+def test_mock_case_percentiles():
+    mc = sib.run_uncertainty_analysis(sib.get_mock_user_data_case1(), draws=5000)
+    assert mc["draws"] == 5000
+    for key in ("displacement_delta_m3", "normal_flowback_L", "compression_L", "thermal_L"):
+        assert mc[key]["p5"] <= mc[key]["p50"] <= mc[key]["p95"]
+    # 46.0 m³ pumped against a 43.7 / 45.5 / 47.3 m³ casing.
+    # Aeration only takes a little off the metered volume.
+    assert mc["displacement_delta_m3"]["p50"] == pytest.approx(46.0 - 45.5, abs=0.3)
+    assert 0.0 <= mc["p_under_displaced"] <= 1.0 and 0.0 <= mc["p_over_displaced"] <= 1.0
+    # "≈1.1 m³ and continued to flow"
+    assert mc["observed_flowback_L"] == 1100.0 and mc["flowback_still_flowing"]
+    assert mc["p_flowback_exceeds_normal"] is not None
+
+
+def test_flowback_components():
+    mc = sib.run_uncertainty_analysis(sib.get_mock_user_data_case1())
+    n, c, t = mc["normal_flowback_L"], mc["compression_L"], mc["thermal_L"]
+    assert c["p50"] < n["p50"] and t["p50"] < n["p50"]
+    assert n["p50"] <= c["p95"] + t["p95"]
+
+
+def test_casing_tolerance_when_min_max_missing():
+    ud = sib.get_mock_user_data_case1()
+    ud["volume_table"].update(casing_vol_min_m3=None, casing_vol_max_m3=None)
+    assert sib.run_uncertainty_analysis(ud) is not None
+
+
+def test_needs_displacement_casing_volume_and_bump():
+    for key in ("displacement_pumped_m3", "bump_pressure_mpa"):
+        ud = sib.get_mock_user_data_case1()
+        ud[key] = None
+        assert sib.run_uncertainty_analysis(ud) is None
+    ud = sib.get_mock_user_data_case1()
+    ud["volume_table"]["casing_vol_nominal_m3"] = None
+    assert sib.run_uncertainty_analysis(ud) is None
@@ -0,0 +1,26 @@
+import json
+import os
+
+from PIL import Image
+
+import streamlit_incident_builder as sib
+
+
+def test_group_picks_up_every_uploadable_image_type(tmp_path):
+    json.dump(sib.get_mock_user_data_case1(), open(tmp_path / "CIR-1_incident.json", "w"))
+    for ext in sib.IMAGE_UPLOAD_TYPES:
+        Image.new("RGB", (8, 8), "red").save(tmp_path / f"CIR-1_photo.{ext}")
+    _, images = sib.load_watch_group([str(p) for p in tmp_path.iterdir()])
+    assert sorted(os.path.splitext(i["filename"])[1][1:] for i in images) == sorted(sib.IMAGE_UPLOAD_TYPES)
+
+
+def test_malformed_group_is_rejected_not_raised(tmp_path):
+    watch = tmp_path / "drop"
+    (watch / "CIR-1").mkdir(parents=True)
+    json.dump({"cir_number": "CIR-1", "volume_table": "not a table"}, open(watch / "CIR-1" / "incident.json", "w"))
+    (watch / "CIR-1" / "edr.csv").write_text("Time (s),Pump Rate (m3/min)\n0,0\n1,1\n2,1\n3,0\n")
+    ing = sib.WatchFolderIngestor(str(watch), None, "k", "m", debounce_s=0.0,
+                                  state_path=str(tmp_path / "state.json"))
+    # Filling volume_table from the EDR events raises TypeError, not OSError / ValueError.
+    assert ing._ingest("CIR-1", ing.scan()["CIR-1"]) == "rejected"
+    assert ing.state()["CIR-1"]["error"].startswith("TypeError")